@@ -1,5 +1,7 @@
-import pandas as pd
 import numpy as np
+import reservoir_kernels as kernels
+from year_index import YearIndex
+import instrumentation
 
 # CONSTANTS: to calculate hydropower
 eta = 0.8 # efficiency of turbines, assumed value
@@ -8,7 +10,10 @@ g = 9.81 # gravitational acceleration, 9.81 m/s^2
 
 class Reservoir:
 
-    def __init__(self, SA, capacity, tail_elev, pool_elev, bottom_elev, fish_pass, pc, spillway_cap, alfa, beta):
+    backend = kernels.BACKEND # 'numba' runs the compiled time-step kernels, 'python' the loops below
+
+    def __init__(self, SA, capacity, tail_elev, pool_elev, bottom_elev, fish_pass, pc, spillway_cap, alfa, beta, power_table=None,
+                 geometry=None):
         self.SA = SA # reservoir surface area (sq m)
         self.capacity = capacity # generation capacity (kW)
         self.tail_elev = tail_elev*0.3046 # tailwater elevation (ft -> m)
@@ -17,20 +22,46 @@ class Reservoir:
         self.fish_pass = fish_pass # fish passage rate
         self.pc = pc # powerhouse capacity (cfs)
         self.spillway_cap = spillway_cap*0.3046**3 # spillway capacity (cfs -> m^3/s)
-        self.max_storage = self.SA * (self.pool_elev - self.bottom_elev) #m^3
         self.alfa = alfa
         self.beta = beta
+        self.power_table = power_table # optional power_table.PowerTable, replaces the constant efficiency eta
+        self.set_geometry(geometry)
     
     def set_params(self, alfa, beta):
         self.alfa = alfa
         self.beta = beta
+
+    def set_power_table(self, power_table):
+        self.power_table = power_table
+
+    def set_geometry(self, geometry):
+        # geometry: stage_storage.StageStorage elevation-storage curve, or None for a prism of surface area SA
+        self.geometry = geometry
+        if geometry is None:
+            self.max_storage = self.SA * (self.pool_elev - self.bottom_elev) #m^3
+            self.curves, self.curve_meta = np.zeros((2, 2)), np.zeros(5) # prism, see reservoir_kernels._level
+        else:
+            self.max_storage = float(geometry.storage(self.pool_elev)) #m^3
+            self.curves, self.curve_meta = geometry.kernel_arrays()
+
+    def level(self, s):
+        # Water level (m) of storage s (m^3), scalar or array
+        if self.geometry is None:
+            return s / self.SA + self.bottom_elev
+        return self.geometry.level(s)
+
+    def storage(self, h):
+        # Storage (m^3) at water level h (m), scalar or array
+        if self.geometry is None:
+            return self.SA * (h - self.bottom_elev)
+        return self.geometry.storage(h)
     
     def simulate_fish_passage(self, keep):
         if keep == 0: # remove dam
             return 1
         return self.fish_pass
     
-    def simulation_nat_lake(self, keep, h_in, n):
+    def simulation_nat_lake(self, keep, h_in, n, delta=60 * 60 * 24):
         """
         Simulate natural lake level, storage, and release trajectories.
         
@@ -38,6 +69,7 @@ class Reservoir:
         - param (dict): Parameters for natural lake model with keys 'beta', 'alfa'
         - h_in (float): Initial lake level
         - n (array-like): Net inflows trajectory
+        - delta (int): Step of integration [s], 3600 for hourly inflows
         
         Returns:
         - tuple: (lake storage trajectory, lake level trajectory, release trajectory)
@@ -49,12 +81,14 @@ class Reservoir:
         h0 = self.tail_elev    # Reference lake level [m]
         h_bottom = self.bottom_elev
         
-        # Step of integration and simulation horizon
-        H = len(n) - 1             # Simulation horizon [day]
-        delta = 60 * 60 * 24       # Step of integration [s/day]
+        # Simulation horizon
+        H = len(n) - 1             # Simulation horizon [steps]
 
         if keep == 0:
             return np.zeros(len(n)), np.full(len(n), h0), n
+
+        if self.backend != 'python':
+            return kernels.nat_lake(h_in, np.asarray(n, dtype=float), S, h_bottom, h0, alfa, beta, delta, self.curves, self.curve_meta)
         
         # Initialize variables for trajectories
         h = np.full(len(n), np.nan)  # Lake level [m]
@@ -63,7 +97,7 @@ class Reservoir:
 
         # Set initial conditions
         h[0] = h_in
-        s[0] = S * (h_in - h_bottom)  # Initial storage
+        s[0] = self.storage(h_in)  # Initial storage
 
         # Simulation loop
         for i in range(H):
@@ -72,10 +106,68 @@ class Reservoir:
             # Update storage with balance equation
             s[i + 1] = s[i] + (n[i + 1] - r[i + 1]) * delta
             # Update lake level
-            h[i + 1] = s[i + 1] / S + h_bottom
+            h[i + 1] = self.level(s[i + 1])
         
         return s, h, r
-    
+
+    def simulation_nat_lake_batch(self, keep, alfa, beta, h_in, n, delta=60 * 60 * 24):
+        """
+        Simulate natural lake trajectories for a whole batch of storage-discharge parameters at once.
+        Gives the trajectories of calling set_params and simulation_nat_lake once per candidate, to the
+        last bit of np.power on the python backend (see simulation_reg_lake_batch), and leaves self.alfa
+        and self.beta unchanged.
+
+        Parameters:
+        - keep (int): 1 if dam is kept, 0 if removed
+        - alfa (array-like): Storage-discharge exponent for each candidate, shape (P,)
+        - beta (array-like): Storage-discharge coefficient for each candidate, shape (P,)
+        - h_in (float or array-like): Initial lake level, scalar or shape (P,)
+        - n (array-like): Net inflows trajectory, shape (T,) shared by all candidates or (P, T)
+        - delta (int): Integration step [s], 3600 for hourly inflows
+
+        Returns:
+        - tuple: (lake storage, lake level, release) trajectories, each of shape (P, T)
+        """
+        # Lake model parameters
+        S = self.SA  # Lake surface area [m^2]
+        h_bottom = self.bottom_elev
+        h0 = self.tail_elev
+
+        alfa, beta, h_in = np.broadcast_arrays(*(np.atleast_1d(np.asarray(x, dtype=float)) for x in (alfa, beta, h_in)))
+        P = alfa.shape[0]                       # Number of candidates
+        n = np.asarray(n, dtype=float)
+        T = n.shape[-1]
+
+        if keep == 0:
+            return np.zeros((P, T)), np.full((P, T), h0), np.array(np.broadcast_to(n, (P, T)))
+
+        if self.backend != 'python':
+            return kernels.nat_lake_batch(np.ascontiguousarray(h_in), np.ascontiguousarray(np.atleast_2d(n)), S, h_bottom, h0,
+                                          np.ascontiguousarray(alfa), np.ascontiguousarray(beta), delta, self.curves, self.curve_meta)
+
+        # Work time-major (T, P) so every step reads and writes contiguous rows
+        n_t = n[:, None] if n.ndim == 1 else np.ascontiguousarray(n.T)
+        h = np.full((T, P), np.nan)  # Lake level [m]
+        s = np.full((T, P), np.nan)  # Lake storage [m^3]
+        r = np.full((T, P), np.nan)  # Lake release [m^3/s]
+
+        # Initial conditions
+        h[0] = h_in
+        s[0] = self.storage(h_in)
+
+        # Simulation loop, all candidates advance together
+        for i in range(T - 1):
+            above = h[i] > h0
+            release = np.zeros(P)
+            release[above] = beta[above] * np.power(h[i, above] - h0, alfa[above])
+            # Same as the scalar min(release, cap): a NaN cap keeps the release
+            cap = s[i]/delta + n_t[i]
+            r[i + 1] = np.where(cap < release, cap, release)
+            s[i + 1] = s[i] + (n_t[i + 1] - r[i + 1]) * delta
+            h[i + 1] = self.level(s[i + 1])
+
+        return s.T, h.T, r.T
+
     def regulated_release(self, param, h):
         # Full implementation of regulated_release
         """
@@ -111,7 +203,7 @@ class Reservoir:
         
         return r
     
-    def simulation_reg_lake(self, keep, param, h_in, n):
+    def simulation_reg_lake(self, keep, param, h_in, n, delta=60 * 60 * 24):
         # Full implementation of simulation_reg_lake
         """
         Simulate regulated lake level, storage, and release trajectories.
@@ -120,6 +212,7 @@ class Reservoir:
         - param (dict): Parameters with lake surface and model settings
         - h_in (float): Initial lake level
         - n (array-like): Net inflows trajectory
+        - delta (int): Integration step [s], 3600 for hourly inflows
 
         Returns:
         - tuple: (lake storage trajectory, lake level trajectory, release trajectory)
@@ -129,13 +222,16 @@ class Reservoir:
         h_bottom = self.bottom_elev
         h0 = self.tail_elev
 
-        # Integration step and simulation horizon
-        H = len(n) - 1              # Simulation horizon [days]
-        delta = 60 * 60 * 24        # Integration step [s/day]
+        # Simulation horizon
+        H = len(n) - 1              # Simulation horizon [steps]
 
         if keep == 0:
             return np.zeros(len(n)), np.full(len(n), h0), n
 
+        if self.backend != 'python':
+            return kernels.reg_lake(h_in, np.asarray(n, dtype=float), S, h_bottom, h0, self.alfa, self.beta,
+                                    param['mef'], param['h1'], param['m'], self.max_storage, delta, self.curves, self.curve_meta)
+
         # Initialize variables for trajectories
         h = np.full(len(n), np.nan)  # Lake level [m]
         s = np.full(len(n), np.nan)  # Lake storage [m^3]
@@ -143,7 +239,7 @@ class Reservoir:
 
         # Initial conditions
         h[0] = h_in
-        s[0] = S * (h_in - h_bottom)  # Initial storage
+        s[0] = self.storage(h_in)  # Initial storage
 
         # Simulation loop
         for i in range(H):
@@ -155,22 +251,112 @@ class Reservoir:
             if raw_storage > self.max_storage:
                 r[i + 1] = r[i + 1] + (raw_storage - self.max_storage) / delta # Recalculate release if storage was capped
             # Compute new lake level
-            h[i + 1] = s[i + 1] / S + h_bottom
+            h[i + 1] = self.level(s[i + 1])
 
         return s, h, r
 
+    def simulation_reg_lake_batch(self, keep, mef, h1, m, h_in, n, delta=60 * 60 * 24):
+        """
+        Simulate regulated lake trajectories for a whole population of release parameters at once.
+        Gives the trajectories of simulation_reg_lake for each candidate, bit for bit on the compiled
+        backend. The python backend raises the whole batch to alfa with np.power, which may round the
+        last bit differently from the scalar **, so it agrees to about 1e-14 relative. Candidates whose
+        release swings from step to step (m * delta above about twice the surface area) amplify such
+        differences, and over a long record their trajectories can drift further apart.
+
+        Parameters:
+        - keep (int or array-like): 1 if dam is kept, 0 if removed, scalar or shape (P,)
+        - mef (array-like): Minimum environmental flow for each candidate, shape (P,)
+        - h1 (array-like): Level above which release increases for each candidate, shape (P,)
+        - m (array-like): Slope of release above h1 for each candidate, shape (P,)
+        - h_in (float or array-like): Initial lake level, scalar or shape (P,)
+        - n (array-like): Net inflows trajectory, shape (T,) shared by all candidates or (P, T)
+        - delta (int): Integration step [s], 3600 for hourly inflows
+
+        Returns:
+        - tuple: (lake storage, lake level, release) trajectories, each of shape (P, T)
+        """
+        # Lake model parameters
+        S = self.SA  # Lake surface area [m^2]
+        h_bottom = self.bottom_elev
+        h0 = self.tail_elev
+
+        mef, h1, m, h_in = np.broadcast_arrays(*(np.atleast_1d(np.asarray(x, dtype=float)) for x in (mef, h1, m, h_in)))
+        P = mef.shape[0]                        # Population size
+        kept = np.broadcast_to(np.asarray(keep) != 0, (P,))
+
+        # Work time-major (T, P) so every step reads and writes contiguous rows
+        n = np.asarray(n, dtype=float)
+        n_t = n[:, None] if n.ndim == 1 else np.ascontiguousarray(n.T)
+        T = n_t.shape[0]
+
+        # Simulation horizon
+        H = T - 1                   # Simulation horizon [steps]
+
+        # Removed dams pass inflow straight through
+        h = np.full((T, P), h0)  # Lake level [m]
+        s = np.zeros((T, P))     # Lake storage [m^3]
+        r = np.array(np.broadcast_to(n_t, (T, P)))  # Lake outflows [m^3/s]
+
+        idx = np.flatnonzero(kept)
+        if idx.size and self.backend != 'python':
+            nk = n_t.T if n_t.shape[1] == 1 else n_t[:, idx].T
+            sk, hk, rk = kernels.reg_lake_batch(h_in[idx], np.ascontiguousarray(nk), S, h_bottom, h0, self.alfa, self.beta,
+                                                mef[idx], h1[idx], m[idx], self.max_storage, delta, self.curves, self.curve_meta)
+            h[:, idx] = hk.T
+            s[:, idx] = sk.T
+            r[:, idx] = rk.T
+        elif idx.size:
+            mef, h1, m = mef[idx], h1[idx], m[idx]
+            beta = self.beta
+            alfa = self.alfa
+            nk = n_t if n_t.shape[1] == 1 else n_t[:, idx]
+            hk = np.full((T, idx.size), np.nan)
+            sk = np.full((T, idx.size), np.nan)
+            rk = np.full((T, idx.size), np.nan)
+
+            # Initial conditions
+            hk[0] = h_in[idx]
+            sk[0] = self.storage(hk[0])
+
+            # Simulation loop, all candidates advance together
+            for i in range(H):
+                # Regulated release, same steps as regulated_release: a NaN level gives a NaN release
+                above = hk[i] > h0
+                release = np.where(hk[i] <= h0, 0, np.maximum(mef + m * (hk[i] - h1), mef))
+                natural_flow = np.zeros(idx.size)
+                natural_flow[above] = beta * np.power(hk[i, above] - h0, alfa)
+                release = np.maximum(np.minimum(natural_flow, release), 0)
+                # Clip to ensure no negative storage, same as the scalar min(release, cap): a NaN cap keeps the release
+                cap = sk[i]/delta + nk[i]
+                rk[i + 1] = np.where(cap < release, cap, release)
+                raw_storage = sk[i] + (nk[i + 1] - rk[i + 1]) * delta
+                sk[i + 1] = np.minimum(raw_storage, self.max_storage)
+                spill = raw_storage > self.max_storage
+                rk[i + 1, spill] += (raw_storage[spill] - self.max_storage) / delta  # Recalculate release if storage was capped
+                hk[i + 1] = self.level(sk[i + 1])
+
+            h[:, idx] = hk
+            s[:, idx] = sk
+            r[:, idx] = rk
+
+        return s.T, h.T, r.T
+
 
     def simulate_head(self, height):
         head = height - self.tail_elev #m
         return head #m
     
-    def simulate_hydropower(self, head, flow, keep):
+    def simulate_hydropower(self, head, flow, keep, hours=24):
         # flow from function: m^3/s
         # pc given in cfs
+        # hours: length of a time step, 24 for daily flows, 1 for hourly
         inflow = np.minimum(flow, self.pc * .0283) #m^3/s
 
         if keep == 0: # no dam
             P = 0
+        elif self.power_table is not None: # head, flow and unit loading from the efficiency table, capped at pc and capacity
+            P = self.power_table.power(head, flow) #kW
         elif keep == 1: #yes dam
             #rho: kg/m^3
             #g: m/s^2
@@ -181,11 +367,15 @@ class Reservoir:
             P = np.maximum(P, 0) # non-negativity constraint
             P = np.minimum(P/1000, self.capacity) # maximum power output is less than rated capacity of turbine, (converted to kW)
         
-        energy = P * 24 # kW multiplied by hours in a day to get kWh
+        energy = P * hours # kW multiplied by hours in a step to get kWh
 
         return energy
 
     def calc_avg_annual_hydro(self, date, hydro):
+        # date is the date array or a YearIndex built from it once, which skips the groupby
+        if isinstance(date, YearIndex):
+            return date.sum(hydro).mean()
+        import pandas as pd # only needed here, kept out of the module import for worker processes
         data = pd.DataFrame({'date':date, 'hydro':hydro})
         annual_hydro = data.groupby(data['date'].dt.year)['hydro'].sum()
         avg_annual_hydro = annual_hydro.mean()
@@ -195,7 +385,7 @@ class Reservoir:
         '''
         Inputs:
         - keep: if dam is kept, has value of 1. If dam is removed, has value of 0. 
-        - datetime: array of datetime values for each datapoint
+        - datetime: array of datetime values for each datapoint, or a YearIndex built from it
         - outflow: array of reservoir outflow values (cfs)
         - dstorage: array of reservoir change in storage values (cfs)
         Return Dataframe containing reservoir simulation data.
@@ -206,6 +396,14 @@ class Reservoir:
         #fish_passage = self.simulate_fish_passage(keep)
         #outflow = self.simulate_outflow(prev_out, tributary, dstorage) #inputs m^3/day,cfs; outputs m^3/day
 
+        prof = instrumentation.active
+        if prof is not None: # same steps, timed per stage
+            storage, height, outflow = prof.call(self, 'simulation_reg_lake', self.simulation_reg_lake, keep, param, initial_height, prev_out + tributary)
+            head = prof.call(self, 'simulate_head', self.simulate_head, height)
+            hydro = prof.call(self, 'simulate_hydropower', self.simulate_hydropower, head, outflow, keep)
+            avg_hydro = prof.call(self, 'calc_avg_annual_hydro', self.calc_avg_annual_hydro, datetime, hydro)
+            return outflow, avg_hydro, height
+
         storage, height, outflow = self.simulation_reg_lake(keep, param, initial_height, prev_out + tributary)
         head = self.simulate_head(height) #inputs m^3, outputs m
         hydro = self.simulate_hydropower(head, outflow, keep) #inputs m and m^3/day, outputs kWh
@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+import snake_river
+
+# Headless runs of the four-dam cascade from a config file, for production runs outside the notebooks.
+#   python batch_run.py config.json                 run every job of the config
+#   python batch_run.py config.json --job base      only the named jobs
+#
+# Only numpy and the model modules are imported up front. pandas, platypus and the sweep and
+# optimization modules are imported by the jobs that use them, so a process that only simulates
+# (or a spawned worker importing this module) starts quickly.
+#
+# Config (JSON, or TOML when the file ends in .toml):
+# {
+#   "output_dir": "runs/base",                     results go here, one set of files per job
+#   "data_dir": null,                              folder with the streamflow CSVs, default the repository's
+#   "start": "1993-01-01", "end": null,            simulated record
+#   "year_start_month": 1,                         10 for water years
+#   "steps_per_day": 1,                            24 for hourly runs, see subdaily.subdaily_cascade
+#   "fish_passage": {"species": "Chinook"},        optional fish survival objective: FishPassage arguments,
+#                                                  "species" sets passage to fish_passage.dam_conversion
+#   "reservoirs": {"LGR": {"alfa": 2.46, "beta": 4.77}},   e.g. calibration.calibrate results
+#   "jobs": [
+#     {"name": "base", "type": "simulate", "variables": [16 values, or a list of vectors]},
+#     {"name": "grid", "type": "sweep", "params": [[12 values], ...], "combos": null, "processes": null},
+#     {"name": "nsga", "type": "optimize", "population_size": 50, "evaluations": 10000, "seed": 1,
+#      "processes": null, "checkpoint": "nsga.npz", "checkpoint_frequency": 1000, "cache": null, "store": false}
+#   ]
+# }
+
+def load_config(path):
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+def build_cascade(config):
+    # RiverCascade of the config: observed record, reservoir overrides and time step
+    from streamflow_store import open_store, DATA_DIR
+    store = open_store(config.get('data_dir') or DATA_DIR)
+    fish = None
+    if config.get('fish_passage') is not None:
+        import fish_passage
+        kwargs = dict(config['fish_passage'])
+        if 'species' in kwargs:
+            kwargs['passage'] = fish_passage.dam_conversion(kwargs.pop('species'), snake_river.NAMES)
+        fish = fish_passage.FishPassage(**kwargs)
+    cascade = snake_river.make_cascade(store, config.get('start', snake_river.POST_CUTOFF), config.get('end'),
+                                       year_start_month=config.get('year_start_month', 1), fish_passage=fish)
+    for name, values in config.get('reservoirs', {}).items():
+        reservoir = cascade.reservoirs[cascade.names.index(name)]
+        unknown = set(values) - {'alfa', 'beta'}
+        if unknown:
+            raise ValueError('reservoir %s: only alfa and beta can be set, not %s' % (name, ', '.join(sorted(unknown))))
+        reservoir.set_params(values.get('alfa', reservoir.alfa), values.get('beta', reservoir.beta))
+    if config.get('steps_per_day', 1) != 1:
+        import subdaily
+        cascade = subdaily.subdaily_cascade(cascade, config['steps_per_day'])
+    return cascade
+
+def run_simulate(cascade, job, prefix):
+    '''
+    Simulate decision vectors laid out like DamOptimization.
+    Writes <prefix>_summary.csv (variables and objectives of every vector, fish_survival with a fish passage
+    model) and <prefix>_trajectories.npz (outflow, height and hydro of shape (N, D, T), and the dates).
+    '''
+    variables = np.atleast_2d(np.asarray(job['variables'], dtype=float))
+    D = len(cascade.reservoirs)
+    results = [cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:4*D]) for v in variables]
+    below = np.array([cascade.years_below_min(r.outflow) for r in results])
+    hydro = np.array([r.avg_hydro for r in results])
+    fish = np.zeros((len(results), 0))
+    if cascade.fish_passage is not None:
+        fish = np.array([[cascade.fish_survival(r, v[3*D:4*D])] for r, v in zip(results, variables)])
+    np.savez_compressed(prefix + '_trajectories.npz', dates=cascade.dates.values.astype('datetime64[s]'),
+                        outflow=np.array([r.outflow for r in results]), height=np.array([r.height for r in results]),
+                        hydro=np.array([r.hydro for r in results]))
+    columns = ['%s_%s' % (var, name) for var in ('mef', 'h1', 'm', 'keep') for name in cascade.names]
+    columns += ['below_min_' + name for name in cascade.names] + ['avg_hydro_' + name for name in cascade.names]
+    columns += ['num_below_min', 'total_hydro'] + ['fish_survival'] * fish.shape[1]
+    table = np.hstack([variables, below, hydro, below.sum(axis=1, keepdims=True), hydro.sum(axis=1, keepdims=True), fish])
+    np.savetxt(prefix + '_summary.csv', table, delimiter=',', header=','.join(columns), comments='', fmt='%.15g')
+    return {'vectors': len(variables)}
+
+def run_sweep(cascade, job, prefix):
+    # scenario_sweep.sweep_scenarios, written to <prefix>_sweep.csv
+    import scenario_sweep
+    table = scenario_sweep.sweep_scenarios(cascade, job['params'], job.get('combos'), job.get('processes'))
+    table.to_csv(prefix + '_sweep.csv', index=False)
+    return {'scenarios': len(table)}
+
+def run_optimize(cascade, job, prefix):
+    '''
+    NSGA-II on DamOptimization with the notebook's operators (SBX and PM on every variable).
+    Optional: a process pool ("processes" other than 1), a persistent evaluation cache ("cache": path),
+    and checkpoints ("checkpoint": path) that resume the run when it is started again.
+    Writes the nondominated solutions to <prefix>_front.csv, and with "store" also their trajectories
+    to the result store <prefix>_store (see result_store).
+    '''
+    import random
+    from platypus import NSGAII, SBX, PM, CompoundOperator, nondominated
+    from dam_optimization import DamOptimization, ParallelEvaluator, decode_variables
+    random.seed(job.get('seed'))
+    problem = DamOptimization(cascade)
+    evaluator = None
+    if job.get('processes', 1) != 1:
+        evaluator = ParallelEvaluator(cascade, job.get('processes'))
+    if job.get('cache'):
+        from evaluation_cache import EvaluationCache, CachedEvaluator
+        evaluator = CachedEvaluator(EvaluationCache(job['cache']), cascade, evaluator)
+    variator = CompoundOperator(*[op for _ in range(problem.nvars) for op in (SBX(), PM())])
+    kwargs = {} if evaluator is None else {'evaluator': evaluator}
+    algorithm = NSGAII(problem, population_size=job.get('population_size', 50), variator=variator, **kwargs)
+    try:
+        if job.get('checkpoint'):
+            from checkpoint import run_with_checkpoints
+            run_with_checkpoints(algorithm, job['evaluations'], job['checkpoint'], job.get('checkpoint_frequency', 1000))
+        else:
+            algorithm.run(job['evaluations'])
+    finally:
+        if evaluator is not None:
+            evaluator.close()
+    front = nondominated(algorithm.result)
+    variables = decode_variables(front)
+    objectives = np.array([s.objectives[:] for s in front], dtype=float)
+    columns = ['%s_%s' % (var, name) for var in ('mef', 'h1', 'm', 'keep') for name in cascade.names]
+    table = np.hstack([variables, objectives[:, :1], -objectives[:, 1:]])
+    columns += ['num_below_min', 'total_hydro', 'fish_survival'][:problem.nobjs]
+    np.savetxt(prefix + '_front.csv', table, delimiter=',', header=','.join(columns), comments='', fmt='%.15g')
+    if job.get('store'):
+        from result_store import save_solutions
+        save_solutions(prefix + '_store', cascade, front)
+    return {'evaluations': algorithm.nfe, 'front': len(front)}
+
+JOBS = {'simulate': run_simulate, 'sweep': run_sweep, 'optimize': run_optimize}
+
+def run(config, names=None):
+    '''
+    Run the jobs of a config (all of them, or those in names) and write their results to output_dir.
+    Returns dict of job name -> summary of the run, also written to output_dir/runs.json.
+    '''
+    jobs = [job for job in config['jobs'] if names is None or job['name'] in names]
+    for job in jobs:
+        if job.get('type') not in JOBS:
+            raise ValueError('job %s: type must be one of %s' % (job.get('name'), ', '.join(JOBS)))
+    output_dir = config.get('output_dir', '.')
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'config.json'), 'w') as f:
+        json.dump(config, f, indent=1, default=str)
+
+    start = time.perf_counter()
+    cascade = build_cascade(config)
+    print('cascade built in %.2f s' % (time.perf_counter() - start))
+    summary = {}
+    for job in jobs:
+        start = time.perf_counter()
+        summary[job['name']] = JOBS[job['type']](cascade, job, os.path.join(output_dir, job['name']))
+        summary[job['name']]['seconds'] = time.perf_counter() - start
+        print('%s (%s): %s' % (job['name'], job['type'], summary[job['name']]))
+    with open(os.path.join(output_dir, 'runs.json'), 'w') as f:
+        json.dump(summary, f, indent=1)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run cascade simulation, sweep and optimization jobs from a config file')
+    parser.add_argument('config', help='JSON or TOML config file')
+    parser.add_argument('--job', nargs='+', help='only run the jobs with these names')
+    parser.add_argument('--output-dir', help='override the output_dir of the config')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.output_dir:
+        config['output_dir'] = args.output_dir
+    run(config, args.job)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
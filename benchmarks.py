@@ -0,0 +1,166 @@
+import argparse
+import copy
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from platypus import NSGAII, SBX, PM, CompoundOperator
+import snake_river
+from river_cascade import RiverCascade
+from dam_optimization import DamOptimization
+from year_index import YearIndex
+from power_table import typical_kaplan_table
+
+# Benchmarks of the reservoir and cascade hot paths.
+#   python benchmarks.py                          run on the 1993+ record and a 100-year synthetic record
+#   python benchmarks.py --years 0 1000           0 is the observed record, other values are synthetic years
+#   python benchmarks.py --save-baseline base.json
+#   python benchmarks.py --compare base.json      exit code 1 if any case lost more than --tolerance of its throughput
+
+PARAM = {'mef': 50000*(0.3046**3), 'h1': 710*0.3046, 'm': 1000} # LGR settings from the notebook
+VARIABLES = [41.54, 235.6, 32.12, 218.45, 201.6, 178.36, 167, 136, 2923, 1782, 2406, 3001, 1, 1, 1, 1]
+
+def synthetic_record(cascade, years, seed=0):
+    '''
+    Synthetic record made of whole calendar years drawn at random from the observed cascade inputs.
+    Each synthetic year is drawn from observed years of the same length, so leap days line up.
+    Returns (dates, inflow, tributaries) starting on 1000-01-01, so 1,000 years fit in datetime64[s].
+    '''
+    rng = np.random.default_rng(seed)
+    observed = cascade.years
+    dates = np.arange(np.datetime64('1000-01-01'), np.datetime64('%04d-01-01' % (1000 + years)))
+    synthetic = YearIndex(dates.astype('datetime64[s]'))
+    pieces = []
+    for length in synthetic.counts:
+        y = rng.choice(np.flatnonzero(observed.counts == length))
+        pieces.append(np.arange(observed.offsets[y], observed.offsets[y] + length))
+    order = np.concatenate(pieces)
+    return dates.astype('datetime64[s]'), cascade.inflow[order], cascade.tributaries[:, order]
+
+def records(years_list):
+    # (label, cascade) of each requested record length
+    observed = snake_river.make_cascade()
+    for years in years_list:
+        if years == 0:
+            yield 'observed %dy' % len(observed.years), observed
+        else:
+            dates, inflow, tributaries = synthetic_record(observed, years)
+            yield 'synthetic %dy' % years, RiverCascade(observed.names, observed.reservoirs, observed.initial_heights,
+                                                        inflow, tributaries, dates, observed.hist_min)
+
+def cases(cascade, population_size):
+    # name -> (function, simulated dam-days per call)
+    lgr = cascade.reservoirs[0]
+    n = cascade.inflow + cascade.tributaries[0]
+    T = len(n)
+    h_in = cascade.initial_heights[0]
+    levels = np.linspace(lgr.tail_elev, lgr.pool_elev, T)
+    _, height, outflow = lgr.simulation_reg_lake(1, PARAM, h_in, n)
+    hydro = lgr.simulate_hydropower(lgr.simulate_head(height), outflow, 1)
+    lgr_table = copy.copy(lgr)
+    lgr_table.set_power_table(typical_kaplan_table(lgr))
+    dates = pd.Series(cascade.dates)
+    years = YearIndex(cascade.dates)
+    D = len(cascade.reservoirs)
+    v = np.asarray(VARIABLES, dtype=float)
+
+    # Same setup as the notebook. The warm-up call of measure evaluates the initial population,
+    # so the timed steps are whole generations
+    variator = CompoundOperator(*[op for _ in range(16) for op in (SBX(), PM())])
+    algorithm = NSGAII(DamOptimization(cascade), population_size=population_size, variator=variator)
+
+    return {
+        'simulation_reg_lake': (lambda: lgr.simulation_reg_lake(1, PARAM, h_in, n), T),
+        'simulation_nat_lake': (lambda: lgr.simulation_nat_lake(1, h_in, n), T),
+        'regulated_release': (lambda: lgr.regulated_release(PARAM, levels), T),
+        'simulate_hydropower': (lambda: lgr.simulate_hydropower(lgr.simulate_head(height), outflow, 1), T),
+        'simulate_hydropower table': (lambda: lgr_table.simulate_hydropower(lgr.simulate_head(height), outflow, 1), T),
+        'calc_avg_annual_hydro': (lambda: lgr.calc_avg_annual_hydro(dates, hydro), T),
+        'calc_avg_annual_hydro YearIndex': (lambda: lgr.calc_avg_annual_hydro(years, hydro), T),
+        'cascade simulate': (lambda: cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:]), D * T),
+        'cascade evaluate': (lambda: cascade.evaluate(v), D * T),
+        'NSGA-II generation': (algorithm.step, population_size * D * T),
+    }
+
+def measure(fn, min_time=0.2, min_repeats=3):
+    # Best wall time over repeated calls, then peak traced memory of one more call
+    fn() # warm up, e.g. Numba compilation
+    best = np.inf
+    total = 0.0
+    repeats = 0
+    while repeats < min_repeats or total < min_time:
+        t = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t
+        best = min(best, elapsed)
+        total += elapsed
+        repeats += 1
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def run(years_list, population_size=50, select=None, min_time=0.2):
+    '''
+    Run every benchmark case on every record.
+    Returns dict of 'case | record' -> {'seconds', 'dam_days_per_s', 'peak_mb'}.
+    '''
+    results = {}
+    for label, cascade in records(years_list):
+        for name, (fn, dam_days) in cases(cascade, population_size).items():
+            if select and not any(s in name for s in select):
+                continue
+            seconds, peak = measure(fn, min_time)
+            results[name + ' | ' + label] = {'seconds': seconds, 'dam_days_per_s': dam_days / seconds, 'peak_mb': peak / 2**20}
+    return results
+
+def compare(results, baseline, tolerance):
+    # Cases whose throughput dropped by more than tolerance against the baseline
+    regressions = []
+    for key, r in results.items():
+        if key in baseline:
+            ratio = r['dam_days_per_s'] / baseline[key]['dam_days_per_s']
+            r['vs_baseline'] = ratio
+            if ratio < 1 - tolerance:
+                regressions.append(key)
+    return regressions
+
+def report(results):
+    width = max(len(k) for k in results)
+    print('%-*s %12s %16s %10s %10s' % (width, 'case | record', 'seconds', 'dam-days/s', 'peak MB', 'vs base'))
+    for key, r in results.items():
+        ratio = '%.2fx' % r['vs_baseline'] if 'vs_baseline' in r else '-'
+        print('%-*s %12.6f %16.4g %10.2f %10s' % (width, key, r['seconds'], r['dam_days_per_s'], r['peak_mb'], ratio))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the reservoir and cascade hot paths')
+    parser.add_argument('--years', type=int, nargs='+', default=[0, 100], help='record lengths, 0 is the observed 1993+ record')
+    parser.add_argument('--population', type=int, default=50, help='NSGA-II population size')
+    parser.add_argument('--select', nargs='+', help='only run cases whose name contains one of these strings')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum timed seconds per case')
+    parser.add_argument('--save-baseline', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed throughput loss against the baseline')
+    args = parser.parse_args(argv)
+
+    results = run(args.years, args.population, args.select, args.min_time)
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    report(results)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=1)
+    if regressions:
+        print('Slower than baseline by more than %d%%:' % (100 * args.tolerance))
+        for key in regressions:
+            print('  ' + key)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+import snake_river
+from streamflow_store import open_store, cascade_inputs
+from year_index import YearIndex
+
+# Calibration of the natural release parameters (alfa, beta) of each dam against its observed outflow.
+# Every dam is run on its own observed inputs (the upstream dam's observed outflow plus tributary
+# inflow), so the four dams calibrate independently. Candidates are evaluated in batches through
+# Reservoir.simulation_nat_lake_batch and scored together: first a dense grid over the bounds, then
+# a few rounds of finer grids around the best grid points.
+#
+#   table = calibrate(snake_river.make_reservoirs())   # writes the best alfa, beta with set_params
+
+SCORES = ('nse', 'kge', 'rmse', 'max_error', 'min_error')
+
+# Loss minimized by each metric
+LOSSES = {
+    'nse': lambda t: 1 - t['nse'],
+    'kge': lambda t: 1 - t['kge'],
+    'rmse': lambda t: t['rmse'],
+    'extremes': lambda t: t['max_error'] + t['min_error'], # the two objectives of "release function attempt.ipynb"
+}
+
+def calibration_inputs(store=None, start=snake_river.POST_CUTOFF, end=None):
+    '''
+    Observed inputs of each dam run on its own.
+    Returns (dates, inflow, observed): inflow (D, T) is the observed outflow of the dam upstream (the
+    Lower Granite inflow for LGR) plus the dam's tributary inflow, observed (D, T) the dam's outflow (m^3/s).
+    '''
+    store = store or open_store()
+    dates, inflow, tributaries = cascade_inputs(store, start, end)
+    k = store.window(start, end)
+    observed = np.vstack([store[name + '_outflow'][k] for name in snake_river.NAMES])
+    return dates, np.vstack([inflow, observed[:-1]]) + tributaries, observed
+
+def scores(simulated, observed, years):
+    '''
+    Goodness of fit of a batch of simulated outflows, over the steps where both series are defined.
+    Inputs:
+    - simulated: (P, T) outflows of P candidates
+    - observed: (T,) observed outflow
+    - years: YearIndex of the T steps
+    Returns dict of (P,) arrays: nse and kge (1 is a perfect fit), rmse (m^3/s), and max_error / min_error,
+    the difference between the simulated and observed median annual maximum / minimum outflow (m^3/s).
+    '''
+    valid = ~np.isnan(simulated) & ~np.isnan(observed)
+    count = valid.sum(axis=1)
+    sim = np.where(valid, simulated, 0.0)
+    obs = np.where(valid, observed, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_sim = sim.sum(axis=1) / count
+        mean_obs = obs.sum(axis=1) / count
+        dev_sim = np.where(valid, sim - mean_sim[:, None], 0.0)
+        dev_obs = np.where(valid, obs - mean_obs[:, None], 0.0)
+        sse = ((sim - obs) ** 2).sum(axis=1)
+        var_sim = (dev_sim ** 2).sum(axis=1)
+        var_obs = (dev_obs ** 2).sum(axis=1)
+        corr = (dev_sim * dev_obs).sum(axis=1) / np.sqrt(var_sim * var_obs)
+        kge = 1 - np.sqrt((corr - 1) ** 2 + (np.sqrt(var_sim / var_obs) - 1) ** 2 + (mean_sim / mean_obs - 1) ** 2)
+        masked = np.where(valid, simulated, np.nan)
+        obs_masked = np.where(valid, observed, np.nan)
+        max_error = np.abs(np.nanmedian(years.max(masked), axis=1) - np.nanmedian(years.max(obs_masked), axis=1))
+        min_error = np.abs(np.nanmedian(years.min(masked), axis=1) - np.nanmedian(years.min(obs_masked), axis=1))
+    return {'nse': 1 - sse / var_obs, 'kge': kge, 'rmse': np.sqrt(sse / count), 'max_error': max_error, 'min_error': min_error}
+
+def evaluate_candidates(reservoir, alfa, beta, h_in, inflow, observed, years, chunk=256):
+    '''
+    Scores of every (alfa, beta) candidate of one reservoir, simulated chunk candidates at a time.
+    Returns DataFrame with alfa, beta and the SCORES columns, one row per candidate.
+    '''
+    alfa = np.asarray(alfa, dtype=float)
+    beta = np.asarray(beta, dtype=float)
+    parts = []
+    for i in range(0, len(alfa), chunk):
+        _, _, release = reservoir.simulation_nat_lake_batch(1, alfa[i:i + chunk], beta[i:i + chunk], h_in, inflow)
+        parts.append(scores(release, observed, years))
+    table = {'alfa': alfa, 'beta': beta}
+    table.update({name: np.concatenate([p[name] for p in parts]) for name in SCORES})
+    return pd.DataFrame(table)
+
+def calibrate_reservoir(reservoir, h_in, inflow, observed, dates, metric='kge', alfa_range=(0.1, 5), beta_range=(0.1, 5),
+                        n_grid=32, n_best=4, n_refine=3, refine_grid=9, chunk=256, year_start_month=1):
+    '''
+    Calibrate alfa and beta of one reservoir: a dense n_grid x n_grid grid over the bounds, then n_refine
+    rounds of refine_grid x refine_grid grids around each of the n_best best candidates, the grid spacing
+    shrinking every round. The reservoir is not changed.
+    Inputs:
+    - reservoir: Reservoir
+    - h_in: initial lake level (m)
+    - inflow, observed: (T,) net inflow and observed outflow (m^3/s)
+    - dates: dates of the T steps, for the annual extremes
+    - metric: loss to minimize, a key of LOSSES
+    - alfa_range, beta_range: bounds of the search, as in "release function attempt.ipynb"
+    Returns DataFrame of every evaluated candidate, with its loss, sorted from best to worst.
+    '''
+    loss = LOSSES[metric]
+    years = YearIndex(dates, year_start_month)
+    lower = np.array([alfa_range[0], beta_range[0]], dtype=float)
+    upper = np.array([alfa_range[1], beta_range[1]], dtype=float)
+
+    A, B = np.meshgrid(np.linspace(lower[0], upper[0], n_grid), np.linspace(lower[1], upper[1], n_grid), indexing='ij')
+    table = evaluate_candidates(reservoir, A.ravel(), B.ravel(), h_in, inflow, observed, years, chunk)
+    table['loss'] = loss(table)
+    step = (upper - lower) / (n_grid - 1)
+    offsets = np.linspace(-1, 1, refine_grid)
+    local = np.stack(np.meshgrid(offsets, offsets, indexing='ij'), axis=-1).reshape(-1, 2)
+    for _ in range(n_refine):
+        # Fine grid spanning one coarse step either side of each of the best candidates so far
+        best = table.nsmallest(n_best, 'loss')[['alfa', 'beta']].values
+        points = np.clip((best[:, None] + local[None] * step).reshape(-1, 2), lower, upper)
+        new = evaluate_candidates(reservoir, points[:, 0], points[:, 1], h_in, inflow, observed, years, chunk)
+        new['loss'] = loss(new)
+        table = pd.concat([table, new], ignore_index=True).drop_duplicates(['alfa', 'beta'])
+        step = 2 * step / (refine_grid - 1)
+    return table.sort_values('loss', kind='stable').reset_index(drop=True)
+
+def calibrate(reservoirs, names=snake_river.NAMES, initial_heights=snake_river.INITIAL_HEIGHTS, store=None,
+              start=snake_river.POST_CUTOFF, end=None, apply=True, **kwargs):
+    '''
+    Calibrate alfa and beta of every dam against its observed outflow, see calibrate_reservoir.
+    Inputs:
+    - reservoirs: Reservoir of each dam, upstream to downstream like snake_river.make_reservoirs
+    - names, initial_heights: dam names and initial lake levels (m)
+    - store, start, end: observed record, see calibration_inputs
+    - apply: write the calibrated values to the reservoirs with set_params
+    - kwargs: passed on to calibrate_reservoir (metric, bounds, grid sizes)
+    Returns DataFrame indexed by dam name with the calibrated alfa and beta, their scores and loss.
+    '''
+    dates, inflow, observed = calibration_inputs(store, start, end)
+    rows = []
+    for d, reservoir in enumerate(reservoirs):
+        best = calibrate_reservoir(reservoir, initial_heights[d], inflow[d], observed[d], dates, **kwargs).iloc[0]
+        if apply:
+            reservoir.set_params(best['alfa'], best['beta'])
+        rows.append(best)
+    return pd.DataFrame(rows, index=pd.Index(names, name='dam'))
@@ -0,0 +1,172 @@
+import numpy as np
+import reservoir_kernels as kernels
+from river_cascade import CascadeResult, stack_geometry
+from year_index import YearIndex
+
+def iter_chunks(dates, inflow, tributaries, size=365 * 100):
+    # Split in-memory (or memory-mapped) cascade inputs into (dates, inflow, tributaries) chunks of size days
+    tributaries = np.atleast_2d(tributaries)
+    for i in range(0, len(inflow), size):
+        yield dates[i:i + size], inflow[i:i + size], tributaries[:, i:i + size]
+
+class CascadeStream:
+    '''
+    Chunked version of RiverCascade for records too long to hold in memory.
+    Inputs arrive as an iterable of (dates, inflow, tributaries) chunks, e.g. iter_chunks or a generator
+    of synthetic years. Storage, level and the previous day's inflow of every dam are carried across
+    chunk boundaries, so the trajectories and objectives are exactly those of one RiverCascade run over
+    the concatenated record, while memory only depends on the chunk size.
+    One reservoir is a one-dam stream with zero tributary inflow.
+    '''
+
+    def __init__(self, names, reservoirs, initial_heights, hist_min=None, year_start_month=1, steps_per_day=1, release_shape=None,
+                 fish_passage=None):
+        '''
+        Inputs:
+        - names: short name of each dam, e.g. ['LGR', 'LGS', 'LMN', 'ICH']
+        - reservoirs: Reservoir objects ordered upstream to downstream
+        - initial_heights: initial water level of each reservoir (m)
+        - hist_min: historical minimum outflow target of each reservoir (m^3/s), needed by evaluate
+        - year_start_month: first month of the years used for annual summaries, 1 for calendar years, 10 for water years
+        - steps_per_day, release_shape: sub-daily time step and intra-day release multipliers, as in RiverCascade
+        - fish_passage: optional fish_passage.FishPassage, adds the annual fish survival to annual and evaluate
+        '''
+        self.names = list(names)
+        self.reservoirs = list(reservoirs)
+        self.initial_heights = np.asarray(initial_heights, dtype=float)
+        self.hist_min = None if hist_min is None else np.asarray(hist_min, dtype=float)
+        self.year_start_month = year_start_month
+        self.fish_passage = fish_passage
+
+        # Reservoir constants, gathered once for the kernel
+        self.S = np.array([r.SA for r in self.reservoirs], dtype=float)
+        self.h_bottom = np.array([r.bottom_elev for r in self.reservoirs])
+        self.h0 = np.array([r.tail_elev for r in self.reservoirs])
+        self.max_storage = np.array([r.max_storage for r in self.reservoirs], dtype=float)
+        self.pc_flow = np.array([r.pc * .0283 for r in self.reservoirs], dtype=float) # powerhouse capacity (m^3/s), for fish passage
+        self.curves, self.curve_meta = stack_geometry(self.reservoirs)
+
+        # Time step
+        D = len(self.reservoirs)
+        if 86400 % steps_per_day != 0:
+            # delta would be truncated while hours is not, and the water balance and energy would disagree
+            raise ValueError('steps_per_day must divide the 86400 s of a day, got %r' % steps_per_day)
+        self.steps_per_day = steps_per_day
+        self.delta = 60 * 60 * 24 // steps_per_day # integration step [s]
+        self.hours = 24 / steps_per_day # hours per step, for energy
+        shape = np.ones(1) if release_shape is None else np.asarray(release_shape, dtype=float)
+        self.release_shape = np.ascontiguousarray(np.broadcast_to(shape, (D, shape.shape[-1])))
+
+    @classmethod
+    def from_cascade(cls, cascade):
+        # Stream with the dams and settings of a RiverCascade
+        return cls(cascade.names, cascade.reservoirs, cascade.initial_heights, cascade.hist_min, cascade.years.start_month,
+                   cascade.steps_per_day, cascade.release_shape, cascade.fish_passage)
+
+    def simulate(self, mef, h1, m, keep, chunks):
+        '''
+        Simulate all dams chunk by chunk.
+        Inputs:
+        - mef, h1, m: regulated release parameters, one value per dam
+        - keep: 1 if the dam is kept, 0 if it is removed, one value per dam
+        - chunks: iterable of (dates, inflow, tributaries) with tributaries of shape (D, t)
+        Yields CascadeResult of each chunk. avg_hydro is None, see annual for yearly values.
+        '''
+        D = len(self.reservoirs)
+        keep = np.asarray(keep, dtype=np.int64)
+        mef = np.asarray(mef, dtype=float)
+        h1 = np.asarray(h1, dtype=float)
+        m = np.asarray(m, dtype=float)
+        alfa = np.array([r.alfa for r in self.reservoirs], dtype=float)
+        beta = np.array([r.beta for r in self.reservoirs], dtype=float)
+
+        # Carried state
+        s = np.empty(D)       # storage of each dam [m^3]
+        n_prev = np.empty(D)  # previous step's net inflow of each dam [m^3/s]
+        h_prev = np.empty(D)  # previous step's level of each dam [m]
+        started = False
+        step = 0              # steps simulated so far, for the step of the day
+
+        for dates, inflow, tributaries in chunks:
+            inflow = np.ascontiguousarray(inflow, dtype=float)
+            tributaries = np.ascontiguousarray(np.atleast_2d(np.asarray(tributaries, dtype=float)))
+            T = len(inflow)
+            if T == 0:
+                continue
+            outflow = np.empty((D, T))
+            height = np.empty((D, T))
+            first = 0
+            if not started:
+                kernels.cascade_start(inflow[0], tributaries[:, 0], keep, self.initial_heights, self.S, self.h_bottom, self.h0,
+                                      self.curves, self.curve_meta, s, n_prev, h_prev, outflow[:, 0], height[:, 0])
+                started = True
+                first = 1
+            kernels.cascade_steps(inflow[first:], tributaries[:, first:], keep, self.S, self.h_bottom, self.h0, alfa, beta,
+                                  mef, h1, m, self.max_storage, self.delta, self.release_shape, step + first,
+                                  self.curves, self.curve_meta, s, n_prev, h_prev, outflow[:, first:], height[:, first:])
+            step += T
+
+            hydro = np.zeros(outflow.shape)
+            for d, res in enumerate(self.reservoirs):
+                if keep[d] != 0:
+                    hydro[d] = res.simulate_hydropower(res.simulate_head(height[d]), outflow[d], keep[d], self.hours) #kWh
+            yield CascadeResult(self.names, dates, outflow, height, hydro, None)
+
+    def annual(self, mef, h1, m, keep, chunks):
+        '''
+        Simulate all dams and summarize each year as soon as it is complete. Years may span chunks.
+        Inputs are the same as simulate.
+        Yields (year, hydro, min_outflow, max_outflow, survival) with the annual hydropower (kWh), minimum and
+        maximum outflow (m^3/s) of every dam as (D,) arrays, and the weighted fish survival through the
+        cascade over the year, NaN without a fish passage model.
+        '''
+        pending = [] # steps of the current year, as (dates, outflow, height, hydro) pieces
+        year = None
+        for result in self.simulate(mef, h1, m, keep, chunks):
+            years = YearIndex(result.dates, self.year_start_month)
+            for label, start, count in zip(years.labels, years.offsets, years.counts):
+                if year is not None and label != year:
+                    yield self._summarize(year, pending, keep)
+                    pending = []
+                year = label
+                window = slice(start, start + count)
+                pending.append((result.dates[window], result.outflow[:, window], result.height[:, window], result.hydro[:, window]))
+        if pending:
+            yield self._summarize(year, pending, keep)
+
+    def _summarize(self, year, pending, keep):
+        # Same reductions as YearIndex and FishPassage.annual_survival over one whole year
+        dates = np.concatenate([p[0] for p in pending])
+        outflow, height, hydro = (np.concatenate([p[i] for p in pending], axis=1) for i in (1, 2, 3))
+        start = np.zeros(1, dtype=int)
+        survival = np.nan
+        if self.fish_passage is not None:
+            s = np.prod(self.fish_passage.dam_survival(self, outflow, height, keep), axis=0)
+            w = self.fish_passage.weights(dates)
+            valid = ~np.isnan(s)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                survival = (np.add.reduceat(np.where(valid, w * s, 0.0), start)[0] /
+                            np.add.reduceat(np.where(valid, w, 0.0), start)[0])
+        return (year, np.add.reduceat(np.nan_to_num(hydro), start, axis=-1)[:, 0],
+                np.fmin.reduceat(outflow, start, axis=-1)[:, 0], np.fmax.reduceat(outflow, start, axis=-1)[:, 0], survival)
+
+    def evaluate(self, variables, chunks):
+        '''
+        Evaluate one decision vector laid out like DamOptimization over a chunked record.
+        Returns the same (num_below_min, total_hydro) as RiverCascade.evaluate on the whole record, and the
+        average annual fish survival as a third value when there is a fish passage model.
+        '''
+        D = len(self.reservoirs)
+        variables = np.asarray(variables, dtype=float)
+        hydro = []
+        survival = []
+        num_below_min = 0
+        for _, year_hydro, min_outflow, _, year_survival in self.annual(variables[:D], variables[D:2*D], variables[2*D:3*D],
+                                                                        variables[3*D:4*D], chunks):
+            hydro.append(year_hydro)
+            survival.append(year_survival)
+            num_below_min += (min_outflow < self.hist_min).sum()
+        avg_hydro = np.ascontiguousarray(np.array(hydro).T).mean(axis=1) #kWh/year, same layout as RiverCascade
+        if self.fish_passage is None:
+            return num_below_min, avg_hydro.sum()
+        return num_below_min, avg_hydro.sum(), np.nanmean(survival)
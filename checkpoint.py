@@ -0,0 +1,197 @@
+import os
+import random
+import numpy as np
+from platypus import Solution, InjectedPopulation, MaxEvaluations
+from platypus.extensions import FixedFrequencyExtension
+from platypus.config import PlatypusConfig
+
+# Checkpoint, resume and warm start of Platypus runs such as NSGA-II on DamOptimization.
+# A checkpoint is one compressed .npz file holding the population, the archive, the evaluation count
+# and the state of Python's random generator, which drives every Platypus operator. Variables are
+# stored encoded (Integer and Binary as their bits), so a resumed run continues exactly where the
+# checkpointed run was, solution for solution.
+#
+#   algorithm = NSGAII(DamOptimization(cascade), population_size=50, variator=variator)
+#   run_with_checkpoints(algorithm, 20_000, 'nsga.npz', frequency=1000)   # resumes if nsga.npz exists
+#
+#   generator = warm_start(DamOptimization(new_cascade), 'nsga.npz')     # seed a new study with the old front
+#   algorithm = NSGAII(DamOptimization(new_cascade), population_size=50, generator=generator, variator=variator)
+
+VERSION = 1
+
+def _signature(problem):
+    return np.array([str(t) for t in problem.types] + ['nobjs=%d' % problem.nobjs, 'nconstrs=%d' % problem.nconstrs])
+
+def _encode(problem, solutions):
+    # Encoded variables of each solution as floats, bit lists packed into integers
+    rows = np.empty((len(solutions), problem.nvars))
+    for j, t in enumerate(problem.types):
+        if hasattr(t, 'nbits'):
+            if t.nbits > 52:
+                raise ValueError('%s has too many bits to checkpoint' % t)
+            rows[:, j] = [sum(1 << (t.nbits - 1 - k) for k, bit in enumerate(s.variables[j]) if bit) for s in solutions]
+        elif hasattr(t, 'min_value'):
+            rows[:, j] = [s.variables[j] for s in solutions]
+        else:
+            raise ValueError('%s variables cannot be checkpointed' % t)
+    return rows
+
+def _decode(problem, row):
+    variables = []
+    for t, value in zip(problem.types, row):
+        if hasattr(t, 'nbits'):
+            value = int(value)
+            variables.append([bool((value >> (t.nbits - 1 - k)) & 1) for k in range(t.nbits)])
+        else:
+            variables.append(float(value))
+    return variables
+
+def _pack(prefix, problem, solutions):
+    return {prefix + '_variables': _encode(problem, solutions),
+            prefix + '_objectives': np.array([s.objectives[:] for s in solutions], dtype=float).reshape(len(solutions), problem.nobjs),
+            prefix + '_constraints': np.array([s.constraints[:] for s in solutions], dtype=float).reshape(len(solutions), problem.nconstrs),
+            prefix + '_violation': np.array([s.constraint_violation for s in solutions], dtype=float),
+            prefix + '_rank': np.array([getattr(s, 'rank', -1) for s in solutions], dtype=np.int64),
+            prefix + '_crowding': np.array([getattr(s, 'crowding_distance', np.nan) for s in solutions], dtype=float)}
+
+def _unpack(prefix, problem, data):
+    # Evaluated Solutions of problem from the stored arrays
+    solutions = []
+    for i, row in enumerate(data[prefix + '_variables']):
+        s = Solution(problem)
+        s.variables[:] = _decode(problem, row)
+        s.objectives[:] = list(data[prefix + '_objectives'][i])
+        s.constraints[:] = list(data[prefix + '_constraints'][i])
+        s.constraint_violation = float(data[prefix + '_violation'][i])
+        s.feasible = s.constraint_violation == 0.0
+        s.evaluated = True
+        if data[prefix + '_rank'][i] >= 0:
+            s.rank = int(data[prefix + '_rank'][i])
+        if not np.isnan(data[prefix + '_crowding'][i]):
+            s.crowding_distance = float(data[prefix + '_crowding'][i])
+        solutions.append(s)
+    return solutions
+
+def save_checkpoint(algorithm, path):
+    '''
+    Write the state of a genetic algorithm (population, archive, nfe, random generator) to path.
+    The file is replaced atomically, so an interrupted write leaves the previous checkpoint intact.
+    '''
+    problem = algorithm.problem
+    version, state, gauss = random.getstate()
+    data = {'version': VERSION, 'signature': _signature(problem), 'nfe': algorithm.nfe,
+            'random_state': np.array(state, dtype=np.uint64), 'random_version': version,
+            'random_gauss': np.nan if gauss is None else gauss}
+    data.update(_pack('population', problem, algorithm.population))
+    archive = getattr(algorithm, 'archive', None)
+    if archive is not None:
+        data.update(_pack('archive', problem, list(archive)))
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, **data)
+    os.replace(tmp, path)
+
+def load_checkpoint(path, problem):
+    '''
+    Read a checkpoint written for problem.
+    Returns dict with 'nfe', 'population' and 'archive' (None if the run had no archive) as lists of
+    evaluated Solutions, and 'random_state' as accepted by random.setstate.
+    '''
+    with np.load(path) as f:
+        data = dict(f)
+    if int(data['version']) != VERSION:
+        raise ValueError('%s has checkpoint version %d, expected %d' % (path, data['version'], VERSION))
+    if list(data['signature']) != list(_signature(problem)):
+        raise ValueError('%s was written for a different problem' % path)
+    gauss = float(data['random_gauss'])
+    return {'nfe': int(data['nfe']),
+            'population': _unpack('population', problem, data),
+            'archive': _unpack('archive', problem, data) if 'archive_variables' in data else None,
+            'random_state': (int(data['random_version']), tuple(int(x) for x in data['random_state']), None if np.isnan(gauss) else gauss)}
+
+def restore_checkpoint(algorithm, path):
+    '''
+    Put a newly built algorithm in the state saved at path, including the random generator.
+    The algorithm must be built like the checkpointed one (problem, population size, operators);
+    its archive, if any, must still be empty. Returns the algorithm.
+    '''
+    state = load_checkpoint(path, algorithm.problem)
+    if len(state['population']) != algorithm.population_size:
+        raise ValueError('%s holds %d solutions, the population size is %d' % (path, len(state['population']), algorithm.population_size))
+    algorithm.population = state['population']
+    algorithm.nfe = state['nfe']
+    algorithm.result = algorithm.population
+    archive = getattr(algorithm, 'archive', None)
+    if archive is not None and state['archive'] is not None:
+        archive.extend(state['archive'])
+        algorithm.result = archive
+    if getattr(algorithm, 'variator', False) is None:
+        algorithm.variator = PlatypusConfig.default_variator(algorithm.problem)
+    random.setstate(state['random_state'])
+    return algorithm
+
+class CheckpointExtension(FixedFrequencyExtension):
+    '''
+    Platypus extension writing a checkpoint every `frequency` evaluations and at the end of the run.
+    '''
+
+    def __init__(self, path, frequency=1000):
+        super(CheckpointExtension, self).__init__(frequency, by_nfe=True)
+        self.path = path
+
+    def do_action(self, algorithm):
+        save_checkpoint(algorithm, self.path)
+
+    def end_run(self, algorithm):
+        save_checkpoint(algorithm, self.path)
+
+def run_with_checkpoints(algorithm, total_evaluations, path, frequency=1000, callback=None):
+    '''
+    Run algorithm until it has done total_evaluations evaluations in all, checkpointing to path.
+    If path exists the run is first restored from it, so calling this again after an interruption
+    finishes the same run with the same result as an uninterrupted one.
+    Returns the algorithm.
+    '''
+    if os.path.exists(path):
+        restore_checkpoint(algorithm, path)
+    extension = CheckpointExtension(path, frequency)
+    algorithm.add_extension(extension)
+    try:
+        if algorithm.nfe < total_evaluations:
+            algorithm.run(MaxEvaluations(total_evaluations - algorithm.nfe), callback)
+    finally:
+        algorithm.remove_extension(extension)
+    return algorithm
+
+def warm_start(problem, path, front_only=True):
+    '''
+    Initial population generator seeded with the solutions of a previous run, e.g. after the record
+    gained a year of data. The seeds are evaluated again on problem; any remaining population slots
+    are filled randomly.
+    Inputs:
+    - problem: problem of the new run, with the same decision variables as the old one
+    - path: checkpoint of the previous run
+    - front_only: seed with the nondominated solutions only (archive and population), else with all of them
+    Returns a platypus InjectedPopulation.
+    '''
+    with np.load(path) as f:
+        data = dict(f)
+    if [str(t) for t in problem.types] != list(data['signature'][:problem.nvars]):
+        raise ValueError('%s has different decision variables' % path)
+    prefixes = ['archive', 'population'] if 'archive_variables' in data else ['population']
+    rows = np.vstack([data[p + '_variables'] for p in prefixes])
+    if front_only:
+        # Nondominated among the feasible solutions, or among all if none is feasible
+        F = np.vstack([data[p + '_objectives'] for p in prefixes])
+        feasible = np.concatenate([data[p + '_violation'] for p in prefixes]) == 0
+        if feasible.any():
+            rows, F = rows[feasible], F[feasible]
+        dominated = (np.all(F[:, None] <= F[None], axis=-1) & np.any(F[:, None] < F[None], axis=-1)).any(axis=0)
+        rows = rows[~dominated]
+    rows = np.unique(rows, axis=0)
+    seeds = []
+    for row in rows:
+        s = Solution(problem)
+        s.variables[:] = _decode(problem, row)
+        seeds.append(s)
+    return InjectedPopulation(seeds)
@@ -0,0 +1,131 @@
+import math
+import os
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from platypus import Problem, Real, Integer
+from platypus.evaluator import Evaluator
+from river_cascade import RiverCascade
+from prefix_cache import PrefixCache
+
+class DamOptimization(Problem):
+    def __init__(self, cascade):
+        # Create a problem with 16 decision variables and 2 objectives, 3 when the cascade has a fish passage model
+        super(DamOptimization, self).__init__(16, 2 if cascade.fish_passage is None else 3)
+        self.cascade = cascade # RiverCascade for LGR, LGS, LMN, ICH
+
+        self.types[:] = (
+                        [Real(0, 10_000*(0.3046**3))] * 4 + # MEF for all dams
+                        [Real(636*0.3046, 746.5*0.3046)] + # h1 LGR
+                        [Real(539*0.3046, 646.5*0.3046)] + # h1 LGS
+                        [Real(439*0.3046, 548.3*0.3046)] + # h1 LMN
+                        [Real(339*0.3046, 446.4*0.3046)] + # h1 ICH
+                        [Real(500, 5000)] * 4 + # m for all dams
+                        [Integer(0,1)] * 4 # keep
+                        )
+
+    def objectives(self, variables):
+        # variables: mef, h1, m of every dam followed by keep of every dam
+        # Maximized objectives (hydropower, fish survival) are negated
+        num_below_min, *maximized = self.cascade.evaluate(variables)
+        return [num_below_min] + [-value for value in maximized]
+
+    def evaluate(self, solutions):
+        # Check if a single solution is passed
+        if not isinstance(solutions, list):
+            solutions = [solutions]
+
+        for s in solutions:
+            s.objectives[:] = self.objectives(s.variables[:])
+
+def decode_variables(solutions):
+    # Decision variables of each solution as a (N, nvars) array, decoded the same way Problem.__call__ does
+    problem = solutions[0].problem
+    return np.array([[problem.types[i].decode(s.variables[i]) for i in range(problem.nvars)] for s in solutions], dtype=float)
+
+def _share(arr):
+    # Copy an array into a new shared memory block
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, arr.dtype, buffer=shm.buf)[:] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+# Per-worker state, set once by _init_worker
+_worker = {}
+
+def _init_worker(names, reservoirs, initial_heights, dates, hist_min, inflow_spec, tributary_spec, cache_settings, year_start_month=1,
+                 steps_per_day=1, release_shape=None, fish_passage=None):
+    views = []
+    for name, shape, dtype in (inflow_spec, tributary_spec):
+        shm = shared_memory.SharedMemory(name=name)
+        _worker.setdefault('shm', []).append(shm) # keep the block mapped for the life of the worker
+        views.append(np.ndarray(shape, dtype, buffer=shm.buf))
+    cache = None if cache_settings is None else PrefixCache(*cache_settings) # each worker keeps its own prefix cache
+    problem = DamOptimization(RiverCascade(names, reservoirs, initial_heights, views[0], views[1], dates, hist_min, cache,
+                                            year_start_month, steps_per_day, release_shape, fish_passage))
+    _worker['problem'] = problem
+
+def _evaluate_chunk(variables):
+    problem = _worker['problem']
+    return [problem.objectives(v) for v in variables]
+
+class ParallelEvaluator(Evaluator):
+    '''
+    Platypus evaluator that spreads DamOptimization solutions across a process pool.
+    The inflow and tributary arrays of the cascade are copied once into shared memory and
+    each worker builds its own RiverCascade on top of them when it starts. Only decision
+    vectors and objective values travel between processes, and results keep the order of
+    the jobs, so objectives are identical to the serial DamOptimization.evaluate path.
+
+    Use as NSGAII(problem, ..., evaluator=ParallelEvaluator(cascade)) and call close() when done.
+    '''
+
+    def __init__(self, cascade, processes=None, chunks_per_worker=4):
+        super(ParallelEvaluator, self).__init__()
+        self.processes = processes or os.cpu_count()
+        self.chunks_per_worker = chunks_per_worker
+        self._shm = []
+        inflow_shm, inflow_spec = _share(cascade.inflow)
+        self._shm.append(inflow_shm)
+        tributary_shm, tributary_spec = _share(cascade.tributaries)
+        self._shm.append(tributary_shm)
+        cache_settings = None if cascade.cache is None else (cascade.cache.max_bytes, cascade.cache.decimals)
+        self.pool = mp.Pool(self.processes, initializer=_init_worker,
+                            initargs=(cascade.names, cascade.reservoirs, cascade.initial_heights, cascade.dates.values,
+                                      cascade.hist_min, inflow_spec, tributary_spec, cache_settings, cascade.years.start_month,
+                                      cascade.steps_per_day, cascade.release_shape, cascade.fish_passage))
+
+    def map_objectives(self, variables):
+        '''
+        Evaluate decision vectors in the pool.
+        Inputs:
+        - variables: (N, nvars) array of decoded decision vectors
+        Returns list of DamOptimization.objectives ([num_below_min, -total_hydro] and -survival with a fish model) in the same order.
+        '''
+        variables = np.asarray(variables, dtype=float)
+        if len(variables) == 0:
+            return []
+        n_chunks = min(len(variables), self.processes * self.chunks_per_worker)
+        size = math.ceil(len(variables) / n_chunks)
+        chunks = [variables[i:i + size] for i in range(0, len(variables), size)]
+        return [obj for chunk in self.pool.map(_evaluate_chunk, chunks) for obj in chunk]
+
+    def evaluate_all(self, jobs, **kwargs):
+        jobs = list(jobs)
+        if not jobs:
+            return jobs
+        solutions = [job.solution for job in jobs]
+        for s, obj in zip(solutions, self.map_objectives(decode_variables(solutions))):
+            # Same bookkeeping as Problem.__call__
+            s.objectives[:] = obj
+            s.constraint_violation = sum([abs(f(x)) for (f, x) in zip(s.problem.constraints, s.constraints)])
+            s.feasible = s.constraint_violation == 0.0
+            s.evaluated = True
+        return jobs
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._shm = []
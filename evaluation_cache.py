@@ -0,0 +1,227 @@
+import hashlib
+import os
+import sqlite3
+import time
+import numpy as np
+from platypus.evaluator import Evaluator
+from platypus.config import PlatypusConfig
+from dam_optimization import decode_variables
+from Reservoir4 import rho, g, eta
+
+# Persistent cache of DamOptimization objective values, shared by runs, seeds, notebooks and processes.
+# Entries live in one SQLite file in WAL mode, so any number of processes can read and write it at
+# the same time. Each entry is keyed on the model fingerprint of the cascade (input data, reservoir
+# constants, objective settings and MODEL_VERSION) and the decision vector rounded to `decimals`.
+# Least recently used entries are deleted when the stored bytes pass max_bytes.
+#
+#   cache = EvaluationCache('runs/evaluations.sqlite')
+#   algorithm = NSGAII(problem, population_size=50, variator=variator, evaluator=CachedEvaluator(cache, cascade))
+
+MODEL_VERSION = 1 # bump when the simulation or the objectives change, so old entries stop matching
+DEFAULT_PATH = '.evaluation_cache.sqlite'
+
+def model_fingerprint(cascade):
+    # Everything besides the decision vector that the DamOptimization objectives depend on, power tables included
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(('%d %s %r %r %r' % (MODEL_VERSION, cascade.fingerprint, rho, g, eta)).encode())
+    hist_min = np.full(len(cascade.reservoirs), np.nan) if cascade.hist_min is None else cascade.hist_min
+    for arr in ([r.alfa for r in cascade.reservoirs], [r.beta for r in cascade.reservoirs], hist_min,
+                cascade.pc_flow, cascade.capacity, cascade.years.offsets):
+        digest.update(np.ascontiguousarray(arr, dtype=float).tobytes())
+    tables, table_meta = cascade.power_tables()
+    digest.update(tables.tobytes() + table_meta.tobytes())
+    if cascade.fish_passage is not None:
+        digest.update(cascade.fish.tobytes() + cascade.fish_weights.tobytes())
+    return digest.hexdigest()
+
+def canonical_variables(variables, n_dams=4):
+    # Decision vectors with the release parameters of removed dams zeroed, since they don't change the objectives
+    v = np.array(variables, dtype=float, ndmin=2)
+    removed = v[:, 3*n_dams:4*n_dams] == 0
+    for k in range(3):
+        v[:, k*n_dams:(k + 1)*n_dams][removed] = 0
+    return v
+
+class EvaluationCache:
+    '''
+    On-disk cache of objective values and optional summary statistics per decision vector.
+    Methods take a batch of vectors so one lookup or store is one SQLite transaction.
+    '''
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=2**30, decimals=9, timeout=60):
+        '''
+        Inputs:
+        - path: SQLite file, created if missing
+        - max_bytes: cap on the stored entry bytes, least recently used entries go first
+        - decimals: decision variables are rounded to this many decimals in the keys
+        - timeout: seconds to wait for a lock held by another process
+        '''
+        self.path = path
+        self.max_bytes = max_bytes
+        self.decimals = decimals
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, fingerprint TEXT, variables BLOB, '
+                         'objectives BLOB, summary BLOB, nbytes INTEGER, last_used REAL) WITHOUT ROWID')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)')
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('nbytes', 0)")
+
+    def _connection(self):
+        # One connection per process; a connection inherited through fork is not reused
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn = _Transaction(conn)
+            self._pid = os.getpid()
+        return self._conn
+
+    def keys(self, fingerprint, variables):
+        # 16-byte key of each rounded decision vector
+        rounded = np.round(np.array(variables, dtype=float, ndmin=2), self.decimals) + 0.0 # + 0.0 turns -0.0 into 0.0
+        return [hashlib.blake2b(fingerprint.encode() + row.tobytes(), digest_size=16).digest() for row in rounded]
+
+    def get(self, fingerprint, variables, summary=False):
+        '''
+        Look up a batch of decision vectors.
+        Returns a list with, per vector, its objectives as an array (or (objectives, summary) if summary
+        is True, summary being None if none was stored), or None on a miss.
+        '''
+        keys = self.keys(fingerprint, variables)
+        found = {}
+        # Read in autocommit mode outside a write transaction, so lookups do not queue behind writers
+        conn = self._connection().conn
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = conn.execute('SELECT key, objectives, summary FROM entries WHERE key IN (%s)' % ','.join('?' * len(batch)), batch)
+            found.update((k, (o, s)) for k, o, s in rows)
+        if found:
+            # Only the last_used update takes the write lock, in a transaction of its own
+            now = time.time()
+            with self._connection() as conn:
+                conn.executemany('UPDATE entries SET last_used = ? WHERE key = ?', [(now, k) for k in found])
+        out = []
+        for k in keys:
+            if k not in found:
+                out.append(None)
+                continue
+            objectives = np.frombuffer(found[k][0])
+            if summary:
+                out.append((objectives, None if found[k][1] is None else np.frombuffer(found[k][1])))
+            else:
+                out.append(objectives)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return out
+
+    def put(self, fingerprint, variables, objectives, summaries=None):
+        '''
+        Store objective values (and optional summary arrays) of a batch of decision vectors.
+        Vectors already in the cache keep their stored values.
+        '''
+        variables = np.array(variables, dtype=float, ndmin=2)
+        keys = self.keys(fingerprint, variables)
+        now = time.time()
+        added = 0
+        with self._connection() as conn:
+            for i, k in enumerate(keys):
+                obj = np.asarray(objectives[i], dtype=float).tobytes()
+                summary = None if summaries is None or summaries[i] is None else np.asarray(summaries[i], dtype=float).tobytes()
+                size = len(k) + len(fingerprint) + variables[i].nbytes + len(obj) + (0 if summary is None else len(summary))
+                cursor = conn.execute('INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                      (k, fingerprint, variables[i].tobytes(), obj, summary, size, now))
+                added += size if cursor.rowcount == 1 else 0
+            conn.execute("UPDATE meta SET value = value + ? WHERE name = 'nbytes'", (added,))
+            self._evict(conn)
+
+    def _evict(self, conn):
+        # Delete least recently used entries until the cache is back under 90% of max_bytes
+        nbytes = conn.execute("SELECT value FROM meta WHERE name = 'nbytes'").fetchone()[0]
+        while nbytes > self.max_bytes:
+            freed = 0
+            for k, size in conn.execute('SELECT key, nbytes FROM entries ORDER BY last_used LIMIT 1000').fetchall():
+                conn.execute('DELETE FROM entries WHERE key = ?', (k,))
+                freed += size
+                if nbytes - freed <= 0.9 * self.max_bytes:
+                    break
+            if freed == 0:
+                break
+            nbytes -= freed
+            conn.execute("UPDATE meta SET value = value - ? WHERE name = 'nbytes'", (freed,))
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM entries')
+            conn.execute("UPDATE meta SET value = 0 WHERE name = 'nbytes'")
+
+    def stats(self):
+        with self._connection() as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            nbytes = conn.execute("SELECT value FROM meta WHERE name = 'nbytes'").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'nbytes': nbytes, 'max_bytes': self.max_bytes}
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.conn.close()
+        self._conn = None
+
+    def __getstate__(self):
+        # Pickled into worker processes without the open connection
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        return state
+
+class _Transaction:
+    # Connection wrapper whose with block is one write transaction, taken up front so concurrent writers queue on the lock
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, kind, value, traceback):
+        self.conn.execute('COMMIT' if kind is None else 'ROLLBACK')
+
+class CachedEvaluator(Evaluator):
+    '''
+    Platypus evaluator that answers DamOptimization solutions from an EvaluationCache and only passes
+    the misses on to the wrapped evaluator (default the Platypus default, or e.g. a ParallelEvaluator).
+    '''
+
+    def __init__(self, cache, cascade, evaluator=None):
+        super(CachedEvaluator, self).__init__()
+        self.cache = cache
+        self.fingerprint = model_fingerprint(cascade)
+        self.n_dams = len(cascade.reservoirs)
+        self.evaluator = evaluator or PlatypusConfig.default_evaluator
+
+    def evaluate_all(self, jobs, **kwargs):
+        jobs = list(jobs)
+        if not jobs:
+            return jobs
+        solutions = [job.solution for job in jobs]
+        variables = canonical_variables(decode_variables(solutions), self.n_dams)
+        found = self.cache.get(self.fingerprint, variables)
+        for s, obj in zip(solutions, found):
+            if obj is not None:
+                # Same bookkeeping as Problem.__call__
+                s.objectives[:] = obj.tolist()
+                s.constraint_violation = sum([abs(f(x)) for (f, x) in zip(s.problem.constraints, s.constraints)])
+                s.feasible = s.constraint_violation == 0.0
+                s.evaluated = True
+        missed = [i for i, obj in enumerate(found) if obj is None]
+        if missed:
+            results = self.evaluator.evaluate_all([jobs[i] for i in missed], **kwargs)
+            for i, result in zip(missed, results):
+                jobs[i] = result
+            self.cache.put(self.fingerprint, variables[missed], [jobs[i].solution.objectives[:] for i in missed])
+        return jobs
+
+    def close(self):
+        self.evaluator.close()
@@ -0,0 +1,102 @@
+import numpy as np
+
+# Flow-dependent fish passage through the cascade.
+# Every step a kept dam passes fish by two routes: the powerhouse takes the release up to its capacity
+# and the rest is spilled, each route with its own survival. Fish also spend the pool's travel time
+# (storage / release) in the reservoir, with survival 1 / (1 + mortality * travel days), and every kept
+# dam keeps the flow-independent passage rate of the dam (Reservoir.fish_pass, or the adult
+# conversion rates below). Removed dams pass every fish. Survivals multiply down the cascade and are
+# averaged over each year with seasonal weights, e.g. the spring outmigration.
+#
+#   cascade = snake_river.make_cascade(fish_passage=FishPassage())
+#   num_below_min, total_hydro, survival = cascade.evaluate(variables)
+#
+# Survival is computed by the kernel in the same pass as hydropower (see RiverCascade.annual_objectives).
+# Route and pool survivals are illustrative, replace them with the dams' own estimates when available.
+
+TURBINE_SURVIVAL = 0.92 # powerhouse route
+SPILL_SURVIVAL = 0.98 # spillway route
+POOL_MORTALITY = 0.01 # per day of travel time through the pool
+
+# Weight of each calendar month, January first: juvenile spring outmigration April through June
+SPRING_MIGRATION = np.array([0, 0, 0, 1, 1, 1, 0, 0, 0, 0, 0, 0], dtype=float)
+
+# Adult dam to dam conversion rates of "Dam to Dam Adult Fish Return Conversion Rate.xlsx"
+# (cbr.washington.edu/dart/query/pitadult_conrate, multi-year averages over all runs and origins):
+# rate from the dam below to each dam, fish migrating upstream from Ice Harbor
+CONVERSION_RATES = {
+    'Chinook': {'LMN': 0.99, 'LGS': 0.99, 'LGR': 0.99},
+    'Coho': {'LMN': 0.96, 'LGS': 0.95, 'LGR': 0.97},
+    'Steelhead': {'LMN': 0.98, 'LGS': 0.99, 'LGR': 0.99},
+    'Sockeye': {'LMN': 0.93, 'LGS': 0.93, 'LGR': 0.96},
+}
+
+def dam_conversion(species, names=('LGR', 'LGS', 'LMN', 'ICH')):
+    # Adult conversion rate of each dam for FishPassage(passage=...). Ice Harbor, where the records start, gets 1
+    return np.array([CONVERSION_RATES[species].get(name, 1.0) for name in names])
+
+class FishPassage:
+    '''
+    Daily survival of fish passing the cascade, for RiverCascade(fish_passage=...).
+    Every parameter is one value shared by all dams or one value per dam.
+    - turbine_survival, spill_survival: survival of the powerhouse and spillway routes
+    - pool_mortality: mortality per day of travel time through the pool
+    - passage: flow-independent passage rate of each kept dam, default Reservoir.fish_pass
+    - monthly_weights: weight of each calendar month in the annual survival, January first
+    '''
+
+    def __init__(self, turbine_survival=TURBINE_SURVIVAL, spill_survival=SPILL_SURVIVAL, pool_mortality=POOL_MORTALITY,
+                 passage=None, monthly_weights=SPRING_MIGRATION):
+        self.turbine_survival = turbine_survival
+        self.spill_survival = spill_survival
+        self.pool_mortality = pool_mortality
+        self.passage = passage
+        self.monthly_weights = np.asarray(monthly_weights, dtype=float)
+        if self.monthly_weights.shape != (12,):
+            raise ValueError('monthly_weights needs one weight per month')
+
+    def kernel_arrays(self, reservoirs):
+        # (D, 4) turbine survival, spill survival, pool mortality per second and passage rate of each dam
+        passage = [r.fish_pass for r in reservoirs] if self.passage is None else self.passage
+        params = (self.turbine_survival, self.spill_survival, np.asarray(self.pool_mortality, dtype=float) / 86400, passage)
+        return np.ascontiguousarray(np.stack([np.broadcast_to(np.asarray(p, dtype=float), len(reservoirs)) for p in params], axis=1))
+
+    def weights(self, dates):
+        # Weight of each step from its calendar month
+        months = np.asarray(dates).astype('datetime64[M]').astype(np.int64) % 12
+        return self.monthly_weights[months]
+
+    def dam_survival(self, cascade, outflow, height, keep):
+        '''
+        Survival of each dam at each step.
+        Inputs:
+        - cascade: RiverCascade of the trajectories
+        - outflow, height: (D, T) trajectories, e.g. of CascadeResult
+        - keep: 1 if the dam is kept, 0 if it is removed, one value per dam
+        Returns (D, T) array: NaN where the outflow is NaN, 0 where nothing is released, 1 for removed dams.
+        '''
+        params = self.kernel_arrays(cascade.reservoirs)
+        survival = np.ones(outflow.shape)
+        for d, res in enumerate(cascade.reservoirs):
+            if keep[d] == 0:
+                continue
+            q = outflow[d]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                # route / (1 + mortality * storage / q) with a single division by the release
+                flow = np.minimum(q, cascade.pc_flow[d])
+                s = (flow * params[d, 0] + (q - flow) * params[d, 1]) / (q + params[d, 2] * res.storage(height[d])) * params[d, 3]
+            survival[d] = np.where(q > 0, s, 0.0)
+            survival[d][np.isnan(q)] = np.nan
+        return survival
+
+    def annual_survival(self, cascade, outflow, height, keep):
+        '''
+        Survival through every dam, averaged over each year with the monthly weights; steps with a NaN
+        outflow are left out. Gives exactly the survival of RiverCascade.annual_objectives.
+        Returns array of shape (Y,).
+        '''
+        survival = np.prod(self.dam_survival(cascade, outflow, height, keep), axis=0)
+        w = self.weights(cascade._dates)
+        valid = ~np.isnan(survival)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return cascade.years.sum(np.where(valid, w * survival, 0.0)) / cascade.years.sum(np.where(valid, w, 0.0))
@@ -0,0 +1,122 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+import numpy as np
+
+# Opt-in timing of the Reservoir and RiverCascade stages.
+# Reservoir.simulate and RiverCascade.simulate/evaluate check `active` once per call and only go
+# through Profiler.call when it is set, so nothing is recorded or timed while profiling is off.
+#
+#   with instrumentation.profile() as prof:
+#       cascade.evaluate(variables)
+#   prof.summary()
+#   prof.write_chrome_trace('trace.json')   # open in chrome://tracing or Perfetto
+
+active = None # Profiler that is currently recording, or None
+
+def _nbytes(value):
+    # Size of the arrays a stage returned (bytes)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+class Profiler:
+    '''
+    Records wall time, call count and returned array bytes of every stage.
+    - keep_events: store every call for the Chrome trace, up to max_events calls
+    - callbacks: functions called as callback(owner, stage, start, seconds, nbytes) after each call
+    '''
+
+    def __init__(self, keep_events=True, max_events=1_000_000, callbacks=()):
+        self.keep_events = keep_events
+        self.max_events = max_events
+        self.callbacks = list(callbacks)
+        self.names = {}   # id of an object -> label
+        self.totals = {}  # (owner, stage) -> [calls, seconds, max seconds, bytes]
+        self.events = []
+        self.dropped = 0
+        self.t0 = time.perf_counter()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def name(self, obj, label):
+        # Label obj, e.g. a Reservoir, in the summary and trace
+        self.names[id(obj)] = label
+
+    def label(self, obj):
+        if isinstance(obj, str):
+            return obj
+        return self.names.get(id(obj), '%s@%x' % (type(obj).__name__, id(obj)))
+
+    def call(self, owner, stage, fn, *args):
+        # Run fn(*args) and record it as one call of stage
+        start = time.perf_counter()
+        value = fn(*args)
+        seconds = time.perf_counter() - start
+        self.record(self.label(owner), stage, start - self.t0, seconds, _nbytes(value))
+        return value
+
+    def record(self, owner, stage, start, seconds, nbytes):
+        total = self.totals.get((owner, stage))
+        if total is None:
+            total = self.totals[(owner, stage)] = [0, 0.0, 0.0, 0]
+        total[0] += 1
+        total[1] += seconds
+        total[2] = max(total[2], seconds)
+        total[3] += nbytes
+        if self.keep_events:
+            if len(self.events) < self.max_events:
+                self.events.append((owner, stage, start, seconds, nbytes))
+            else:
+                self.dropped += 1
+        for callback in self.callbacks:
+            callback(owner, stage, start, seconds, nbytes)
+
+    def summary(self):
+        '''
+        Returns DataFrame indexed by (owner, stage) with calls, total/mean/max seconds and returned MB.
+        '''
+        import pandas as pd
+        rows = [{'owner': owner, 'stage': stage, 'calls': calls, 'total_s': total, 'mean_s': total / calls,
+                 'max_s': longest, 'returned_mb': nbytes / 2**20}
+                for (owner, stage), (calls, total, longest, nbytes) in self.totals.items()]
+        columns = ['owner', 'stage', 'calls', 'total_s', 'mean_s', 'max_s', 'returned_mb']
+        return pd.DataFrame(rows, columns=columns).set_index(['owner', 'stage'])
+
+    def chrome_trace(self):
+        # Trace Event Format, one complete ('X') event per recorded call and one track per owner
+        pid = os.getpid()
+        tids = {}
+        events = []
+        for owner, stage, start, seconds, nbytes in self.events:
+            if owner not in tids:
+                tids[owner] = len(tids)
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tids[owner], 'args': {'name': owner}})
+            events.append({'name': stage, 'cat': owner, 'ph': 'X', 'ts': start * 1e6, 'dur': seconds * 1e6,
+                           'pid': pid, 'tid': tids[owner], 'args': {'bytes': nbytes}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+@contextmanager
+def profile(profiler=None, **kwargs):
+    '''
+    Record every instrumented stage run inside the with block.
+    Inputs:
+    - profiler: Profiler to record into, default a new Profiler(**kwargs)
+    Yields the Profiler.
+    '''
+    global active
+    profiler = profiler or Profiler(**kwargs)
+    previous = active
+    active = profiler
+    try:
+        yield profiler
+    finally:
+        active = previous
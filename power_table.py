@@ -0,0 +1,115 @@
+import numpy as np
+import reservoir_kernels as kernels
+from Reservoir4 import rho, g
+
+# Turbine efficiency (hill chart) power tables for Reservoir.
+# The chart gives unit efficiency against head and unit load. It is turned once into a dense grid of
+# plant power against head and plant flow, with the number of running units chosen at every grid
+# point to give the most power, and the plant limited to its powerhouse flow and generation capacity.
+# During a simulation power is a bilinear lookup on that grid, a handful of operations per step like
+# the constant-efficiency formula in Reservoir.simulate_hydropower.
+#
+#   lgr.set_power_table(typical_kaplan_table(lgr, n_units=6))
+
+# Illustrative Kaplan unit chart: efficiency against unit load (fraction of rated unit flow) at
+# 70%, 85%, 100% and 115% of the design head. Replace with the plant's own chart when available.
+KAPLAN_LOADS = np.array([0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0])
+KAPLAN_RELATIVE_HEADS = np.array([0.7, 0.85, 1.0, 1.15])
+KAPLAN_EFFICIENCY = np.array([
+    [0.70, 0.78, 0.83, 0.86, 0.88, 0.89, 0.89, 0.88, 0.86],
+    [0.73, 0.81, 0.86, 0.89, 0.91, 0.92, 0.92, 0.91, 0.89],
+    [0.75, 0.83, 0.88, 0.91, 0.93, 0.94, 0.94, 0.93, 0.91],
+    [0.74, 0.82, 0.87, 0.90, 0.92, 0.93, 0.93, 0.92, 0.90]])
+
+def _chart_efficiency(heads, loads, efficiency, head, load):
+    # Bilinear interpolation in the chart, heads clipped to the chart. Loads below the chart's
+    # smallest load cannot run (efficiency 0), loads above 1 are not reached
+    i = np.clip(np.searchsorted(heads, head) - 1, 0, len(heads) - 2)
+    u = np.clip((head - heads[i]) / (heads[i + 1] - heads[i]), 0, 1)
+    j = np.clip(np.searchsorted(loads, load) - 1, 0, len(loads) - 2)
+    v = np.clip((load - loads[j]) / (loads[j + 1] - loads[j]), 0, 1)
+    e = ((efficiency[i, j] * (1 - u) + efficiency[i + 1, j] * u) * (1 - v) +
+         (efficiency[i, j + 1] * (1 - u) + efficiency[i + 1, j + 1] * u) * v)
+    return np.where(load >= loads[0], e, 0.0)
+
+class PowerTable:
+    '''
+    Plant power (kW) against head (m) and plant flow (m^3/s) on a regular grid.
+    - grid: (n_head, n_flow) power, grid[i, j] at head i * h_step and flow j * q_step
+    - n_units: number of turbine units running at each grid point, same shape
+    '''
+
+    def __init__(self, heads, loads, efficiency, n_units, unit_flow, capacity, h_max, n_head=256, n_flow=512):
+        '''
+        Inputs:
+        - heads: heads of the chart rows (m), increasing
+        - loads: unit flow of the chart columns as a fraction of unit_flow, increasing, the first is the minimum load
+        - efficiency: (len(heads), len(loads)) unit efficiency
+        - n_units: number of identical units in the powerhouse
+        - unit_flow: rated flow of one unit (m^3/s); the plant passes at most n_units * unit_flow
+        - capacity: generation capacity of the plant (kW)
+        - h_max: largest head of the grid (m), larger heads are looked up at h_max
+        - n_head, n_flow: grid size
+        '''
+        heads = np.asarray(heads, dtype=float)
+        loads = np.asarray(loads, dtype=float)
+        efficiency = np.asarray(efficiency, dtype=float)
+        self.n_units_total = n_units
+        self.capacity = capacity
+        self.h_step = h_max / (n_head - 1)
+        self.q_step = n_units * unit_flow / (n_flow - 1)
+        H = np.arange(n_head)[:, None] * self.h_step
+        Q = np.arange(n_flow)[None, :] * self.q_step
+
+        # Unit commitment: share the plant flow equally between k units and keep the best k
+        best = np.zeros((n_head, n_flow))
+        units = np.zeros((n_head, n_flow), dtype=np.int64)
+        for k in range(1, n_units + 1):
+            load = Q / (k * unit_flow)
+            e = _chart_efficiency(heads, loads, efficiency, np.broadcast_to(H, best.shape), np.broadcast_to(load, best.shape))
+            P = np.where(load <= 1 + 1e-12, rho * g * H * e * Q / 1000, 0.0) # kW
+            better = P > best
+            best[better] = P[better]
+            units[better] = k
+        self.grid = np.ascontiguousarray(np.minimum(best, capacity))
+        self.n_units = units
+
+    @classmethod
+    def from_reservoir(cls, reservoir, heads, loads, efficiency, n_units=6, **kwargs):
+        # Table for a Reservoir, its powerhouse flow split over n_units units and heads up to the full pool
+        return cls(heads, loads, efficiency, n_units, reservoir.pc * .0283 / n_units, reservoir.capacity,
+                   reservoir.pool_elev - reservoir.tail_elev, **kwargs)
+
+    def power(self, head, flow):
+        '''
+        Plant power (kW) by bilinear interpolation. Heads and flows outside the grid are clipped to it,
+        NaN inputs give NaN. Runs the compiled lookup when Numba is installed, with the same result.
+        '''
+        head, flow = np.broadcast_arrays(np.asarray(head, dtype=float), np.asarray(flow, dtype=float))
+        if kernels.BACKEND != 'python':
+            P = kernels.table_lookup(self.grid, self.h_step, self.q_step, np.ascontiguousarray(head).ravel(),
+                                     np.ascontiguousarray(flow).ravel())
+            return P.reshape(head.shape)
+        nh, nq = self.grid.shape
+        invalid = np.isnan(head) | np.isnan(flow)
+        x = np.clip(np.where(invalid, 0.0, head) / self.h_step, 0, nh - 1)
+        y = np.clip(np.where(invalid, 0.0, flow) / self.q_step, 0, nq - 1)
+        i = np.minimum(x.astype(np.int64), nh - 2)
+        j = np.minimum(y.astype(np.int64), nq - 2)
+        u = x - i
+        v = y - j
+        k = i * nq + j # flat index, faster to gather than [i, j]
+        G = self.grid.ravel()
+        P = (G[k] * (1 - u) + G[k + nq] * u) * (1 - v) + (G[k + 1] * (1 - u) + G[k + nq + 1] * u) * v
+        return np.where(invalid, np.nan, P)
+
+def typical_kaplan_table(reservoir, n_units=6, **kwargs):
+    # PowerTable of a Reservoir from the illustrative Kaplan chart, with the full pool head as design head
+    design_head = reservoir.pool_elev - reservoir.tail_elev
+    return PowerTable.from_reservoir(reservoir, KAPLAN_RELATIVE_HEADS * design_head, KAPLAN_LOADS, KAPLAN_EFFICIENCY,
+                                     n_units, **kwargs)
+
+def constant_efficiency_table(reservoir, eta=0.8, **kwargs):
+    # PowerTable with one unit at constant efficiency, the same model as the closed-form simulate_hydropower
+    h_max = reservoir.pool_elev - reservoir.tail_elev
+    return PowerTable([0, h_max], [0, 1], [[eta, eta], [eta, eta]], 1, reservoir.pc * .0283, reservoir.capacity, h_max, **kwargs)
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+import numpy as np
+
+class PrefixCache:
+    '''
+    Bounded LRU cache of per-dam trajectories for RiverCascade.
+    A dam's outflow only depends on its own parameters, the parameters of every dam upstream
+    and the input data, so each entry is keyed on that whole upstream prefix. The cascade looks
+    up the longest cached prefix and only simulates from the first changed dam downstream.
+    '''
+
+    def __init__(self, max_bytes=256 * 2**20, decimals=9):
+        '''
+        Inputs:
+        - max_bytes: memory cap for the stored trajectories (bytes)
+        - decimals: parameters are rounded to this many decimals before they are used as keys
+        '''
+        self.max_bytes = max_bytes
+        self.decimals = decimals
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def dam_key(self, mef, h1, m, keep, alfa, beta):
+        # Key of one dam's settings. A removed dam passes inflow through, so its release parameters don't matter
+        if keep == 0:
+            return (0,)
+        return (1,) + tuple(np.round([mef, h1, m, alfa, beta], self.decimals).tolist())
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, outflow, height):
+        if key in self.entries:
+            return
+        outflow.flags.writeable = False
+        height.flags.writeable = False
+        size = outflow.nbytes + height.nbytes
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (outflow, height)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (o, h) = self.entries.popitem(last=False)
+            self.nbytes -= o.nbytes + h.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.entries), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
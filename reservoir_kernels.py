@@ -0,0 +1,427 @@
+import importlib.util
+import numpy as np
+
+# Time-step kernels for the Reservoir lake models.
+# The loops only touch floats and arrays so Numba can compile them. When Numba is not
+# installed BACKEND is 'python' and Reservoir keeps using its own loops.
+# Numba itself is imported the first time a kernel is looked up (see __getattr__ below), so
+# processes that import the models but never run a kernel don't pay for it.
+
+BACKEND = 'numba' if importlib.util.find_spec('numba') is not None else 'python'
+
+def _reg_release(h, h0, alfa, beta, mef, h1, m):
+    # Same steps as Reservoir.regulated_release for a scalar level
+    if h <= h0:
+        return 0.0 # No flow possible
+    r = mef + m * (h - h1)
+    if r < mef:
+        r = mef
+    natural_flow = beta * (h - h0) ** alfa
+    if natural_flow < r:
+        r = natural_flow # Do not exceed natural flow ever
+    if r < 0:
+        r = 0.0 # Release cannot be negative
+    return r
+
+def _grid_lookup(x, x0, step, values, n):
+    # Same linear interpolation on a uniform grid as stage_storage._uniform_lookup, end segments extended
+    pos = (x - x0) / step
+    if pos != pos:
+        return np.nan
+    if pos < 0:
+        i = 0
+    elif pos > n - 2:
+        i = n - 2
+    else:
+        i = int(np.floor(pos))
+    return values[i] + (pos - i) * (values[i + 1] - values[i])
+
+def _level(s, S, h_bottom, curves, meta):
+    # Level [m] of storage s: the prism s / S + h_bottom when meta[0] == 0, else the StageStorage grids in
+    # curves (see StageStorage.kernel_arrays)
+    if meta[0] == 0:
+        return s / S + h_bottom
+    return _grid_lookup(s, meta[1], meta[2], curves[0], int(meta[0]))
+
+def _storage(h, S, h_bottom, curves, meta):
+    # Storage [m^3] at level h, inverse of _level
+    if meta[0] == 0:
+        return S * (h - h_bottom)
+    return _grid_lookup(h, meta[3], meta[4], curves[1], int(meta[0]))
+
+def _reg_lake(h_in, n, S, h_bottom, h0, alfa, beta, mef, h1, m, max_storage, delta, curves, meta):
+    T = n.shape[0]
+    h = np.full(T, np.nan)  # Lake level [m]
+    s = np.full(T, np.nan)  # Lake storage [m^3]
+    r = np.full(T, np.nan)  # Lake outflows [m^3/s]
+    h[0] = h_in
+    s[0] = _storage(h_in, S, h_bottom, curves, meta)
+    for i in range(T - 1):
+        release = _reg_release(h[i], h0, alfa, beta, mef, h1, m)
+        # Clip to ensure no negative storage. A NaN inflow leaves the release unchanged, like min()
+        available = s[i] / delta + n[i]
+        if available < release:
+            release = available
+        raw_storage = s[i] + (n[i + 1] - release) * delta
+        if raw_storage > max_storage:
+            s[i + 1] = max_storage
+            release = release + (raw_storage - max_storage) / delta
+        else:
+            s[i + 1] = raw_storage
+        r[i + 1] = release
+        h[i + 1] = _level(s[i + 1], S, h_bottom, curves, meta)
+    return s, h, r
+
+def _reg_lake_batch(h_in, n, S, h_bottom, h0, alfa, beta, mef, h1, m, max_storage, delta, curves, meta):
+    # n has shape (1, T) when all candidates share the inflow, otherwise (P, T)
+    P = mef.shape[0]
+    T = n.shape[1]
+    s = np.empty((P, T))
+    h = np.empty((P, T))
+    r = np.empty((P, T))
+    for p in range(P):
+        row = p if n.shape[0] > 1 else 0
+        s[p], h[p], r[p] = reg_lake(h_in[p], n[row], S, h_bottom, h0, alfa, beta, mef[p], h1[p], m[p], max_storage, delta, curves, meta)
+    return s, h, r
+
+def _nat_lake(h_in, n, S, h_bottom, h0, alfa, beta, delta, curves, meta):
+    T = n.shape[0]
+    h = np.full(T, np.nan)  # Lake level [m]
+    s = np.full(T, np.nan)  # Lake storage [m^3]
+    r = np.full(T, np.nan)  # Lake release [m^3/s]
+    h[0] = h_in
+    s[0] = _storage(h_in, S, h_bottom, curves, meta)
+    for i in range(T - 1):
+        release = beta * (h[i] - h0) ** alfa if h[i] > h0 else 0.0
+        available = s[i] / delta + n[i]
+        if available < release:
+            release = available
+        r[i + 1] = release
+        s[i + 1] = s[i] + (n[i + 1] - release) * delta
+        h[i + 1] = _level(s[i + 1], S, h_bottom, curves, meta)
+    return s, h, r
+
+def _nat_lake_batch(h_in, n, S, h_bottom, h0, alfa, beta, delta, curves, meta):
+    # n has shape (1, T) when all candidates share the inflow, otherwise (P, T)
+    P = alfa.shape[0]
+    T = n.shape[1]
+    s = np.empty((P, T))
+    h = np.empty((P, T))
+    r = np.empty((P, T))
+    for p in range(P):
+        row = p if n.shape[0] > 1 else 0
+        s[p], h[p], r[p] = nat_lake(h_in[p], n[row], S, h_bottom, h0, alfa[p], beta[p], delta, curves, meta)
+    return s, h, r
+
+def _cascade_start(inflow0, tributaries0, keep, h_in, S, h_bottom, h0, curves, meta, s, n_prev, h_prev, outflow0, height0):
+    # Initial conditions of every dam on the first step. Fills the carried state s, n_prev and h_prev
+    up = inflow0
+    for d in range(keep.shape[0]):
+        n = up + tributaries0[d]
+        if keep[d] != 0:
+            height0[d] = h_in[d]
+            s[d] = _storage(h_in[d], S[d], h_bottom[d], curves[d], meta[d])
+            outflow0[d] = np.nan
+        else: # removed dam passes inflow straight through
+            height0[d] = h0[d]
+            s[d] = 0.0
+            outflow0[d] = n
+        n_prev[d] = n
+        h_prev[d] = height0[d]
+        up = outflow0[d]
+
+def _cascade_steps(inflow, tributaries, keep, S, h_bottom, h0, alfa, beta, mef, h1, m, max_storage, delta, shape, phase,
+                   curves, meta, s, n_prev, h_prev, outflow, height):
+    # Advance the chain over the steps of inflow, starting from the carried state s (storage [m^3]),
+    # n_prev (previous step's net inflow [m^3/s]) and h_prev (previous step's level [m]) of each dam.
+    # shape (D, K) scales the regulated release of each of the K steps of a day, phase is the step
+    # of the day of inflow[0]. A shape of ones (D, 1) is the plain daily model. curves and meta hold the
+    # geometry of each dam, see _level.
+    D, T = tributaries.shape
+    K = shape.shape[1]
+    for i in range(T):
+        up = inflow[i]
+        k = (phase + i) % K
+        for d in range(D):
+            n = up + tributaries[d, i]
+            if keep[d] != 0:
+                f = shape[d, k]
+                release = _reg_release(h_prev[d], h0[d], alfa[d], beta[d], f * mef[d], h1[d], f * m[d])
+                available = s[d] / delta + n_prev[d]
+                if available < release:
+                    release = available
+                raw_storage = s[d] + (n - release) * delta
+                if raw_storage > max_storage[d]:
+                    s[d] = max_storage[d]
+                    release = release + (raw_storage - max_storage[d]) / delta
+                else:
+                    s[d] = raw_storage
+                outflow[d, i] = release
+                height[d, i] = _level(s[d], S[d], h_bottom[d], curves[d], meta[d])
+            else:
+                outflow[d, i] = n
+                height[d, i] = h0[d]
+            n_prev[d] = n
+            h_prev[d] = height[d, i]
+            up = outflow[d, i]
+
+def _cascade(inflow, tributaries, keep, h_in, S, h_bottom, h0, alfa, beta, mef, h1, m, max_storage, delta, shape, curves, meta):
+    # Step-major loop over the whole chain: each step's release flows straight into the next dam.
+    # Per-dam values are arrays of length D ordered upstream to downstream.
+    D, T = tributaries.shape
+    outflow = np.empty((D, T))
+    height = np.empty((D, T))
+    s = np.empty(D)       # current storage of each dam [m^3]
+    n_prev = np.empty(D)  # previous step's net inflow of each dam [m^3/s]
+    h_prev = np.empty(D)  # previous step's level of each dam [m]
+    _cascade_start(inflow[0], tributaries[:, 0], keep, h_in, S, h_bottom, h0, curves, meta, s, n_prev, h_prev, outflow[:, 0], height[:, 0])
+    _cascade_steps(inflow[1:], tributaries[:, 1:], keep, S, h_bottom, h0, alfa, beta, mef, h1, m, max_storage, delta, shape, 1,
+                   curves, meta, s, n_prev, h_prev, outflow[:, 1:], height[:, 1:])
+    return outflow, height
+
+def _pairwise_block(a, lo, n):
+    # NumPy's pairwise summation of a block of at most 128 values
+    if n < 8:
+        res = 0.0
+        for i in range(lo, lo + n):
+            res += a[i]
+        return res
+    r0, r1, r2, r3 = a[lo], a[lo + 1], a[lo + 2], a[lo + 3]
+    r4, r5, r6, r7 = a[lo + 4], a[lo + 5], a[lo + 6], a[lo + 7]
+    i = 8
+    while i < n - (n % 8):
+        r0 += a[lo + i]
+        r1 += a[lo + i + 1]
+        r2 += a[lo + i + 2]
+        r3 += a[lo + i + 3]
+        r4 += a[lo + i + 4]
+        r5 += a[lo + i + 5]
+        r6 += a[lo + i + 6]
+        r7 += a[lo + i + 7]
+        i += 8
+    res = ((r0 + r1) + (r2 + r3)) + ((r4 + r5) + (r6 + r7))
+    while i < n:
+        res += a[lo + i]
+        i += 1
+    return res
+
+def _pairwise_sum(a, lo, n):
+    # Sum of a[lo:lo + n] in the same order as NumPy's pairwise summation, so annual sums match np.add.reduceat.
+    # NumPy halves blocks over 128 values recursively; this walks the same tree with explicit stacks,
+    # because Numba cannot cache recursive functions.
+    node_lo = np.empty(128, dtype=np.int64)
+    node_n = np.empty(128, dtype=np.int64)
+    node_done = np.zeros(128, dtype=np.int64)
+    values = np.empty(128)
+    top = 0
+    nv = 0
+    node_lo[0] = lo
+    node_n[0] = n
+    node_done[0] = 0
+    while top >= 0:
+        lo_k, n_k, done = node_lo[top], node_n[top], node_done[top]
+        top -= 1
+        if n_k <= 128:
+            values[nv] = _pairwise_block(a, lo_k, n_k)
+            nv += 1
+        elif done:
+            values[nv - 2] = values[nv - 2] + values[nv - 1]
+            nv -= 1
+        else:
+            n2 = n_k // 2
+            n2 -= n2 % 8
+            # Combine after both halves, left half first
+            top += 1
+            node_lo[top], node_n[top], node_done[top] = lo_k, n_k, 1
+            top += 1
+            node_lo[top], node_n[top], node_done[top] = lo_k + n2, n_k - n2, 0
+            top += 1
+            node_lo[top], node_n[top], node_done[top] = lo_k, n2, 0
+    return values[0]
+
+def _table_power(grid, nh, nq, h_step, q_step, head, flow):
+    # Same bilinear lookup as PowerTable.power for one step
+    x = head / h_step
+    x = 0.0 if x < 0 else (nh - 1.0 if x > nh - 1 else x)
+    y = flow / q_step
+    y = 0.0 if y < 0 else (nq - 1.0 if y > nq - 1 else y)
+    i = min(int(x), nh - 2)
+    j = min(int(y), nq - 2)
+    u = x - i
+    v = y - j
+    return (grid[i, j] * (1 - u) + grid[i + 1, j] * u) * (1 - v) + (grid[i, j + 1] * (1 - u) + grid[i + 1, j + 1] * u) * v
+
+def _table_lookup(grid, h_step, q_step, head, flow):
+    # PowerTable.power over 1-D arrays, NaN where head or flow is NaN
+    nh, nq = grid.shape
+    P = np.empty(head.shape[0])
+    for k in range(head.shape[0]):
+        if head[k] == head[k] and flow[k] == flow[k]:
+            P[k] = _table_power(grid, nh, nq, h_step, q_step, head[k], flow[k])
+        else:
+            P[k] = np.nan
+    return P
+
+def _dam_survival(q, storage, pc_flow, turbine, spill, mortality, passage):
+    # Same survival of one step as fish_passage.FishPassage.dam_survival: powerhouse and spill routes
+    # weighted by their share of the release, times the pool term 1 / (1 + mortality * travel time)
+    # and the dam's passage rate. mortality is per second, so both terms share one division by the release
+    if q != q:
+        return np.nan
+    if q <= 0:
+        return 0.0
+    flow = q if q < pc_flow else pc_flow
+    return (flow * turbine + (q - flow) * spill) / (q + mortality * storage) * passage
+
+def _cascade_objectives(inflow, tributaries, keep, h_in, S, h_bottom, h0, alfa, beta, mef, h1, m, max_storage, delta, shape,
+                        hours, year_offsets, pc_flow, capacity, rho, g, eta, tables, table_meta, curves, meta, fish, fish_weights):
+    # Annual minimum outflow [m^3/s] and annual hydropower [kWh] of every dam, shape (D, Y), and the annual
+    # fish survival through the cascade, shape (Y,), without the full-length trajectories: the chain
+    # advances one year at a time into a buffer of one year of steps.
+    # Hydropower follows Reservoir.simulate_hydropower with `hours` per step, NaN steps count as zero like YearIndex.sum.
+    # Dams with a power table have its grid in tables[d] and (n_head, n_flow, h_step, q_step) in table_meta[d],
+    # the others have n_head = 0 and use the constant efficiency eta.
+    # fish holds (turbine, spill, mortality per second, passage) of each dam and fish_weights the weight of each step, see
+    # fish_passage.FishPassage; an empty fish_weights skips the survival (NaN).
+    D, T = tributaries.shape
+    Y = year_offsets.shape[0]
+    annual_min = np.empty((D, Y))
+    annual_hydro = np.empty((D, Y))
+    annual_fish = np.full(Y, np.nan)
+    L = 0
+    for k in range(Y):
+        end = year_offsets[k + 1] if k + 1 < Y else T
+        L = max(L, end - year_offsets[k])
+    outflow = np.empty((D, L))
+    height = np.empty((D, L))
+    energy = np.empty(L)
+    weight = np.empty(L)
+    survival = np.empty(L)
+    s = np.empty(D)
+    n_prev = np.empty(D)
+    h_prev = np.empty(D)
+    for k in range(Y):
+        start = year_offsets[k]
+        end = year_offsets[k + 1] if k + 1 < Y else T
+        n = end - start
+        first = 0
+        if k == 0:
+            _cascade_start(inflow[0], tributaries[:, 0], keep, h_in, S, h_bottom, h0, curves, meta, s, n_prev, h_prev,
+                           outflow[:, 0], height[:, 0])
+            first = 1
+        _cascade_steps(inflow[start + first:end], tributaries[:, start + first:end], keep, S, h_bottom, h0, alfa, beta, mef, h1, m,
+                       max_storage, delta, shape, start + first, curves, meta, s, n_prev, h_prev, outflow[:, first:n], height[:, first:n])
+        for d in range(D):
+            low = np.nan
+            nh = int(table_meta[d, 0])
+            nq = int(table_meta[d, 1])
+            for i in range(n):
+                q = outflow[d, i]
+                if not (q >= low): # NaN days are skipped, like np.fmin
+                    if q == q:
+                        low = q
+                if keep[d] != 0 and q == q and nh > 0:
+                    head = height[d, i] - h0[d]
+                    energy[i] = 0.0 if head != head else _table_power(tables[d], nh, nq, table_meta[d, 2], table_meta[d, 3], head, q) * hours
+                elif keep[d] != 0 and q == q:
+                    flow = q if q < pc_flow[d] else pc_flow[d]
+                    P = rho * g * (height[d, i] - h0[d]) * eta * flow
+                    if P < 0:
+                        P = 0.0
+                    P = P / 1000
+                    if P > capacity[d]:
+                        P = capacity[d]
+                    energy[i] = P * hours
+                else:
+                    energy[i] = 0.0
+            annual_min[d, k] = low
+            annual_hydro[d, k] = energy[0] + _pairwise_sum(energy, 1, n - 1)
+        if fish_weights.shape[0] > 0:
+            # Weighted mean over the year's steps of the survival through every kept dam, NaN steps skipped.
+            # Dam by dam into the product buffer; steps outside the season (weight 0) are not evaluated.
+            # Prism storage is inlined, passing the curve arrays to _storage on every step costs more than the rest
+            for i in range(n):
+                survival[i] = 1.0
+            for d in range(D):
+                if keep[d] != 0:
+                    curve = curves[d]
+                    cmeta = meta[d]
+                    prism = cmeta[0] == 0
+                    for i in range(n):
+                        if fish_weights[start + i] != 0:
+                            h = height[d, i]
+                            storage = S[d] * (h - h_bottom[d]) if prism else _storage(h, S[d], h_bottom[d], curve, cmeta)
+                            survival[i] *= _dam_survival(outflow[d, i], storage, pc_flow[d], fish[d, 0], fish[d, 1],
+                                                         fish[d, 2], fish[d, 3])
+            for i in range(n):
+                p = survival[i]
+                if fish_weights[start + i] != 0 and p == p:
+                    weight[i] = fish_weights[start + i]
+                    energy[i] = weight[i] * p
+                else:
+                    weight[i] = 0.0
+                    energy[i] = 0.0
+            total = weight[0] + _pairwise_sum(weight, 1, n - 1)
+            if total > 0:
+                annual_fish[k] = (energy[0] + _pairwise_sum(energy, 1, n - 1)) / total
+    return annual_min, annual_hydro, annual_fish
+
+# Kernels compiled together, private helpers first: a compiled kernel binds the helpers it calls when
+# it is compiled, so every name is rebound before the first call
+_HELPERS = ('_reg_release', '_grid_lookup', '_level', '_storage', '_cascade_start', '_cascade_steps', '_pairwise_block',
+            '_pairwise_sum', '_table_power', '_dam_survival')
+_KERNELS = {'reg_lake': '_reg_lake', 'reg_lake_batch': '_reg_lake_batch', 'nat_lake': '_nat_lake',
+            'nat_lake_batch': '_nat_lake_batch', 'cascade_start': '_cascade_start', 'cascade_steps': '_cascade_steps',
+            'cascade': '_cascade', 'cascade_objectives': '_cascade_objectives', 'table_lookup': '_table_lookup'}
+
+def _load():
+    # Bind the public kernel names, compiled with Numba when BACKEND is 'numba'
+    global BACKEND
+    names = globals()
+    try:
+        import numba
+    except ImportError:
+        numba = None
+        BACKEND = 'python'
+    if numba is not None and BACKEND == 'numba':
+        for name in _HELPERS:
+            names[name] = numba.njit(cache=True)(names[name])
+        for public, private in _KERNELS.items():
+            names[public] = names[private] if private in _HELPERS else numba.njit(cache=True)(names[private])
+    else:
+        for public, private in _KERNELS.items():
+            names[public] = names[private]
+
+def __getattr__(name):
+    # First lookup of a kernel, e.g. kernels.reg_lake
+    if name in _KERNELS:
+        _load()
+        return globals()[name]
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+def check_backends(reservoir, param, h_in, n):
+    """
+    Run a reservoir on both backends and report how far the trajectories are apart.
+
+    Parameters:
+    - reservoir (Reservoir): Reservoir to check
+    - param (dict): Regulated release parameters with keys 'mef', 'h1', 'm'
+    - h_in (float): Initial lake level
+    - n (array-like): Net inflows trajectory
+
+    Returns:
+    - dict: largest absolute difference in storage, level and release for the regulated and natural lake
+    """
+    backend = reservoir.backend
+    out = {}
+    try:
+        runs = {}
+        for b in ('python', BACKEND):
+            reservoir.backend = b
+            runs[b] = (reservoir.simulation_reg_lake(1, param, h_in, n), reservoir.simulation_nat_lake(1, h_in, n))
+    finally:
+        reservoir.backend = backend
+    for k, model in enumerate(('reg', 'nat')):
+        for name, a, b in zip(('storage', 'level', 'release'), runs['python'][k], runs[BACKEND][k]):
+            out[model + '_' + name] = np.nanmax(np.abs(a - b))
+    return out
@@ -0,0 +1,256 @@
+import json
+import os
+import zlib
+import numpy as np
+
+# Columnar store for the solutions of an optimization run and their trajectories.
+# Decision variables and objectives are small and go into plain .npy files. Each trajectory
+# (outflow, height, hydro) of each dam is a column of its own: a (solutions, steps) array cut into
+# chunks of chunk_solutions x chunk_steps, every chunk byte-shuffled (the bytes of the values grouped by
+# position, so the slowly varying sign, exponent and leading mantissa bytes sit together) and zlib
+# compressed, the chunks of a column written one after the other into one file with an index of
+# their offsets. A read only decompresses the chunks it touches.
+#
+#   save_solutions('runs/nsga_front', cascade, nondominated(algorithm.result))
+#   store = ResultStore('runs/nsga_front')
+#   store.read('height', 'LGS', slice(10, 41), '2001-01-01', '2001-12-31')   # (31, 365)
+#   store.result(37)                                                       # CascadeResult, no re-simulation
+
+VERSION = 1
+FIELDS = ('outflow', 'height', 'hydro') # CascadeResult trajectories
+
+def _compress(block, level):
+    block = np.ascontiguousarray(block)
+    shuffled = np.frombuffer(block.tobytes(), np.uint8).reshape(-1, block.itemsize).T
+    return zlib.compress(shuffled.tobytes(), level)
+
+def _decompress(data, dtype, shape):
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(zlib.decompress(data), np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(shuffled.T).view(dtype).reshape(shape)
+
+class ResultWriter:
+    '''
+    Writes solutions to a new result store, chunk_solutions at a time.
+    Add solutions with append and finish with close; the manifest is written last, so an interrupted
+    write is never read as a complete store.
+    '''
+
+    def __init__(self, path, names, dates, variable_names, objective_names, fields=FIELDS, year_start_month=1,
+                 chunk_solutions=64, chunk_steps=1024, level=1, dtype=np.float64):
+        '''
+        Inputs:
+        - path: folder of the store, created if missing
+        - names: dam names
+        - dates: dates of the trajectory steps
+        - variable_names, objective_names: column names of the variables and objectives
+        - fields: trajectories stored for every dam, empty to store variables and objectives only
+        - year_start_month: years of the record, for ResultStore.result
+        - chunk_solutions, chunk_steps: chunk size of the trajectory columns
+        - level: zlib compression level
+        - dtype: dtype of the stored trajectories, np.float32 halves the size at float32 precision
+        '''
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.names = list(names)
+        self.dates = np.asarray(dates).astype('datetime64[s]')
+        self.variable_names = list(variable_names)
+        self.objective_names = list(objective_names)
+        self.fields = list(fields)
+        self.year_start_month = year_start_month
+        self.chunk_solutions = chunk_solutions
+        self.chunk_steps = chunk_steps
+        self.level = level
+        self.dtype = np.dtype(dtype)
+        self._variables = []
+        self._objectives = []
+        self._pending = {field: [] for field in self.fields} # (n, D, T) blocks not yet written
+        self._n_pending = 0
+        self._files = {}
+        self._offsets = {}
+        for field in self.fields:
+            for name in self.names:
+                column = field + '_' + name
+                self._files[column] = open(os.path.join(path, column + '.bin'), 'wb')
+                self._offsets[column] = [0]
+
+    def append(self, variables, objectives, trajectories=None):
+        '''
+        Add solutions.
+        Inputs:
+        - variables: (n, nvars) decision vectors
+        - objectives: (n, nobjs) objective values
+        - trajectories: dict of field -> (n, D, T) array, needed when the store has fields
+        '''
+        variables = np.atleast_2d(np.asarray(variables, dtype=float))
+        self._variables.append(variables)
+        self._objectives.append(np.asarray(objectives, dtype=float).reshape(len(variables), -1))
+        if self.fields:
+            for field in self.fields:
+                block = np.asarray(trajectories[field])
+                if block.shape != (len(variables), len(self.names), len(self.dates)):
+                    raise ValueError('%s has shape %s, expected %s' % (field, block.shape, (len(variables), len(self.names), len(self.dates))))
+                self._pending[field].append(block.astype(self.dtype))
+            self._n_pending += len(variables)
+            while self._n_pending >= self.chunk_solutions:
+                self._flush(self.chunk_solutions)
+
+    def _flush(self, n):
+        # Write the first n pending solutions as one row of chunks of every column
+        for field in self.fields:
+            pending = np.concatenate(self._pending[field]) if len(self._pending[field]) > 1 else self._pending[field][0]
+            block, rest = pending[:n], pending[n:]
+            self._pending[field] = [rest] if len(rest) else []
+            for d, name in enumerate(self.names):
+                column = field + '_' + name
+                for t in range(0, len(self.dates), self.chunk_steps):
+                    data = _compress(block[:, d, t:t + self.chunk_steps], self.level)
+                    self._files[column].write(data)
+                    self._offsets[column].append(self._offsets[column][-1] + len(data))
+        self._n_pending -= n
+
+    def close(self):
+        if self._n_pending:
+            self._flush(self._n_pending)
+        for column, f in self._files.items():
+            f.close()
+            np.save(os.path.join(self.path, column + '.offsets.npy'), np.array(self._offsets[column], dtype=np.int64))
+        variables = np.concatenate(self._variables) if self._variables else np.zeros((0, len(self.variable_names)))
+        objectives = np.concatenate(self._objectives) if self._objectives else np.zeros((0, len(self.objective_names)))
+        np.save(os.path.join(self.path, 'variables.npy'), variables)
+        np.save(os.path.join(self.path, 'objectives.npy'), objectives)
+        np.save(os.path.join(self.path, 'dates.npy'), self.dates)
+        manifest = {'version': VERSION, 'length': len(variables), 'names': self.names, 'fields': self.fields,
+                    'variable_names': self.variable_names, 'objective_names': self.objective_names,
+                    'year_start_month': self.year_start_month, 'chunk_solutions': self.chunk_solutions,
+                    'chunk_steps': self.chunk_steps, 'dtype': self.dtype.str}
+        with open(os.path.join(self.path, 'manifest.json'), 'w') as out:
+            json.dump(manifest, out, indent=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        # An exception leaves the store without a manifest
+        if exc_type is None:
+            self.close()
+        else:
+            for f in self._files.values():
+                f.close()
+
+class ResultStore:
+    '''
+    Read-only result store. variables and objectives are memory-mapped (N, nvars) and (N, nobjs) arrays;
+    trajectories are read by column and slice with read, only decompressing the chunks of the slice.
+    '''
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        if self.manifest['version'] != VERSION:
+            raise ValueError('result store version %s, expected %d' % (self.manifest['version'], VERSION))
+        self.path = path
+        self.names = self.manifest['names']
+        self.fields = self.manifest['fields']
+        self.variable_names = self.manifest['variable_names']
+        self.objective_names = self.manifest['objective_names']
+        self.variables = np.load(os.path.join(path, 'variables.npy'), mmap_mode='r')
+        self.objectives = np.load(os.path.join(path, 'objectives.npy'), mmap_mode='r')
+        self.dates = np.load(os.path.join(path, 'dates.npy'))
+        self._offsets = {}
+
+    def __len__(self):
+        return self.manifest['length']
+
+    def table(self):
+        # DataFrame of the variables and objectives, one row per solution
+        import pandas as pd
+        return pd.DataFrame(np.hstack([self.variables, self.objectives]), columns=self.variable_names + self.objective_names)
+
+    def window(self, start=None, end=None):
+        # Slice of the steps with start <= date <= end
+        i = 0 if start is None else np.searchsorted(self.dates, np.datetime64(start, 's'), side='left')
+        j = len(self.dates) if end is None else np.searchsorted(self.dates, np.datetime64(end, 's'), side='right')
+        return slice(int(i), int(j))
+
+    def read(self, field, name, solutions=None, start=None, end=None):
+        '''
+        Trajectory of one dam for a selection of solutions and dates.
+        Inputs:
+        - field: 'outflow', 'height' or 'hydro' (see CascadeResult)
+        - name: dam name
+        - solutions: solution index, slice, index array or boolean mask, default all
+        - start, end: date range, both included, default the whole record
+        Returns (n, T) array, or (T,) for a single solution index.
+        '''
+        if field not in self.fields:
+            raise KeyError('the store has no %s trajectories' % field)
+        column = field + '_' + name
+        if name not in self.names:
+            raise KeyError(name)
+        if column not in self._offsets:
+            self._offsets[column] = np.load(os.path.join(self.path, column + '.offsets.npy'))
+        offsets = self._offsets[column]
+        N, T = len(self), len(self.dates)
+        cs, ct = self.manifest['chunk_solutions'], self.manifest['chunk_steps']
+        n_time = -(-T // ct)
+        single = np.ndim(solutions) == 0 and solutions is not None and not isinstance(solutions, slice)
+        rows = np.arange(N)[slice(None) if solutions is None else solutions]
+        rows = np.atleast_1d(rows)
+        steps = self.window(start, end)
+        out = np.empty((len(rows), steps.stop - steps.start), dtype=self.manifest['dtype'])
+
+        with open(os.path.join(self.path, column + '.bin'), 'rb') as f:
+            for c in np.unique(rows // cs):
+                picked = np.flatnonzero(rows // cs == c)
+                n = min(cs, N - c * cs)
+                for k in range(steps.start // ct, -(-steps.stop // ct) if steps.stop > steps.start else 0):
+                    # Chunk k of solution chunk c, and the part of it inside the window
+                    i = c * n_time + k
+                    f.seek(offsets[i])
+                    t0 = k * ct
+                    block = _decompress(f.read(offsets[i + 1] - offsets[i]), self.manifest['dtype'], (n, min(ct, T - t0)))
+                    lo, hi = max(steps.start, t0), min(steps.stop, t0 + ct)
+                    out[picked, lo - steps.start:hi - steps.start] = block[rows[picked] - c * cs, lo - t0:hi - t0]
+        return out[0] if single else out
+
+    def result(self, i):
+        # CascadeResult of solution i with the trajectories cascade.simulate gave, dates as datetime64
+        from river_cascade import CascadeResult
+        from year_index import YearIndex
+        arrays = {field: np.array([self.read(field, name, i) for name in self.names], dtype=float) for field in FIELDS}
+        avg_hydro = YearIndex(self.dates, self.manifest['year_start_month']).sum(arrays['hydro']).mean(axis=1)
+        return CascadeResult(self.names, self.dates, arrays['outflow'], arrays['height'], arrays['hydro'], avg_hydro)
+
+def save_solutions(path, cascade, solutions, trajectories=True, batch=64, **kwargs):
+    '''
+    Write Platypus solutions of DamOptimization (e.g. nondominated(algorithm.result)) to a result store,
+    simulating each one on the cascade for its trajectories.
+    Inputs:
+    - path: folder of the store
+    - cascade: RiverCascade the solutions were optimized on
+    - solutions: evaluated solutions
+    - trajectories: False to store variables and objectives only
+    - batch: solutions simulated before they are handed to the writer
+    - kwargs: passed on to ResultWriter (chunk sizes, level, dtype)
+    Returns ResultStore.
+    '''
+    from dam_optimization import decode_variables
+    D = len(cascade.reservoirs)
+    names = ['%s_%s' % (var, name) for var in ('mef', 'h1', 'm', 'keep') for name in cascade.names]
+    variables = decode_variables(solutions) if len(solutions) else np.zeros((0, 4 * D))
+    # Maximized objectives back to their sign, like the batch_run front table
+    objectives = np.array([s.objectives[:] for s in solutions], dtype=float).reshape(len(solutions), -1)
+    objectives[:, 1:] = -objectives[:, 1:]
+    objective_names = ['num_below_min', 'total_hydro', 'fish_survival'][:objectives.shape[1]]
+    fields = FIELDS if trajectories else ()
+    with ResultWriter(path, cascade.names, cascade.dates.values, names, objective_names, fields, cascade.years.start_month,
+                      **kwargs) as writer:
+        for i in range(0, len(variables), batch):
+            v = variables[i:i + batch]
+            block = None
+            if trajectories:
+                results = [cascade.simulate(x[:D], x[D:2*D], x[2*D:3*D], x[3*D:4*D]) for x in v]
+                block = {field: np.array([getattr(r, field) for r in results]) for field in FIELDS}
+            writer.append(v, objectives[i:i + batch], block)
+    return ResultStore(path)
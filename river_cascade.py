@@ -0,0 +1,325 @@
+import hashlib
+import time
+import numpy as np
+import reservoir_kernels as kernels
+import instrumentation
+from year_index import YearIndex
+from Reservoir4 import rho, g, eta
+
+def stack_geometry(reservoirs):
+    # Elevation-storage curves of the reservoirs for the kernels, as (D, 2, N) curves and (D, 5) meta, see Reservoir.set_geometry
+    N = max(r.curves.shape[1] for r in reservoirs)
+    curves = np.zeros((len(reservoirs), 2, N))
+    for d, r in enumerate(reservoirs):
+        curves[d, :, :r.curves.shape[1]] = r.curves
+    return curves, np.array([r.curve_meta for r in reservoirs])
+
+class CascadeResult:
+    '''
+    Trajectories of one cascade simulation. Arrays have one row per dam, ordered upstream to downstream.
+    - outflow: (D, T) reservoir outflow (m^3/s)
+    - height: (D, T) reservoir water level (m)
+    - hydro: (D, T) daily hydropower (kWh)
+    - avg_hydro: (D,) average annual hydropower (kWh/year)
+    '''
+
+    def __init__(self, names, dates, outflow, height, hydro, avg_hydro):
+        self.names = list(names)
+        self.dates = dates
+        self.outflow = outflow
+        self.height = height
+        self.hydro = hydro
+        self.avg_hydro = avg_hydro
+
+    def __getitem__(self, name):
+        d = self.names.index(name)
+        return {'outflow': self.outflow[d], 'height': self.height[d], 'hydro': self.hydro[d], 'avg_hydro': self.avg_hydro[d]}
+
+class RiverCascade:
+
+    def __init__(self, names, reservoirs, initial_heights, inflow, tributaries, dates, hist_min=None, cache=None, year_start_month=1,
+                 steps_per_day=1, release_shape=None, fish_passage=None):
+        '''
+        Inputs:
+        - names: short name of each dam, e.g. ['LGR', 'LGS', 'LMN', 'ICH']
+        - reservoirs: Reservoir objects ordered upstream to downstream
+        - initial_heights: initial water level of each reservoir (m)
+        - inflow: array of inflow into the most upstream reservoir (m^3/s)
+        - tributaries: one array of tributary inflow per reservoir (m^3/s), or a (D, T) array
+        - dates: array of datetime values for each datapoint
+        - hist_min: historical minimum outflow target of each reservoir (m^3/s), needed by evaluate
+        - cache: optional PrefixCache, reuses upstream trajectories when only downstream parameters change
+        - year_start_month: first month of the years used for annual sums and minimums, 1 for calendar years, 10 for water years
+        - steps_per_day: time steps per day of the inputs, 24 for hourly records (see subdaily); must divide 86400
+        - release_shape: multiplier of the regulated release at each step of the day, shape (steps_per_day,) shared by
+          all dams or (D, steps_per_day), e.g. subdaily.peaking_shape. Default constant release
+        - fish_passage: optional fish_passage.FishPassage, adds the cascade's fish survival to evaluate
+        '''
+        self.names = list(names)
+        self.reservoirs = list(reservoirs)
+        self.initial_heights = np.asarray(initial_heights, dtype=float)
+        self.inflow = np.ascontiguousarray(inflow, dtype=float)
+        self.tributaries = np.ascontiguousarray(np.atleast_2d(np.asarray(tributaries, dtype=float)))
+        self._dates = dates
+        self._date_index = None
+        self.hist_min = None if hist_min is None else np.asarray(hist_min, dtype=float)
+
+        # Reservoir constants, gathered once for the kernel
+        self.S = np.array([r.SA for r in self.reservoirs], dtype=float)
+        self.h_bottom = np.array([r.bottom_elev for r in self.reservoirs])
+        self.h0 = np.array([r.tail_elev for r in self.reservoirs])
+        self.max_storage = np.array([r.max_storage for r in self.reservoirs], dtype=float)
+        self.pc_flow = np.array([r.pc * .0283 for r in self.reservoirs], dtype=float) # powerhouse capacity (m^3/s)
+        self.capacity = np.array([r.capacity for r in self.reservoirs], dtype=float)
+        self.curves, self.curve_meta = stack_geometry(self.reservoirs)
+
+        # Time step
+        D = len(self.reservoirs)
+        if 86400 % steps_per_day != 0:
+            # delta would be truncated while hours is not, and the water balance and energy would disagree
+            raise ValueError('steps_per_day must divide the 86400 s of a day, got %r' % steps_per_day)
+        self.steps_per_day = steps_per_day
+        self.delta = 60 * 60 * 24 // steps_per_day # integration step [s]
+        self.hours = 24 / steps_per_day # hours per step, for energy
+        shape = np.ones(1) if release_shape is None else np.asarray(release_shape, dtype=float)
+        if shape.shape[-1] not in (1, steps_per_day):
+            raise ValueError('release_shape has %d steps per day, expected %d' % (shape.shape[-1], steps_per_day))
+        self.release_shape = np.ascontiguousarray(np.broadcast_to(shape, (D, shape.shape[-1])))
+
+        # Fingerprint of everything besides the release parameters that the trajectories depend on
+        self.cache = cache
+        digest = hashlib.blake2b(digest_size=16)
+        for arr in (self.inflow, self.tributaries, self.initial_heights, self.S, self.h_bottom, self.h0, self.max_storage,
+                    self.release_shape, [self.delta], self.curves, self.curve_meta):
+            digest.update(np.ascontiguousarray(arr).tobytes())
+        self.fingerprint = digest.hexdigest()
+
+        self._tables = (None, None, None)
+
+        # Fish passage parameters and step weights for the kernel, empty weights when there is no model
+        self.fish_passage = fish_passage
+        if fish_passage is None:
+            self.fish = np.zeros((D, 4))
+            self.fish_weights = np.zeros(0)
+        else:
+            self.fish = fish_passage.kernel_arrays(self.reservoirs)
+            self.fish_weights = fish_passage.weights(dates)
+
+        # Year segments, so annual sums and minimums skip pandas groupby
+        self.years = YearIndex(dates, year_start_month)
+
+    @property
+    def dates(self):
+        # DatetimeIndex of the steps, built on first use so that a cascade that only evaluates never loads pandas
+        if self._date_index is None:
+            import pandas as pd
+            self._date_index = pd.DatetimeIndex(self._dates)
+        return self._date_index
+
+    def simulate(self, mef, h1, m, keep):
+        '''
+        Simulate all dams in one step-major pass.
+        Inputs:
+        - mef, h1, m: regulated release parameters, one value per dam
+        - keep: 1 if the dam is kept, 0 if it is removed, one value per dam
+        Returns CascadeResult.
+        '''
+        keep = np.asarray(keep, dtype=np.int64)
+        mef = np.asarray(mef, dtype=float)
+        h1 = np.asarray(h1, dtype=float)
+        m = np.asarray(m, dtype=float)
+        alfa = np.array([r.alfa for r in self.reservoirs], dtype=float)
+        beta = np.array([r.beta for r in self.reservoirs], dtype=float)
+        prof = instrumentation.active
+        if prof is not None:
+            return self._simulate_profiled(prof, keep, alfa, beta, mef, h1, m)
+        if self.cache is None:
+            outflow, height = self._run(0, self.inflow, keep, alfa, beta, mef, h1, m)
+        else:
+            outflow, height = self._run_cached(keep, alfa, beta, mef, h1, m)
+
+        hydro = np.zeros(outflow.shape)
+        for d, res in enumerate(self.reservoirs):
+            if keep[d] != 0:
+                hydro[d] = res.simulate_hydropower(res.simulate_head(height[d]), outflow[d], keep[d], self.hours) #kWh
+        avg_hydro = self.annual_sum(hydro).mean(axis=1) #kWh/year
+
+        return CascadeResult(self.names, self.dates, outflow, height, hydro, avg_hydro)
+
+    def _simulate_profiled(self, prof, keep, alfa, beta, mef, h1, m):
+        # Same steps as simulate, timed per stage. Each reservoir is labeled with its dam name
+        prof.name(self, 'cascade')
+        for name, res in zip(self.names, self.reservoirs):
+            prof.name(res, name)
+        if self.cache is None:
+            outflow, height = prof.call(self, 'kernel', self._run, 0, self.inflow, keep, alfa, beta, mef, h1, m)
+        else:
+            outflow, height = prof.call(self, 'kernel cached', self._run_cached, keep, alfa, beta, mef, h1, m)
+
+        hydro = np.zeros(outflow.shape)
+        for d, res in enumerate(self.reservoirs):
+            if keep[d] != 0:
+                head = prof.call(res, 'simulate_head', res.simulate_head, height[d])
+                hydro[d] = prof.call(res, 'simulate_hydropower', res.simulate_hydropower, head, outflow[d], keep[d], self.hours)
+        avg_hydro = prof.call(self, 'annual_sum', self.annual_sum, hydro).mean(axis=1)
+
+        return CascadeResult(self.names, self.dates, outflow, height, hydro, avg_hydro)
+
+    def _run(self, start, inflow, keep, alfa, beta, mef, h1, m):
+        # Simulate dams start.. downstream, with inflow arriving from upstream of dam start
+        k = slice(start, None)
+        return kernels.cascade(inflow, self.tributaries[k], keep[k], self.initial_heights[k], self.S[k], self.h_bottom[k], self.h0[k],
+                               alfa[k], beta[k], mef[k], h1[k], m[k], self.max_storage[k], self.delta, self.release_shape[k],
+                               self.curves[k], self.curve_meta[k])
+
+    def _run_cached(self, keep, alfa, beta, mef, h1, m):
+        D = len(self.reservoirs)
+        keys = []
+        prefix = (self.fingerprint,)
+        for d in range(D):
+            prefix = prefix + (self.cache.dam_key(mef[d], h1[d], m[d], keep[d], alfa[d], beta[d]),)
+            keys.append(prefix)
+
+        # Reuse the longest cached upstream prefix
+        outflow = np.empty(self.tributaries.shape)
+        height = np.empty(self.tributaries.shape)
+        start = 0
+        while start < D:
+            hit = self.cache.get(keys[start])
+            if hit is None:
+                break
+            outflow[start], height[start] = hit
+            start += 1
+
+        # Re-run from the first changed dam down
+        if start < D:
+            inflow = self.inflow if start == 0 else outflow[start - 1]
+            outflow[start:], height[start:] = self._run(start, inflow, keep, alfa, beta, mef, h1, m)
+            for d in range(start, D):
+                self.cache.put(keys[d], outflow[d].copy(), height[d].copy())
+        return outflow, height
+
+    def annual_sum(self, x):
+        return self.years.sum(x)
+
+    def annual_min(self, x):
+        return self.years.min(x)
+
+    def years_below_min(self, outflow):
+        # Number of years each dam's minimum outflow falls below its historical minimum, shape (D,)
+        return (self.annual_min(outflow) < self.hist_min[:, None]).sum(axis=1)
+
+    def annual_objectives(self, mef, h1, m, keep, inflow=None, tributaries=None, years=None, fish_weights=None):
+        '''
+        Annual minimum outflow (m^3/s) and annual hydropower (kWh) of every dam, each of shape (D, Y), and the
+        annual fish survival through the cascade, shape (Y,), NaN without a fish passage model.
+        The kernel keeps one year of trajectories at a time, so nothing of the record's length is allocated.
+        Gives exactly annual_min(outflow) and annual_sum(hydro) of simulate, and FishPassage.annual_survival.
+        Inputs:
+        - mef, h1, m, keep: as in simulate
+        - inflow, tributaries, years: other inputs with the same dams, default this cascade's record
+        - fish_weights: fish passage weight of each step of those inputs, default this cascade's
+        '''
+        inflow = self.inflow if inflow is None else np.ascontiguousarray(inflow, dtype=float)
+        tributaries = self.tributaries if tributaries is None else np.ascontiguousarray(tributaries, dtype=float)
+        years = self.years if years is None else years
+        fish_weights = self.fish_weights if fish_weights is None else fish_weights
+        alfa = np.array([r.alfa for r in self.reservoirs], dtype=float)
+        beta = np.array([r.beta for r in self.reservoirs], dtype=float)
+        tables, table_meta = self.power_tables()
+        return kernels.cascade_objectives(inflow, tributaries, np.asarray(keep, dtype=np.int64), self.initial_heights,
+                                          self.S, self.h_bottom, self.h0, alfa, beta, np.asarray(mef, dtype=float),
+                                          np.asarray(h1, dtype=float), np.asarray(m, dtype=float), self.max_storage, self.delta,
+                                          self.release_shape, self.hours, years.offsets, self.pc_flow, self.capacity, rho, g, eta,
+                                          tables, table_meta, self.curves, self.curve_meta, self.fish, fish_weights)
+
+    def power_tables(self):
+        # Power tables of the reservoirs stacked for the kernel as (tables, table_meta), rebuilt when a table changes
+        current = [r.power_table for r in self.reservoirs]
+        if self._tables[0] is None or any(a is not b for a, b in zip(current, self._tables[0])):
+            D = len(self.reservoirs)
+            present = [r.power_table for r in self.reservoirs if r.power_table is not None]
+            nh = max([t.grid.shape[0] for t in present], default=1)
+            nq = max([t.grid.shape[1] for t in present], default=1)
+            tables = np.zeros((D, nh, nq))
+            meta = np.zeros((D, 4))
+            for d, r in enumerate(self.reservoirs):
+                t = r.power_table
+                if t is not None:
+                    tables[d, :t.grid.shape[0], :t.grid.shape[1]] = t.grid
+                    meta[d] = (t.grid.shape[0], t.grid.shape[1], t.h_step, t.q_step)
+            self._tables = (current, tables, meta)
+        return self._tables[1], self._tables[2]
+
+    def evaluate(self, variables):
+        '''
+        Evaluate one decision vector laid out like DamOptimization: mef, h1 and m of every dam, then keep of every dam.
+        Returns (number of years below the historical minimum outflow summed over dams, total average annual hydropower),
+        and the average annual fish survival through the cascade as a third value when there is a fish passage model.
+        Without a prefix cache only the annual aggregates are computed, see annual_objectives. A profiler times
+        the same path as an unprofiled run.
+        '''
+        D = len(self.reservoirs)
+        variables = np.asarray(variables, dtype=float)
+        mef, h1, m, keep = variables[:D], variables[D:2*D], variables[2*D:3*D], variables[3*D:4*D]
+        prof = instrumentation.active
+        if prof is not None:
+            prof.name(self, 'cascade')
+            start = time.perf_counter()
+        if self.cache is None:
+            if prof is None:
+                annual_min, annual_hydro, annual_fish = self.annual_objectives(mef, h1, m, keep)
+            else:
+                annual_min, annual_hydro, annual_fish = prof.call(self, 'annual_objectives', self.annual_objectives, mef, h1, m, keep)
+            objectives = ((annual_min < self.hist_min[:, None]).sum(), annual_hydro.mean(axis=1).sum())
+            if self.fish_passage is not None:
+                objectives += (np.nanmean(annual_fish),)
+        else:
+            # The prefix cache stores trajectories, so the cached path simulates them (profiled stage by stage in simulate)
+            result = self.simulate(mef, h1, m, keep)
+            if prof is None:
+                num_below_min = self.years_below_min(result.outflow).sum()
+            else:
+                num_below_min = prof.call(self, 'years_below_min', self.years_below_min, result.outflow).sum()
+            objectives = (num_below_min, result.avg_hydro.sum())
+            if self.fish_passage is not None:
+                objectives += (self.fish_survival(result, keep),)
+        if prof is not None:
+            prof.record(prof.label(self), 'evaluate', start - prof.t0, time.perf_counter() - start, 0)
+        return objectives
+
+    def fish_survival(self, result, keep):
+        # Average annual fish survival through the cascade of a simulated CascadeResult, see FishPassage.annual_survival
+        return np.nanmean(self.fish_passage.annual_survival(self, result.outflow, result.height, keep))
+
+    def evaluate_ensemble(self, variables, inflow, tributaries, dates=None):
+        '''
+        Evaluate one decision vector on every member of a streamflow ensemble, e.g. from synthetic_streamflow.cascade_ensemble.
+        Inputs:
+        - variables: decision vector laid out like DamOptimization
+        - inflow: (N, T) inflow into the most upstream reservoir of each member (m^3/s)
+        - tributaries: (N, D, T) tributary inflow of each member (m^3/s)
+        - dates: dates of the members, default the dates of this cascade
+        Returns (num_below_min, total_hydro), each of shape (N,), same as evaluate on each member, and the fish
+        survival of each member as a third array when there is a fish passage model.
+        '''
+        D = len(self.reservoirs)
+        variables = np.asarray(variables, dtype=float)
+        years = self.years if dates is None else YearIndex(dates, self.years.start_month)
+        fish_weights = None
+        if self.fish_passage is not None and dates is not None:
+            fish_weights = self.fish_passage.weights(dates)
+        N = len(inflow)
+        num_below_min = np.empty(N, dtype=np.int64)
+        total_hydro = np.empty(N)
+        survival = np.empty(N)
+        for n in range(N):
+            annual_min, annual_hydro, annual_fish = self.annual_objectives(variables[:D], variables[D:2*D], variables[2*D:3*D],
+                                                                           variables[3*D:4*D], inflow[n], tributaries[n], years,
+                                                                           fish_weights)
+            num_below_min[n] = (annual_min < self.hist_min[:, None]).sum()
+            total_hydro[n] = annual_hydro.mean(axis=1).sum()
+            survival[n] = np.nanmean(annual_fish) if self.fish_passage is not None else np.nan
+        if self.fish_passage is None:
+            return num_below_min, total_hydro
+        return num_below_min, total_hydro, survival
@@ -0,0 +1,91 @@
+import numpy as np
+
+# SCS curve number runoff of the four local watersheds, as tributary inflow of the cascade.
+# Daily runoff depth Q = (P - Ia)^2 / (P - Ia + S) for P > Ia, with retention S = 1000 / CN - 10 (in)
+# and initial abstraction Ia = 0.2 S, is computed for every scenario, watershed and day in one batch
+# of array operations, shape (N, W, T). Runoff over the watershed area becomes a flow that is added
+# to each dam's tributary inflow, ready for RiverCascade.evaluate_ensemble.
+#
+#   dates, precip = read_precipitation('archive/NOAAprecipitation_data_LEWISTON_AIRPORT_ID.csv')
+#   cn = CURVE_NUMBER + np.arange(-10, 11)[:, None] * np.ones(4)       # 21 land use scenarios
+#   inflow, tributaries = scenario_tributaries(cascade, cn, precip, dates)
+#   num_below_min, total_hydro = cascade.evaluate_ensemble(variables, inflow, tributaries)
+#
+# Precipitation scenarios broadcast the same way, e.g. precip * factor[:, None, None] with one curve number.
+
+CURVE_NUMBER = 84 # S = 1.905 in and Ia = 0.381 in, the hard-coded values of reservoir_simulation.py
+INITIAL_ABSTRACTION = 0.2 # Ia / S
+
+# Watershed area draining into each dam (m^2), from reservoir_simulation.res_info
+WATERSHED_AREAS = {'LGR': 111_602*4047, 'LGS': 83_074*4047, 'LMN': 95_277*4047, 'ICH': 103_352*4047}
+
+def read_precipitation(path):
+    # Daily precipitation (in) of a NOAA daily summaries CSV (DATE, PRCP columns) as (dates, precip); missing days are 0
+    import pandas as pd
+    data = pd.read_csv(path, usecols=['DATE', 'PRCP'], parse_dates=['DATE'])
+    return data['DATE'].values.astype('datetime64[D]'), data['PRCP'].fillna(0).values.astype(float)
+
+def align_precipitation(precip, precip_dates, dates):
+    '''
+    Precipitation on the days of another record, 0 on days the precipitation record does not have.
+    Inputs:
+    - precip: (..., T_p) daily precipitation on precip_dates, increasing
+    - dates: dates of the steps, sub-daily steps take the precipitation of their day
+    Returns (..., T) array.
+    '''
+    precip = np.asarray(precip, dtype=float)
+    precip_dates = np.asarray(precip_dates).astype('datetime64[D]')
+    days = np.asarray(dates).astype('datetime64[D]')
+    i = np.clip(np.searchsorted(precip_dates, days), 0, len(precip_dates) - 1)
+    found = precip_dates[i] == days
+    return np.where(found, precip[..., i], 0.0)
+
+def retention(cn):
+    # Potential maximum retention S (in) of curve numbers
+    return 1000 / np.asarray(cn, dtype=float) - 10
+
+def runoff_depth(precip, cn, ia_ratio=INITIAL_ABSTRACTION):
+    '''
+    Daily SCS curve number runoff.
+    Inputs:
+    - precip: daily precipitation (in), shape (T,) shared by all watersheds, (W, T), or any shape broadcasting
+      against cn.shape + (T,)
+    - cn: curve numbers, e.g. (W,) for one scenario or (N, W) for N scenarios
+    - ia_ratio: initial abstraction as a fraction of the retention
+    Returns runoff depth (m) of shape cn.shape + (T,), broadcast with precip.
+    '''
+    S = retention(cn)[..., None]
+    Q = np.asarray(precip, dtype=float) - ia_ratio * S
+    np.maximum(Q, 0.0, out=Q)
+    denominator = Q + S
+    np.multiply(Q, Q, out=Q)
+    np.divide(Q, denominator, out=Q, where=denominator > 0) # CN 100 with no rain is 0 / 0, left at 0
+    Q *= 0.0254 # in -> m
+    return Q
+
+def runoff_flow(depth, areas, out=None):
+    # Flow (m^3/s) of daily runoff depths (m) over watershed areas (m^2), one area per row of depth
+    return np.multiply(depth, (np.asarray(areas, dtype=float) / 86400)[:, None], out=out)
+
+def scenario_tributaries(cascade, cn, precip, precip_dates=None, areas=None):
+    '''
+    Inputs of a RiverCascade with the runoff of each curve number scenario added to the tributary inflow.
+    Inputs:
+    - cascade: RiverCascade
+    - cn: curve number of each watershed, shape (D,) or (N, D); a scalar is used for every watershed
+    - precip: daily precipitation (in), (T_p,) or (D, T_p), or (N, D, T_p) for precipitation scenarios
+    - precip_dates: dates of the precipitation, aligned to the cascade's dates with align_precipitation.
+      Default None: precip is already on the cascade's steps
+    - areas: watershed area of each dam (m^2), default WATERSHED_AREAS of the cascade's names
+    Returns (inflow, tributaries) of shape (N, T) and (N, D, T), ready for RiverCascade.evaluate_ensemble.
+    '''
+    D = len(cascade.reservoirs)
+    areas = np.array([WATERSHED_AREAS[name] for name in cascade.names] if areas is None else areas, dtype=float)
+    if precip_dates is not None:
+        precip = align_precipitation(precip, precip_dates, cascade.dates.values)
+    cn = np.asarray(cn, dtype=float)
+    cn = np.broadcast_to(cn, np.broadcast_shapes(cn.shape, (D,))).reshape(-1, D)
+    depth = runoff_depth(precip, cn)
+    tributaries = runoff_flow(depth, areas, out=depth)
+    tributaries += cascade.tributaries
+    return np.repeat(cascade.inflow[None], len(tributaries), axis=0), tributaries
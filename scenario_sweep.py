@@ -0,0 +1,123 @@
+import itertools
+import math
+import os
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+from prefix_cache import PrefixCache
+import dam_optimization as opt
+
+def keep_combos(n_dams=4):
+    # Every dam removal combination, e.g. (0, 0, 0, 0) ... (1, 1, 1, 1)
+    return list(itertools.product([0, 1], repeat=n_dams))
+
+def _scenario_key(cascade, keyer, v):
+    # Upstream-to-downstream prefix key of one scenario. Scenarios that only differ in the
+    # parameters of removed dams have the same key and give the same trajectories.
+    D = len(cascade.reservoirs)
+    return tuple(keyer.dam_key(v[d], v[D + d], v[2*D + d], v[3*D + d], r.alfa, r.beta) for d, r in enumerate(cascade.reservoirs))
+
+def _evaluate_scenarios(cascade, scenarios):
+    # Per-dam years below minimum and average annual hydropower of each (mef, h1, m, keep) row,
+    # then the fish survival when the cascade has a fish passage model
+    D = len(cascade.reservoirs)
+    rows = []
+    for v in scenarios:
+        result = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:4*D])
+        row = np.r_[cascade.years_below_min(result.outflow), result.avg_hydro]
+        if cascade.fish_passage is not None:
+            row = np.r_[row, cascade.fish_survival(result, v[3*D:4*D])]
+        rows.append(row)
+    return rows
+
+def _sweep_chunk(scenarios):
+    return _evaluate_scenarios(opt._worker['problem'].cascade, scenarios)
+
+def sweep_scenarios(cascade, params, combos=None, processes=None, chunks_per_worker=4, cache_bytes=256 * 2**20):
+    '''
+    Evaluate every (keep combo x release parameter) scenario of a cascade.
+    Scenarios are deduplicated (a removed dam's release parameters don't matter) and sorted so
+    that scenarios sharing an upstream prefix run back to back on the same worker, where the
+    prefix cache skips the dams they have in common.
+    Inputs:
+    - cascade: RiverCascade with hist_min set
+    - params: release parameters laid out like DamOptimization (mef, h1, m of every dam),
+      one vector of length 3*D or an (N, 3*D) array
+    - combos: keep combinations to sweep, default all 2**D of them
+    - processes: worker processes, default os.cpu_count(). 1 runs in this process
+    - chunks_per_worker: number of chunks handed to each worker
+    - cache_bytes: prefix cache size of each worker (bytes), used when the cascade has no cache
+    Returns DataFrame with one row per scenario: keep and mef/h1/m of every dam, years below the
+    historical minimum outflow and average annual hydropower (kWh/year) of every dam,
+    their totals num_below_min and total_hydro, and fish_survival when the cascade has a fish passage model.
+    '''
+    D = len(cascade.reservoirs)
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    combos = np.asarray(keep_combos(D) if combos is None else combos, dtype=float)
+    if params.shape[1] != 3 * D or combos.shape[1] != D:
+        raise ValueError('params need %d columns and combos %d columns' % (3 * D, D))
+
+    # Full grid, combo-major like the notebook loop
+    grid = np.hstack([np.tile(params, (len(combos), 1)), np.repeat(combos, len(params), axis=0)])
+
+    # Unique scenarios, ordered by their upstream prefix
+    cache_settings = (cache_bytes, 9) if cascade.cache is None else (cascade.cache.max_bytes, cascade.cache.decimals)
+    keyer = cascade.cache if cascade.cache is not None else PrefixCache(*cache_settings)
+    keys = [_scenario_key(cascade, keyer, v) for v in grid]
+    unique = {}
+    index = np.array([unique.setdefault(k, len(unique)) for k in keys])
+    first = np.zeros(len(unique), dtype=int)
+    first[index[::-1]] = np.arange(len(grid))[::-1] # first grid row of each unique scenario
+    order = sorted(range(len(unique)), key=lambda u: keys[first[u]])
+    scenarios = grid[first[order]]
+
+    processes = processes or os.cpu_count()
+    if processes == 1:
+        cache = cascade.cache
+        cascade.cache = cache if cache is not None else PrefixCache(*cache_settings)
+        try:
+            rows = _evaluate_scenarios(cascade, scenarios)
+        finally:
+            cascade.cache = cache
+    else:
+        shm = []
+        inflow_shm, inflow_spec = opt._share(cascade.inflow)
+        shm.append(inflow_shm)
+        tributary_shm, tributary_spec = opt._share(cascade.tributaries)
+        shm.append(tributary_shm)
+        try:
+            # Contiguous chunks keep shared prefixes on one worker
+            n_chunks = min(len(scenarios), processes * chunks_per_worker)
+            size = math.ceil(len(scenarios) / n_chunks)
+            chunks = [scenarios[i:i + size] for i in range(0, len(scenarios), size)]
+            with mp.Pool(processes, initializer=opt._init_worker,
+                         initargs=(cascade.names, cascade.reservoirs, cascade.initial_heights, cascade.dates.values,
+                                   cascade.hist_min, inflow_spec, tributary_spec, cache_settings,
+                                   cascade.years.start_month, cascade.steps_per_day, cascade.release_shape,
+                                   cascade.fish_passage)) as pool:
+                rows = [row for chunk in pool.map(_sweep_chunk, chunks) for row in chunk]
+        finally:
+            for s in shm:
+                s.close()
+                s.unlink()
+
+    # Scatter the unique results back onto the grid
+    values = np.empty((len(unique), 2 * D + (cascade.fish_passage is not None)))
+    values[order] = np.array(rows)
+    values = values[index]
+
+    table = {}
+    for d, name in enumerate(cascade.names):
+        table['keep_' + name] = grid[:, 3*D + d].astype(int)
+    for k, var in enumerate(('mef', 'h1', 'm')):
+        for d, name in enumerate(cascade.names):
+            table[var + '_' + name] = grid[:, k*D + d]
+    for d, name in enumerate(cascade.names):
+        table['below_min_' + name] = values[:, d].astype(int)
+    for d, name in enumerate(cascade.names):
+        table['avg_hydro_' + name] = values[:, D + d]
+    table['num_below_min'] = values[:, :D].sum(axis=1).astype(int)
+    table['total_hydro'] = values[:, D:2*D].sum(axis=1)
+    if cascade.fish_passage is not None:
+        table['fish_survival'] = values[:, 2*D]
+    return pd.DataFrame(table)
@@ -0,0 +1,196 @@
+import os
+import numpy as np
+import pandas as pd
+from evaluation_cache import canonical_variables
+from dam_optimization import ParallelEvaluator
+
+# Global sensitivity of the DamOptimization objectives to its decision variables.
+# Samples cover the bounds of DamOptimization.types (Integer keep variables take each of their values
+# with equal probability) and are evaluated in one batch: vectors that only differ in the release
+# parameters of removed dams are evaluated once, and the rest go through the cascade serially or
+# through a ParallelEvaluator pool.
+#
+#   sobol = sobol_analysis(DamOptimization(cascade), 1024)   # 1024 * (16 + 2) = 18,432 samples
+#   sobol['total_hydro'].sort_values('ST')
+#   morris = morris_analysis(DamOptimization(cascade), 100)   # 100 * 17 = 1,700 samples
+
+OBJECTIVES = ('num_below_min', 'total_hydro', 'fish_survival') # the last only with a fish passage model
+
+def bounds(problem):
+    # Lower and upper bounds of every decision variable, and which ones are integers
+    lower = np.array([t.min_value for t in problem.types], dtype=float)
+    upper = np.array([t.max_value for t in problem.types], dtype=float)
+    integer = np.array([type(t).__name__ == 'Integer' for t in problem.types])
+    return lower, upper, integer
+
+def variable_names(problem):
+    # mef_<dam>, h1_<dam>, m_<dam> and keep_<dam> like the scenario_sweep columns
+    return [var + '_' + name for var in ('mef', 'h1', 'm', 'keep') for name in problem.cascade.names]
+
+def scale(problem, U):
+    # Map points of the unit cube onto the variable bounds; integers take each value on an equal share of [0, 1]
+    lower, upper, integer = bounds(problem)
+    U = np.asarray(U, dtype=float)
+    X = lower + U * (upper - lower)
+    n = upper - lower + 1
+    X[:, integer] = np.minimum(lower + np.floor(U * n), upper)[:, integer]
+    return X
+
+def evaluate_samples(cascade, X, processes=None, chunks_per_worker=4):
+    '''
+    Evaluate a batch of decision vectors.
+    Inputs:
+    - cascade: RiverCascade with hist_min set
+    - X: (N, 4*D) decision vectors laid out like DamOptimization
+    - processes: worker processes, default os.cpu_count(). 1 runs in this process
+    - chunks_per_worker: see ParallelEvaluator
+    Returns (N, 2) array of num_below_min and total_hydro, (N, 3) with fish_survival when the cascade has a fish passage model.
+    '''
+    D = len(cascade.reservoirs)
+    # Dam-major column order so unique vectors come out sorted by their upstream prefix for the prefix cache
+    order = np.arange(4 * D).reshape(4, D).T.ravel()
+    unique, index = np.unique(canonical_variables(X, D)[:, order], axis=0, return_inverse=True)
+    unique = unique[:, np.argsort(order)]
+    processes = processes or os.cpu_count()
+    if processes == 1:
+        values = np.array([cascade.evaluate(v) for v in unique], dtype=float)
+    else:
+        evaluator = ParallelEvaluator(cascade, processes, chunks_per_worker)
+        try:
+            values = np.array(evaluator.map_objectives(unique), dtype=float)
+        finally:
+            evaluator.close()
+        values[:, 1:] = -values[:, 1:] # map_objectives gives -total_hydro and -survival
+    return values[index.ravel()]
+
+def saltelli_sample(problem, N, seed=None):
+    '''
+    Saltelli sample for first-order and total Sobol indices.
+    Rows are the N base points A, the N base points B, then for each variable i the N points AB_i
+    (A with column i taken from B). Returns (U, X): the points in the unit cube and decoded, N * (k + 2) rows.
+    '''
+    k = problem.nvars
+    rng = np.random.default_rng(seed)
+    base = rng.random((N, 2 * k))
+    A, B = base[:, :k], base[:, k:]
+    AB = np.repeat(A[None], k, axis=0)
+    AB[np.arange(k), :, np.arange(k)] = B.T
+    U = np.vstack([A, B, AB.reshape(k * N, k)])
+    return U, scale(problem, U)
+
+def _sobol_indices(fA, fB, fAB):
+    # First-order (Saltelli 2010) and total (Jansen) indices; fA, fB (..., N), fAB (k, ..., N)
+    var = np.concatenate([fA, fB], axis=-1).var(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        S1 = np.mean(fB * (fAB - fA), axis=-1) / var
+        ST = 0.5 * np.mean((fA - fAB) ** 2, axis=-1) / var
+    return S1, ST
+
+def sobol_indices(Y, N, n_boot=1000, conf_level=0.95, seed=None):
+    '''
+    Sobol indices of one output of a saltelli_sample.
+    Inputs:
+    - Y: outputs of the N * (k + 2) sample rows, in sample order
+    - N: base sample size
+    - n_boot: bootstrap resamples of the N base rows for the confidence intervals
+    - conf_level: confidence level of the percentile intervals
+    Returns DataFrame with one row per variable: S1, ST and the bounds of their intervals.
+    An output that never changes gives NaN indices.
+    '''
+    Y = np.asarray(Y, dtype=float)
+    k = len(Y) // N - 2
+    fA, fB, fAB = Y[:N], Y[N:2*N], Y[2*N:].reshape(k, N)
+    S1, ST = _sobol_indices(fA, fB, fAB)
+
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, N, (n_boot, N))
+    fA, fB = fA[rows], fB[rows]
+    boot = [_sobol_indices(fA, fB, fAB[i, rows]) for i in range(k)] # one variable at a time keeps n_boot x N arrays
+    boot_S1 = np.array([b[0] for b in boot]).reshape(k, n_boot)
+    boot_ST = np.array([b[1] for b in boot]).reshape(k, n_boot)
+    tail = 50 * (1 - conf_level)
+    S1_low, S1_high = np.nanpercentile(boot_S1, [tail, 100 - tail], axis=1) if n_boot else (np.nan, np.nan)
+    ST_low, ST_high = np.nanpercentile(boot_ST, [tail, 100 - tail], axis=1) if n_boot else (np.nan, np.nan)
+    return pd.DataFrame({'S1': S1, 'S1_low': S1_low, 'S1_high': S1_high, 'ST': ST, 'ST_low': ST_low, 'ST_high': ST_high})
+
+def sobol_analysis(problem, N=1024, n_boot=1000, conf_level=0.95, seed=None, processes=None):
+    '''
+    First-order and total Sobol indices of the DamOptimization objectives over the variable bounds.
+    Inputs:
+    - problem: DamOptimization
+    - N: base sample size, the cascade is run at most N * (nvars + 2) times
+    - n_boot, conf_level: see sobol_indices
+    - seed: seed of the sample and of the bootstrap
+    - processes: see evaluate_samples
+    Returns dict of DataFrame per objective (num_below_min, total_hydro, fish_survival), indexed by variable name.
+    '''
+    seeds = np.random.SeedSequence(seed).spawn(2)
+    _, X = saltelli_sample(problem, N, seeds[0])
+    Y = evaluate_samples(problem.cascade, X, processes)
+    names = variable_names(problem)
+    return {obj: sobol_indices(Y[:, j], N, n_boot, conf_level, seeds[1]).set_index(pd.Index(names, name='variable'))
+            for j, obj in enumerate(OBJECTIVES[:Y.shape[1]])}
+
+def morris_sample(problem, r, levels=4, seed=None):
+    '''
+    Morris one-at-a-time trajectories on a grid of `levels` levels per variable.
+    Each trajectory starts at a random grid point and moves every variable once, in random order,
+    by levels / (2 * (levels - 1)) of its range, up or down. Integer keep variables flip at every move
+    when levels is even. Returns (U, X, steps): the points in the unit cube and decoded, r * (k + 1) rows,
+    and the (r, k) variable moved at each step of each trajectory.
+    '''
+    k = problem.nvars
+    rng = np.random.default_rng(seed)
+    delta = levels / (2 * (levels - 1))
+    start = rng.integers(0, levels, (r, k)) / (levels - 1)
+    up = start + delta <= 1
+    steps = np.argsort(rng.random((r, k)), axis=1)
+    U = np.repeat(start[:, None], k + 1, axis=1)
+    for j in range(k):
+        i = steps[:, j]
+        move = np.where(up[np.arange(r), i], delta, -delta)
+        U[np.arange(r), j + 1:, i] += move[:, None]
+    U = U.reshape(r * (k + 1), k)
+    return U, scale(problem, U), steps
+
+def morris_indices(problem, X, Y, steps, n_boot=1000, conf_level=0.95, seed=None):
+    '''
+    Morris statistics of one output of a morris_sample. Elementary effects are the change of the output
+    per change of the variable as a fraction of its range.
+    Returns DataFrame with one row per variable: mu, mu_star (mean absolute effect), sigma and the
+    bootstrap interval of mu_star over trajectories.
+    '''
+    lower, upper, _ = bounds(problem)
+    r, k = steps.shape
+    X = X.reshape(r, k + 1, k)
+    Y = np.asarray(Y, dtype=float).reshape(r, k + 1)
+    t = np.arange(r)[:, None]
+    moved = (X[t, np.arange(1, k + 1), steps] - X[t, np.arange(k), steps]) / (upper - lower)[steps]
+    effects = np.empty((r, k))
+    effects[t, steps] = np.diff(Y, axis=1) / moved
+
+    rng = np.random.default_rng(seed)
+    boot = np.abs(effects)[rng.integers(0, r, (n_boot, r))].mean(axis=1) # (n_boot, k)
+    tail = 50 * (1 - conf_level)
+    low, high = np.percentile(boot, [tail, 100 - tail], axis=0) if n_boot else (np.nan, np.nan)
+    return pd.DataFrame({'mu': effects.mean(axis=0), 'mu_star': np.abs(effects).mean(axis=0),
+                         'sigma': effects.std(axis=0, ddof=1) if r > 1 else np.nan, 'mu_star_low': low, 'mu_star_high': high})
+
+def morris_analysis(problem, r=100, levels=4, n_boot=1000, conf_level=0.95, seed=None, processes=None):
+    '''
+    Morris screening of the DamOptimization objectives, cheaper than Sobol indices for ranking variables.
+    Inputs:
+    - problem: DamOptimization
+    - r: number of trajectories, the cascade is run at most r * (nvars + 1) times
+    - levels: grid levels per variable
+    - n_boot, conf_level: bootstrap of the mu_star intervals
+    - seed: seed of the trajectories and of the bootstrap
+    - processes: see evaluate_samples
+    Returns dict of DataFrame per objective (num_below_min, total_hydro, fish_survival), indexed by variable name.
+    '''
+    seeds = np.random.SeedSequence(seed).spawn(2)
+    _, X, steps = morris_sample(problem, r, levels, seeds[0])
+    Y = evaluate_samples(problem.cascade, X, processes)
+    names = variable_names(problem)
+    return {obj: morris_indices(problem, X, Y[:, j], steps, n_boot, conf_level, seeds[1]).set_index(pd.Index(names, name='variable'))
+            for j, obj in enumerate(OBJECTIVES[:Y.shape[1]])}
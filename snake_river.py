@@ -0,0 +1,42 @@
+from datetime import datetime
+import numpy as np
+from Reservoir4 import Reservoir
+from river_cascade import RiverCascade
+
+# The four lower Snake River dams as set up in "optimize in series.ipynb", ordered upstream to downstream.
+
+NAMES = ['LGR', 'LGS', 'LMN', 'ICH']
+INITIAL_HEIGHTS = np.array([670, 570, 470, 370]) * 0.3046 # m
+PRE_CUTOFF = datetime(1970, 1, 1) # pre-dam record, used for the historical minimum outflows
+POST_CUTOFF = datetime(1993, 1, 1) # start of the simulated record
+
+def make_reservoirs():
+    lower_granite = Reservoir(SA=8900*4047,capacity=810000,tail_elev=636,pool_elev=746.5,bottom_elev=590,fish_pass=1, pc=130_000, spillway_cap=850_000, alfa=2.2, beta=4.9)
+    little_goose = Reservoir(SA=10025*4047,capacity=903000,tail_elev=539,pool_elev=646.5,bottom_elev=500,fish_pass=0.9775, pc=130_000, spillway_cap=850_000, alfa=2.2, beta=4.9)
+    lower_monumental = Reservoir(SA=6590*4047,capacity=810000,tail_elev=439,pool_elev=548.3,bottom_elev=406,fish_pass=0.965, pc=130_000, spillway_cap=850_000, alfa=2.2, beta=4.9)
+    ice_harbor = Reservoir(SA=9200*4047,capacity=603000,tail_elev=339,pool_elev=446,bottom_elev=310,fish_pass=0.965, pc=106_000, spillway_cap=850_000, alfa=2.2, beta=4.9)
+    return [lower_granite, little_goose, lower_monumental, ice_harbor]
+
+def historical_minimums(store):
+    # Median over the pre-dam years of each dam's annual minimum outflow (m^3/s)
+    k = store.window(end=PRE_CUTOFF)
+    years = store.dates[k].year.values
+    starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    return np.array([np.median(np.fmin.reduceat(store[name + '_outflow'][k], starts)) for name in NAMES])
+
+def make_cascade(store=None, start=POST_CUTOFF, end=None, cache=None, year_start_month=1, fish_passage=None):
+    '''
+    RiverCascade of the four dams on the observed record.
+    Inputs:
+    - store: StreamflowStore, default open_store() on the CSVs next to this module
+    - start, end: simulated date range
+    - cache: optional PrefixCache
+    - year_start_month: 1 for calendar years, 10 for water years
+    - fish_passage: optional fish_passage.FishPassage, adds fish survival to the objectives
+    Returns RiverCascade with hist_min set.
+    '''
+    from streamflow_store import open_store, cascade_inputs # pandas, only needed to read the record
+    store = store or open_store()
+    dates, inflow, tributaries = cascade_inputs(store, start, end)
+    return RiverCascade(NAMES, make_reservoirs(), INITIAL_HEIGHTS, inflow, tributaries, dates,
+                        historical_minimums(store), cache, year_start_month, fish_passage=fish_passage)
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+# Elevation-storage-area curves for Reservoir, replacing the prism pool (storage = SA * (h - h_bottom)).
+# The tabulated curve is interpolated with a monotone cubic (PCHIP) and resampled once onto uniform
+# grids in elevation and in storage. A lookup is then an O(1) index plus one linear interpolation,
+# storage -> level and level -> storage alike, on scalars inside the time loop (reservoir_kernels) or
+# on arrays (StageStorage.level / storage). Linear interpolation of monotone samples stays monotone,
+# and beyond the table the end segments are extended.
+#
+#   curve = StageStorage.read_csv('lower_granite_storage.csv')   # USACE units, see read_csv
+#   lgr = Reservoir(..., geometry=curve)
+
+FT = 0.3046 # ft -> m, as in Reservoir
+ACRE = 4047 # acre -> m^2, as in the notebooks
+
+def _pchip_slopes(x, y):
+    # Fritsch-Carlson derivatives of the monotone cubic through (x, y)
+    h = np.diff(x)
+    delta = np.diff(y) / h
+    d = np.zeros(len(x))
+    if len(x) == 2:
+        return np.full(2, delta[0])
+    w1 = 2 * h[1:] + h[:-1]
+    w2 = h[1:] + 2 * h[:-1]
+    same = delta[:-1] * delta[1:] > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d[1:-1] = np.where(same, (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:]), 0.0)
+    # One-sided three-point ends, kept shape-preserving
+    for end, (h0, h1, d0, d1) in ((0, (h[0], h[1], delta[0], delta[1])), (-1, (h[-1], h[-2], delta[-1], delta[-2]))):
+        s = ((2 * h0 + h1) * d0 - h0 * d1) / (h0 + h1)
+        if np.sign(s) != np.sign(d0):
+            s = 0.0
+        elif np.sign(d0) != np.sign(d1) and abs(s) > abs(3 * d0):
+            s = 3 * d0
+        d[end] = s
+    return d
+
+def _pchip(x, y, xi):
+    # Monotone cubic interpolation of (x, y) at xi inside [x[0], x[-1]]
+    d = _pchip_slopes(x, y)
+    i = np.clip(np.searchsorted(x, xi) - 1, 0, len(x) - 2)
+    h = x[i + 1] - x[i]
+    t = (xi - x[i]) / h
+    return ((2 * t**3 - 3 * t**2 + 1) * y[i] + (t**3 - 2 * t**2 + t) * h * d[i] +
+            (-2 * t**3 + 3 * t**2) * y[i + 1] + (t**3 - t**2) * h * d[i + 1])
+
+def _uniform_lookup(x, x0, step, values):
+    # Linear interpolation on a uniform grid, end segments extended
+    x = np.asarray(x, dtype=float)
+    pos = (x - x0) / step
+    i = np.clip(np.floor(np.nan_to_num(pos)).astype(np.int64), 0, len(values) - 2)
+    return values[i] + (pos - i) * (values[i + 1] - values[i])
+
+class StageStorage:
+    '''
+    Reservoir geometry from an elevation-storage(-area) table, in m, m^3 and m^2.
+    - levels: level at each point of a uniform storage grid from s_min in steps of s_step
+    - storages: storage at each point of a uniform level grid from h_min in steps of h_step
+    '''
+
+    def __init__(self, elevation, storage, area=None, n_grid=2048):
+        '''
+        Inputs:
+        - elevation: table elevations (m), increasing
+        - storage: storage at each elevation (m^3), increasing
+        - area: optional water surface area at each elevation (m^2)
+        - n_grid: points of the resampled uniform grids
+        '''
+        elevation = np.asarray(elevation, dtype=float)
+        storage = np.asarray(storage, dtype=float)
+        if len(elevation) < 2 or np.any(np.diff(elevation) <= 0) or np.any(np.diff(storage) <= 0):
+            raise ValueError('elevation and storage must have at least two points and increase strictly')
+        self.elevation = elevation
+        self.storage_table = storage
+        self.area_table = None if area is None else np.asarray(area, dtype=float)
+
+        # Level -> storage on a uniform level grid
+        self.h_min = elevation[0]
+        self.h_step = (elevation[-1] - elevation[0]) / (n_grid - 1)
+        grid_h = self.h_min + np.arange(n_grid) * self.h_step
+        grid_h[-1] = elevation[-1]
+        self.storages = _pchip(elevation, storage, grid_h)
+
+        # Storage -> level on a uniform storage grid, inverting a finer sampling of the same monotone curve
+        fine_h = np.linspace(elevation[0], elevation[-1], 16 * n_grid)
+        fine_s = np.maximum.accumulate(_pchip(elevation, storage, fine_h))
+        self.s_min = storage[0]
+        self.s_step = (storage[-1] - storage[0]) / (n_grid - 1)
+        grid_s = self.s_min + np.arange(n_grid) * self.s_step
+        self.levels = np.interp(grid_s, fine_s, fine_h)
+
+    @classmethod
+    def from_usace(cls, elevation_ft, storage_acre_ft, area_acres=None, **kwargs):
+        # Table in USACE units: elevation (ft), storage (acre-ft), area (acres)
+        area = None if area_acres is None else np.asarray(area_acres, dtype=float) * ACRE
+        return cls(np.asarray(elevation_ft, dtype=float) * FT, np.asarray(storage_acre_ft, dtype=float) * ACRE * FT, area, **kwargs)
+
+    @classmethod
+    def read_csv(cls, path, elevation='elevation', storage='storage', area='area', **kwargs):
+        '''
+        Read a USACE elevation-storage-area table from a CSV (or Excel) file with elevation (ft),
+        storage (acre-ft) and optionally area (acres) columns. Rows are sorted by elevation.
+        '''
+        data = pd.read_excel(path) if str(path).endswith(('.xlsx', '.xls')) else pd.read_csv(path)
+        data = data.sort_values(elevation)
+        return cls.from_usace(data[elevation].values, data[storage].values,
+                              data[area].values if area in data.columns else None, **kwargs)
+
+    def level(self, s):
+        # Water level (m) of storage s (m^3), scalar or array
+        return _uniform_lookup(s, self.s_min, self.s_step, self.levels)
+
+    def storage(self, h):
+        # Storage (m^3) at water level h (m), scalar or array
+        return _uniform_lookup(h, self.h_min, self.h_step, self.storages)
+
+    def area(self, h):
+        # Water surface area (m^2) at level h, linear in the table
+        if self.area_table is None:
+            raise ValueError('the table has no area column')
+        return np.interp(h, self.elevation, self.area_table)
+
+    def kernel_arrays(self):
+        # (curves, meta) for reservoir_kernels: curves[0] levels, curves[1] storages,
+        # meta = (n_grid, s_min, s_step, h_min, h_step)
+        return np.vstack([self.levels, self.storages]), np.array([len(self.levels), self.s_min, self.s_step, self.h_min, self.h_step])
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Binary store for the streamflow CSVs.
+# build_store parses every CSV once, aligns the series on the dates they share (like the inner
+# merges in the notebooks), converts cfs to m^3/s and writes one .npy per series plus a manifest.
+# open_store memory-maps the arrays, so notebooks and worker processes read them without copying.
+# The store is rebuilt when a source file or the store layout changes.
+
+VERSION = 1
+CFS = 0.3046**3 # cfs -> m^3/s, same factor as the notebooks
+DEFAULT_DIR = '.streamflow_store'
+DATA_DIR = os.path.dirname(os.path.abspath(__file__)) # the CSVs ship next to this module
+
+# series name: (csv file, column, clip at zero)
+SOURCES = {
+    'LGR_inflow': ('lowergraniteinflow.csv', 'A (unit:cfs)', False),
+    'LGR_outflow': ('lowergraniteoutflow.csv', 'H (unit:cfs)', False),
+    'LGR_storage': ('lowergranitestorage.csv', 'S (unit:cfs)', False),
+    'LGR_trib': ('lowergranitetrib.csv', 'L (unit:cfs)', True),
+    'LGS_outflow': ('littlegooseoutflow.csv', 'H (unit:cfs)', False),
+    'LGS_storage': ('littlegoosestorage.csv', 'S (unit:cfs)', False),
+    'LMN_outflow': ('lowermonumentaloutflow.csv', 'H (unit:cfs)', False),
+    'LMN_storage': ('lowermonumentalstorage.csv', 'S (unit:cfs)', False),
+    'LMN_trib': ('lowermontrib.csv', 'L (unit:cfs)', True),
+    'ICH_outflow': ('iceharboroutflow.csv', 'H (unit:cfs)', False),
+    'ICH_storage': ('iceharborstorage.csv', 'S (unit:cfs)', False),
+    'ICH_trib': ('iceharbortrib.csv', 'L (unit:cfs)', True),
+    'LGR_modified': ('4200 Modified Average Daily Streamflows.csv', 'Lower Granite (unit:cfs)', False),
+    'LGS_modified': ('4200 Modified Average Daily Streamflows.csv', 'Little Goose (unit:cfs)', False),
+    'LMN_modified': ('4200 Modified Average Daily Streamflows.csv', 'Lower Monumental (unit:cfs)', False),
+    'ICH_modified': ('4200 Modified Average Daily Streamflows.csv', 'Ice Harbor Daily Streamflows (unit:cfs)', False),
+}
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _source_files(sources):
+    return sorted({f for f, _, _ in sources.values()})
+
+def build_store(data_dir=DATA_DIR, store_dir=None, sources=SOURCES):
+    '''
+    Parse the CSVs and write the binary store.
+    Inputs:
+    - data_dir: folder with the CSV files, default the folder of this module
+    - store_dir: folder of the store, default data_dir/.streamflow_store
+    - sources: series name -> (csv file, column, clip at zero)
+    Returns the manifest dict.
+    '''
+    store_dir = store_dir or os.path.join(data_dir, DEFAULT_DIR)
+    os.makedirs(store_dir, exist_ok=True)
+
+    # Read each file once, utf-8-sig strips the BOM in the header
+    tables = {}
+    for f in _source_files(sources):
+        data = pd.read_csv(os.path.join(data_dir, f), encoding='utf-8-sig')
+        data['date'] = pd.to_datetime(data['date'])
+        tables[f] = data.set_index('date')
+
+    # Common date axis: the dates every file has
+    dates = None
+    for data in tables.values():
+        dates = data.index if dates is None else dates.intersection(data.index)
+    dates = dates.sort_values()
+
+    series = {}
+    for name, (f, column, clip) in sources.items():
+        values = tables[f][column].reindex(dates).values.astype(float)
+        if clip:
+            values = np.maximum(values, 0)
+        np.save(os.path.join(store_dir, name + '.npy'), values * CFS)
+        series[name] = {'file': f, 'column': column, 'clip': clip, 'units': 'm^3/s'}
+    np.save(os.path.join(store_dir, 'dates.npy'), dates.values.astype('datetime64[D]'))
+
+    files = {}
+    for f in tables:
+        st = os.stat(os.path.join(data_dir, f))
+        files[f] = {'sha256': _file_hash(os.path.join(data_dir, f)), 'size': st.st_size, 'mtime': st.st_mtime}
+    manifest = {'version': VERSION, 'length': len(dates), 'series': series, 'files': files}
+    # Manifest goes last, so an interrupted build is never taken as valid
+    with open(os.path.join(store_dir, 'manifest.json'), 'w') as out:
+        json.dump(manifest, out, indent=1)
+    return manifest
+
+def is_current(data_dir=DATA_DIR, store_dir=None, sources=SOURCES):
+    # True if the store exists and was built from the current source files with this layout
+    store_dir = store_dir or os.path.join(data_dir, DEFAULT_DIR)
+    try:
+        with open(os.path.join(store_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if manifest.get('version') != VERSION or set(manifest['series']) != set(sources):
+        return False
+    for name, (f, column, clip) in sources.items():
+        if manifest['series'][name] != {'file': f, 'column': column, 'clip': clip, 'units': 'm^3/s'}:
+            return False
+    for f in _source_files(sources):
+        path = os.path.join(data_dir, f)
+        if not os.path.exists(path):
+            return False
+        st = os.stat(path)
+        entry = manifest['files'][f]
+        # Hash only when size or modification time moved
+        if (st.st_size, st.st_mtime) != (entry['size'], entry['mtime']) and _file_hash(path) != entry['sha256']:
+            return False
+    return True
+
+class StreamflowStore:
+    '''
+    Read-only memory-mapped series of the binary store, all in m^3/s on one date axis.
+    store['LMN_trib'] gives the whole series, store.window(start, end) the slice of a date range.
+    '''
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.store_dir = store_dir
+        self.dates = pd.DatetimeIndex(np.load(os.path.join(store_dir, 'dates.npy')).astype('datetime64[ns]'))
+        self._arrays = {}
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            if name not in self.manifest['series']:
+                raise KeyError(name)
+            self._arrays[name] = np.load(os.path.join(self.store_dir, name + '.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    def __contains__(self, name):
+        return name in self.manifest['series']
+
+    def names(self):
+        return list(self.manifest['series'])
+
+    def window(self, start=None, end=None):
+        # Slice of the date axis with start <= date <= end
+        i = 0 if start is None else self.dates.searchsorted(pd.Timestamp(start), side='left')
+        j = len(self.dates) if end is None else self.dates.searchsorted(pd.Timestamp(end), side='right')
+        return slice(i, j)
+
+def open_store(data_dir=DATA_DIR, store_dir=None, sources=SOURCES):
+    '''
+    Open the binary store, building it first if it is missing or stale.
+    Inputs:
+    - data_dir: folder with the CSV files, default the folder of this module
+    - store_dir: folder of the store, default data_dir/.streamflow_store
+    Returns StreamflowStore.
+    '''
+    store_dir = store_dir or os.path.join(data_dir, DEFAULT_DIR)
+    if not is_current(data_dir, store_dir, sources):
+        build_store(data_dir, store_dir, sources)
+    return StreamflowStore(store_dir)
+
+def cascade_inputs(store, start=None, end=None):
+    '''
+    Inputs of the LGR -> LGS -> LMN -> ICH cascade over a date range, set up like the notebooks:
+    Lower Granite inflow upstream, no tributary inflow for Lower Granite and Little Goose.
+    Returns (dates, inflow, tributaries) with tributaries of shape (4, T). inflow is a view of the store.
+    '''
+    k = store.window(start, end)
+    T = k.stop - k.start
+    zeros = np.zeros(T)
+    tributaries = np.vstack([zeros, zeros, store['LMN_trib'][k], store['ICH_trib'][k]])
+    return store.dates[k], store['LGR_inflow'][k], tributaries
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+from river_cascade import RiverCascade
+
+# Sub-daily (e.g. hourly) cascade runs for peaking studies.
+# Daily mean inflows are spread over steps_per_day steps without changing any day's volume, and a
+# release shape lets each dam release more at peak hours and less overnight (load following).
+# The record gets steps_per_day times longer, but evaluate keeps using the objectives-only kernel,
+# which holds one year of steps at a time, so memory does not grow with the record.
+#
+#   hourly = subdaily_cascade(snake_river.make_cascade(), 24, release_shape=peaking_shape(24))
+#   hourly.evaluate(variables)
+
+def step_dates(dates, steps_per_day):
+    # Start time of every step of every day
+    dates = pd.DatetimeIndex(dates)
+    offsets = pd.to_timedelta(np.arange(steps_per_day) * (24 * 60 * 60 // steps_per_day), unit='s')
+    return pd.DatetimeIndex((dates.values[:, None] + offsets.values[None]).ravel())
+
+def disaggregate(daily, steps_per_day=24, method='linear'):
+    '''
+    Spread daily mean flows over steps_per_day steps per day, keeping each day's mean.
+    Inputs:
+    - daily: daily mean flows, shape (T,) or (..., T)
+    - steps_per_day: steps of each day, 24 for hourly
+    - method: 'repeat' holds the daily value, 'linear' interpolates between day midpoints and then
+      rescales each day back to its own mean, so the flow changes smoothly from one day to the next
+    Returns flows of shape (..., T * steps_per_day). Days with a NaN flow stay NaN.
+    '''
+    daily = np.asarray(daily, dtype=float)
+    K = steps_per_day
+    if method == 'repeat':
+        return np.repeat(daily, K, axis=-1)
+    if method != 'linear':
+        raise ValueError("method must be 'linear' or 'repeat', not %r" % method)
+    rows = daily.reshape(-1, daily.shape[-1])
+    T = rows.shape[1]
+    midpoints = np.arange(T) + 0.5
+    steps = (np.arange(T * K) + 0.5) / K
+    fine = np.empty((len(rows), T, K))
+    for i, row in enumerate(rows):
+        valid = ~np.isnan(row)
+        if valid.any():
+            fine[i] = np.interp(steps, midpoints[valid], row[valid]).reshape(T, K)
+        else:
+            fine[i] = np.nan
+    # Rescale each day to its daily mean; days whose interpolated mean is zero are held flat
+    mean = fine.mean(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = rows / mean
+    flat = ~np.isfinite(scale)
+    fine = fine * np.where(flat, 1, scale)[..., None]
+    fine[flat] = rows[flat][:, None]
+    return fine.reshape(daily.shape[:-1] + (T * K,))
+
+def peaking_shape(steps_per_day=24, peak_start=6, peak_end=22, ratio=1.5):
+    '''
+    Release multipliers of a two-level load-following schedule, ratio times higher from peak_start to
+    peak_end (hours) than the rest of the day, scaled to a mean of 1 so the daily target volume is unchanged.
+    Returns array of shape (steps_per_day,), for RiverCascade(release_shape=...).
+    '''
+    hour = np.arange(steps_per_day) * 24 / steps_per_day
+    shape = np.where((hour >= peak_start) & (hour < peak_end), float(ratio), 1.0)
+    return shape / shape.mean()
+
+def subdaily_cascade(cascade, steps_per_day=24, method='linear', release_shape=None, cache=None):
+    '''
+    Copy of a daily RiverCascade on a sub-daily time step.
+    Inputs:
+    - cascade: daily RiverCascade, its record starting at midnight
+    - steps_per_day, method: see disaggregate
+    - release_shape: release multipliers of each step of the day, e.g. peaking_shape(steps_per_day)
+    - cache: optional PrefixCache for the new cascade (trajectories are steps_per_day times larger)
+    Returns RiverCascade. hist_min is compared with the minimum outflow over the steps of each year.
+    '''
+    if cascade.steps_per_day != 1:
+        raise ValueError('cascade is already on a sub-daily time step')
+    inflow = disaggregate(cascade.inflow, steps_per_day, method)
+    tributaries = disaggregate(cascade.tributaries, steps_per_day, method)
+    return RiverCascade(cascade.names, cascade.reservoirs, cascade.initial_heights, inflow, tributaries,
+                        step_dates(cascade.dates, steps_per_day), cascade.hist_min, cache, cascade.years.start_month,
+                        steps_per_day, release_shape, cascade.fish_passage)
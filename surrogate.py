@@ -0,0 +1,174 @@
+import numpy as np
+from platypus.config import PlatypusConfig
+from platypus.core import Variator
+from platypus.evaluator import Evaluator
+from dam_optimization import decode_variables
+
+class RBFSurrogate:
+    '''
+    Cubic radial basis function interpolant with a linear tail, one per objective.
+    Inputs are scaled to [0, 1] with the variable bounds and objectives are standardized.
+    '''
+
+    def __init__(self, lower, upper, smoothing=1e-8):
+        self.lower = np.asarray(lower, dtype=float)
+        self.span = np.asarray(upper, dtype=float) - self.lower
+        self.span[self.span == 0] = 1
+        self.smoothing = smoothing
+        self.X = None
+
+    def _basis(self, X):
+        r = np.sqrt(((X[:, None, :] - self.X[None, :, :])**2).sum(axis=-1))
+        return r**3
+
+    def fit(self, X, Y):
+        self.X = (np.asarray(X, dtype=float) - self.lower) / self.span
+        Y = np.asarray(Y, dtype=float)
+        self.mu = Y.mean(axis=0)
+        self.sd = Y.std(axis=0)
+        self.sd[self.sd == 0] = 1
+        n, k = self.X.shape
+        P = np.hstack([np.ones((n, 1)), self.X])
+        A = np.zeros((n + k + 1, n + k + 1))
+        A[:n, :n] = self._basis(self.X) + self.smoothing * np.eye(n)
+        A[:n, n:] = P
+        A[n:, :n] = P.T
+        b = np.vstack([(Y - self.mu) / self.sd, np.zeros((k + 1, Y.shape[1]))])
+        self.coef = np.linalg.lstsq(A, b, rcond=None)[0] # lstsq copes with repeated points
+        return self
+
+    def predict(self, X):
+        X = (np.asarray(X, dtype=float) - self.lower) / self.span
+        P = np.hstack([np.ones((len(X), 1)), X])
+        n = len(self.X)
+        return (self._basis(X) @ self.coef[:n] + P @ self.coef[n:]) * self.sd + self.mu
+
+def _pareto_rank(F):
+    # Nondominated sorting rank (0 = front) of objective rows, all minimized
+    F = np.asarray(F, dtype=float)
+    dominates = np.all(F[:, None] <= F[None], axis=-1) & np.any(F[:, None] < F[None], axis=-1)
+    rank = np.full(len(F), -1)
+    left = np.ones(len(F), dtype=bool)
+    level = 0
+    while left.any():
+        counts = dominates[np.ix_(left, left)].sum(axis=0)
+        idx = np.flatnonzero(left)[counts == 0]
+        rank[idx] = level
+        left[idx] = False
+        level += 1
+    return rank
+
+class _ScreeningVariator(Variator):
+    def __init__(self, screen, variator):
+        super(_ScreeningVariator, self).__init__(variator.arity)
+        self.screen = screen
+        self.variator = variator
+
+    def evolve(self, parents):
+        return self.screen.screen(parents, self.variator)
+
+class _ScreeningEvaluator(Evaluator):
+    def __init__(self, screen, evaluator):
+        super(_ScreeningEvaluator, self).__init__()
+        self.screen = screen
+        self.evaluator = evaluator
+
+    def evaluate_all(self, jobs, **kwargs):
+        jobs = self.evaluator.evaluate_all(jobs, **kwargs)
+        self.screen.observe([job.solution for job in jobs])
+        return jobs
+
+    def close(self):
+        self.evaluator.close()
+
+class SurrogateScreening:
+    '''
+    Surrogate-assisted pre-screening of offspring.
+    Each time the algorithm asks for offspring, the wrapped variator is run `oversample` times on the
+    same parents and only the candidates the surrogate ranks best (Pareto rank of the predicted
+    objectives, then their standardized sum) go on to a real simulation. The surrogate is refit on
+    every real evaluation after each generation. Until `min_train` solutions have been simulated,
+    offspring pass through unscreened.
+
+    Use as
+        screen = SurrogateScreening(problem, variator)
+        algorithm = NSGAII(problem, population_size=50, variator=screen.variator, evaluator=screen.evaluator)
+    and read screen.stats() afterwards.
+    '''
+
+    def __init__(self, problem, variator, evaluator=None, oversample=4, min_train=50, max_train=500, model=RBFSurrogate, seed=None):
+        '''
+        Inputs:
+        - problem: Platypus problem, e.g. DamOptimization
+        - variator: variation operator to screen, e.g. the notebook's CompoundOperator of SBX and PM
+        - evaluator: evaluator doing the real simulations, default the Platypus default evaluator
+        - oversample: candidates generated per offspring kept
+        - min_train: real evaluations before screening starts
+        - max_train: most recent real evaluations the surrogate is fit on
+        - model: surrogate class built as model(lower, upper) with fit(X, Y) and predict(X)
+        '''
+        self.problem = problem
+        self.oversample = oversample
+        self.min_train = min_train
+        self.max_train = max_train
+        self.rng = np.random.default_rng(seed)
+        self.model = model([t.min_value for t in problem.types], [t.max_value for t in problem.types])
+        self.variator = _ScreeningVariator(self, variator)
+        self.evaluator = _ScreeningEvaluator(self, evaluator or PlatypusConfig.default_evaluator)
+        self.X = []
+        self.Y = []
+        self.fitted = False
+        self.generated = 0 # candidates produced by the variator
+        self.screened_out = 0 # candidates dropped without a simulation
+        self.errors = [] # |predicted - simulated| of each screened offspring
+
+    def screen(self, parents, variator):
+        offspring = variator.evolve(parents)
+        self.generated += len(offspring)
+        if not self.fitted or self.oversample <= 1:
+            return offspring
+        candidates = list(offspring)
+        for _ in range(self.oversample - 1):
+            candidates.extend(variator.evolve(parents))
+        self.generated += len(candidates) - len(offspring)
+
+        predicted = self.model.predict(decode_variables(candidates))
+        rank = _pareto_rank(predicted)
+        score = ((predicted - predicted.mean(axis=0)) / (predicted.std(axis=0) + 1e-12)).sum(axis=1)
+        order = np.lexsort((self.rng.random(len(candidates)), score, rank))
+        chosen = [candidates[i] for i in order[:len(offspring)]]
+        for i, s in zip(order, chosen):
+            s.surrogate_prediction = predicted[i]
+        self.screened_out += len(candidates) - len(chosen)
+        return chosen
+
+    def observe(self, solutions):
+        # Record real evaluations, the prediction error of screened ones, and refit
+        solutions = [s for s in solutions if s.evaluated]
+        if not solutions:
+            return
+        X = decode_variables(solutions)
+        for x, s in zip(X, solutions):
+            prediction = getattr(s, 'surrogate_prediction', None)
+            if prediction is not None:
+                self.errors.append(np.abs(prediction - np.asarray(s.objectives[:], dtype=float)))
+                s.surrogate_prediction = None
+            self.X.append(x)
+            self.Y.append(np.asarray(s.objectives[:], dtype=float))
+        self.X = self.X[-self.max_train:]
+        self.Y = self.Y[-self.max_train:]
+        if len(self.X) >= self.min_train:
+            self.model.fit(np.array(self.X), np.array(self.Y))
+            self.fitted = True
+
+    def stats(self):
+        '''
+        Returns dict with the number of candidates generated, screened out and simulated, the fraction
+        of simulations saved, and the mean absolute prediction error of each objective.
+        '''
+        errors = np.array(self.errors) if self.errors else np.full((0, self.problem.nobjs), np.nan)
+        return {'generated': self.generated, 'screened_out': self.screened_out,
+                'simulated': self.generated - self.screened_out,
+                'fraction_saved': self.screened_out / self.generated if self.generated else 0.0,
+                'mean_abs_error': errors.mean(axis=0) if len(errors) else np.full(self.problem.nobjs, np.nan),
+                'training_size': len(self.X)}
@@ -0,0 +1,131 @@
+import calendar
+import numpy as np
+import pandas as pd
+from year_index import YearIndex
+
+# Synthetic daily streamflow ensembles for robustness evaluation.
+# Both generators draw the same historical year (or month) for every site at once, so the
+# inter-site correlation of the record is kept. All members are generated in one batch of array
+# operations. Years are handled as 365 days; Feb 29 of a synthetic leap year repeats Feb 28.
+#
+# - kirsch_nowak: monthly flows are bootstrapped in standardized log space, month by month, then
+#   correlated again with the Cholesky factor of the historical month-to-month correlation, including
+#   across the December/January boundary (Kirsch et al. 2013). Monthly totals are split into days
+#   with the daily pattern of a nearby historical month (Nowak et al. 2010).
+# - bootstrap_years: whole historical years in random order.
+
+NOLEAP_MONTH = pd.date_range('2001-01-01', periods=365).month.values - 1 # month of each day of a 365-day year
+MONTH_STARTS = np.flatnonzero(np.r_[True, NOLEAP_MONTH[1:] != NOLEAP_MONTH[:-1]])
+
+def _noleap_years(dates, flows):
+    # Complete calendar years of the record as (S, Y, 365), Feb 29 dropped
+    dates = pd.DatetimeIndex(dates)
+    years = YearIndex(dates)
+    length = np.array([366 if calendar.isleap(y) else 365 for y in years.labels])
+    full = (years.counts == length) & (dates[years.offsets].dayofyear == 1)
+    if not full.any():
+        raise ValueError('record has no complete calendar year')
+    in_full = np.repeat(full, years.counts)
+    keep = in_full & ~((dates.month == 2) & (dates.day == 29))
+    return flows[:, keep].reshape(flows.shape[0], full.sum(), 365)
+
+def _calendar(n_years, start_year):
+    # Synthetic dates and, for each date, its (year, day of the 365-day year)
+    dates = pd.date_range('%d-01-01' % start_year, '%d-12-31' % (start_year + n_years - 1), freq='D')
+    doy = dates.dayofyear.values - 1
+    doy = doy - (dates.is_leap_year & (doy >= 59)) # Feb 29 repeats Feb 28
+    return dates, dates.year.values - start_year, doy
+
+def _cholesky(corr):
+    # Upper Cholesky factor, after clipping negative eigenvalues when the sample correlation is not positive definite
+    try:
+        return np.linalg.cholesky(corr).T
+    except np.linalg.LinAlgError:
+        w, v = np.linalg.eigh(corr)
+        fixed = (v * np.maximum(w, 1e-8)) @ v.T
+        d = np.sqrt(np.diag(fixed))
+        return np.linalg.cholesky(fixed / np.outer(d, d)).T
+
+def bootstrap_years(dates, flows, n_members, n_years, seed=None, start_year=2001):
+    '''
+    Year-block bootstrap ensemble.
+    Inputs:
+    - dates: dates of the historical record
+    - flows: historical daily flows of every site, shape (S, T)
+    - n_members, n_years: ensemble size and length of each member (years)
+    - seed: seed of the random generator
+    - start_year: first year of the synthetic dates
+    Returns (dates, flows) with flows of shape (N, S, T).
+    '''
+    rng = np.random.default_rng(seed)
+    Q = _noleap_years(dates, np.asarray(flows, dtype=float))
+    draw = rng.integers(0, Q.shape[1], (n_members, n_years))
+    out_dates, year, doy = _calendar(n_years, start_year)
+    return out_dates, Q[:, draw[:, year], doy].transpose(1, 0, 2)
+
+def kirsch_nowak(dates, flows, n_members, n_years, seed=None, start_year=2001):
+    '''
+    Kirsch-Nowak ensemble: new monthly sequences with the historical seasonality, month-to-month
+    and inter-site correlation, disaggregated to days with historical daily patterns.
+    Inputs and return are the same as bootstrap_years. Sites that are zero over the whole record stay zero.
+    '''
+    rng = np.random.default_rng(seed)
+    Q = _noleap_years(dates, np.asarray(flows, dtype=float))
+    S, Yh, _ = Q.shape
+    M = np.add.reduceat(Q, MONTH_STARTS, axis=-1) # historical monthly totals (S, Yh, 12)
+
+    # Standardized log monthly flows of each site
+    logM = np.log1p(np.maximum(M, 0))
+    mu = logM.mean(axis=1, keepdims=True)
+    sd = logM.std(axis=1, ddof=1, keepdims=True)
+    sd[sd == 0] = 1
+    Z = (logM - mu) / sd
+    Z_shift = np.concatenate([Z[:, :-1, 6:], Z[:, 1:, :6]], axis=2) # July to June years
+    U = np.array([_cholesky(np.corrcoef(Z[s], rowvar=False)) if M[s].any() else np.eye(12) for s in range(S)])
+    U_shift = np.array([_cholesky(np.corrcoef(Z_shift[s], rowvar=False)) if M[s].any() else np.eye(12) for s in range(S)])
+
+    # Kirsch: bootstrap each month independently (same historical year at every site), then correlate
+    draw = rng.integers(0, Yh, (n_members, n_years + 1, 12))
+    C = Z[:, draw, np.arange(12)] # (S, N, Y+1, 12)
+    C_shift = np.concatenate([C[:, :, :-1, 6:], C[:, :, 1:, :6]], axis=3)
+    Zc = np.matmul(C, U[:, None])
+    Zc_shift = np.matmul(C_shift, U_shift[:, None])
+    # January-June from the shifted years keeps the December/January correlation
+    Z_syn = np.concatenate([Zc_shift[:, :, :, 6:], Zc[:, :, 1:, 6:]], axis=3) # (S, N, Y, 12)
+    M_syn = np.maximum(np.expm1(Z_syn * sd[:, None] + mu[:, None]), 0)
+
+    # Nowak: daily pattern of one of the K historical months closest in total flow over all sites
+    K = max(1, int(round(np.sqrt(Yh))))
+    weights = 1 / np.arange(1, K + 1)
+    distance = np.abs(M_syn.sum(axis=0)[..., None] - M.sum(axis=0).T[None, None]) # (N, Y, 12, Yh)
+    nearest = np.argsort(distance, axis=-1)[..., :K]
+    rank = rng.choice(K, size=nearest.shape[:-1], p=weights / weights.sum())
+    k = np.take_along_axis(nearest, rank[..., None], axis=-1)[..., 0] # (N, Y, 12)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pattern = np.where(M[..., NOLEAP_MONTH] > 0, Q / M[..., NOLEAP_MONTH], 0) # (S, Yh, 365)
+
+    out_dates, year, doy = _calendar(n_years, start_year)
+    month = NOLEAP_MONTH[doy]
+    out = M_syn[:, :, year, month] * pattern[:, k[:, year, month], doy]
+    return out_dates, out.transpose(1, 0, 2)
+
+def cascade_ensemble(cascade, n_members, n_years=None, method='kirsch_nowak', seed=None, start_year=2001):
+    '''
+    Synthetic inputs for a RiverCascade, generated from its own inflow and tributary record.
+    Inputs:
+    - cascade: RiverCascade with the historical record
+    - n_members: number of members
+    - n_years: years per member, default the number of complete years in the record
+    - method: 'kirsch_nowak' or 'bootstrap_years'
+    Returns (dates, inflow, tributaries) with inflow of shape (N, T) and tributaries (N, D, T),
+    ready for RiverCascade.evaluate_ensemble.
+    '''
+    generate = {'kirsch_nowak': kirsch_nowak, 'bootstrap_years': bootstrap_years}[method]
+    sites = np.vstack([cascade.inflow[None], cascade.tributaries])
+    active = np.flatnonzero(np.any(sites != 0, axis=1))
+    if n_years is None:
+        n_years = _noleap_years(cascade.dates, sites[:1]).shape[1]
+    dates, flows = generate(cascade.dates, sites[active], n_members, n_years, seed, start_year)
+    out = np.zeros((n_members, len(sites), len(dates)))
+    out[:, active] = flows
+    return dates, out[:, 0], out[:, 1:]
@@ -0,0 +1,72 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The models are flat modules at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Reservoir4 import Reservoir
+from river_cascade import RiverCascade
+
+# The four dams of "optimize in series.ipynb" on a synthetic five-year record shaped like the observed one
+# (spring freshet at Lower Granite, tributaries entering at Lower Monumental and Ice Harbor), so the tests
+# need neither the CSVs nor the streamflow store.
+
+NAMES = ['LGR', 'LGS', 'LMN', 'ICH']
+INITIAL_HEIGHTS = np.array([670, 570, 470, 370]) * 0.3046 # m
+HIST_MIN = np.array([475.0, 481.0, 482.0, 462.0]) # m^3/s, close to the pre-dam minimums of the record
+
+# Bounds of the DamOptimization decision variables: mef, h1, m and keep of every dam
+LOWER = np.array([0] * 4 + [636 * 0.3046, 539 * 0.3046, 439 * 0.3046, 339 * 0.3046] + [500] * 4 + [0] * 4, dtype=float)
+UPPER = np.array([10_000 * 0.3046**3] * 4 + [746.5 * 0.3046, 646.5 * 0.3046, 548.3 * 0.3046, 446.4 * 0.3046] + [5000] * 4 + [1] * 4)
+
+def make_reservoirs():
+    return [Reservoir(SA=8900*4047, capacity=810000, tail_elev=636, pool_elev=746.5, bottom_elev=590, fish_pass=1, pc=130_000, spillway_cap=850_000, alfa=2.2, beta=4.9),
+            Reservoir(SA=10025*4047, capacity=903000, tail_elev=539, pool_elev=646.5, bottom_elev=500, fish_pass=0.9775, pc=130_000, spillway_cap=850_000, alfa=2.2, beta=4.9),
+            Reservoir(SA=6590*4047, capacity=810000, tail_elev=439, pool_elev=548.3, bottom_elev=406, fish_pass=0.965, pc=130_000, spillway_cap=850_000, alfa=2.2, beta=4.9),
+            Reservoir(SA=9200*4047, capacity=603000, tail_elev=339, pool_elev=446, bottom_elev=310, fish_pass=0.965, pc=106_000, spillway_cap=850_000, alfa=2.2, beta=4.9)]
+
+def make_record(start='1995-01-01', end='1999-12-31', seed=0):
+    # (dates, inflow, tributaries) of daily flows (m^3/s), tributaries of shape (4, T)
+    rng = np.random.default_rng(seed)
+    dates = np.arange(np.datetime64(start), np.datetime64(end) + 1)
+    day = (dates - dates.astype('datetime64[Y]')).astype(int)
+    year = dates.astype('datetime64[Y]').astype(int)
+    freshet = np.exp(-((day - 140) / 35.0) ** 2)
+    wetness = rng.lognormal(0, 0.3, year.max() - year.min() + 1)[year - year.min()]
+    inflow = (750 + 3000 * wetness * freshet) * rng.lognormal(0, 0.1, len(dates))
+    tributaries = np.zeros((4, len(dates)))
+    tributaries[2] = (30 + 400 * wetness * freshet) * rng.lognormal(0, 0.2, len(dates))
+    tributaries[3] = 20 * wetness * freshet * rng.lognormal(0, 0.2, len(dates))
+    return dates, inflow, tributaries
+
+def make_cascade(record, **kwargs):
+    # RiverCascade of the four dams on a record, kwargs passed on
+    dates, inflow, tributaries = record
+    return RiverCascade(NAMES, make_reservoirs(), INITIAL_HEIGHTS, inflow, tributaries, dates, HIST_MIN, **kwargs)
+
+@pytest.fixture(scope='session')
+def record():
+    return make_record()
+
+@pytest.fixture(scope='session')
+def cascade(record):
+    return make_cascade(record)
+
+@pytest.fixture
+def reservoirs():
+    # Fresh reservoirs, free to be changed by the test
+    return make_reservoirs()
+
+@pytest.fixture(scope='session')
+def policies():
+    # Fixed decision vectors: every dam kept, every dam removed, and random policies with mixed keep
+    rng = np.random.default_rng(4200)
+    mid = (LOWER + UPPER) / 2
+    out = [np.r_[mid[:12], 1, 1, 1, 1], np.r_[mid[:12], 0, 0, 0, 0]]
+    for _ in range(4):
+        v = LOWER + rng.random(16) * (UPPER - LOWER)
+        v[12:] = np.round(v[12:])
+        out.append(v)
+    return out
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from cascade_stream import CascadeStream, iter_chunks
+from fish_passage import FishPassage
+from conftest import make_cascade
+
+# Chunk sizes: one step, a size that does not divide the record or a year, and more than the whole record
+CHUNKS = [1, 97, 10_000]
+
+def chunks(cascade, size):
+    return iter_chunks(cascade.dates, cascade.inflow, cascade.tributaries, size)
+
+@pytest.mark.parametrize('size', CHUNKS)
+def test_evaluate_matches_cascade(cascade, policies, size):
+    stream = CascadeStream.from_cascade(cascade)
+    for v in policies:
+        num_below_min, total_hydro = stream.evaluate(v, chunks(cascade, size))
+        expected = cascade.evaluate(v)
+        assert num_below_min == expected[0]
+        np.testing.assert_allclose(total_hydro, expected[1], rtol=1e-12)
+
+@pytest.mark.parametrize('size', CHUNKS)
+def test_simulate_matches_cascade(cascade, policies, size):
+    D = len(cascade.reservoirs)
+    stream = CascadeStream.from_cascade(cascade)
+    v = policies[2]
+    expected = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+    results = list(stream.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:], chunks(cascade, size)))
+    assert len(results) == -(-len(cascade.inflow) // size)
+    for field in ('outflow', 'height', 'hydro'):
+        trajectory = np.concatenate([getattr(r, field) for r in results], axis=1)
+        assert np.array_equal(trajectory, getattr(expected, field), equal_nan=True)
+
+@pytest.mark.parametrize('size', CHUNKS)
+def test_water_years_span_chunks(record, size):
+    # October years start inside a chunk and end in a later one
+    cascade = make_cascade(record, year_start_month=10)
+    D = len(cascade.reservoirs)
+    stream = CascadeStream.from_cascade(cascade)
+    v = np.r_[[300.0] * 4, cascade.initial_heights + 5, [2000.0] * 4, [1, 1, 0, 1]]
+    years = list(stream.annual(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:], chunks(cascade, size)))
+    result = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+    annual_min, annual_hydro = cascade.annual_min(result.outflow), cascade.annual_sum(result.hydro)
+    assert [year for year, _, _, _, _ in years] == list(cascade.years.labels)
+    np.testing.assert_allclose(np.array([hydro for _, hydro, _, _, _ in years]).T, annual_hydro, rtol=1e-12)
+    np.testing.assert_array_equal(np.array([low for _, _, low, _, _ in years]).T, annual_min)
+    assert np.isnan([survival for _, _, _, _, survival in years]).all()
+    assert stream.evaluate(v, chunks(cascade, size)) == pytest.approx(cascade.evaluate(v), rel=1e-12)
+
+@pytest.mark.parametrize('size', CHUNKS)
+@pytest.mark.parametrize('year_start_month', [1, 10])
+def test_fish_survival_matches_cascade(record, policies, size, year_start_month):
+    # The fish model is carried over from the cascade and the stream gives its third objective
+    cascade = make_cascade(record, fish_passage=FishPassage(), year_start_month=year_start_month)
+    D = len(cascade.reservoirs)
+    stream = CascadeStream.from_cascade(cascade)
+    for v in policies:
+        objectives = stream.evaluate(v, chunks(cascade, size))
+        expected = cascade.evaluate(v)
+        assert len(objectives) == 3
+        assert objectives[0] == expected[0]
+        np.testing.assert_allclose(objectives[1:], expected[1:], rtol=1e-12)
+
+        # Each year's survival is FishPassage.annual_survival of the whole trajectories
+        result = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+        survival = [s for _, _, _, _, s in stream.annual(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:], chunks(cascade, size))]
+        np.testing.assert_allclose(survival, cascade.fish_passage.annual_survival(cascade, result.outflow, result.height, v[3*D:]),
+                                   rtol=1e-12)
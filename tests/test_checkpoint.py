@@ -0,0 +1,50 @@
+import os
+import random
+import pytest
+from platypus import NSGAII, SBX, PM, CompoundOperator
+from checkpoint import load_checkpoint, run_with_checkpoints
+from dam_optimization import DamOptimization
+
+# A small NSGA-II run of DamOptimization: 12 solutions, a checkpoint every 24 evaluations
+POPULATION = 12
+EVALUATIONS = 120
+FREQUENCY = 24
+SEED = 11
+
+class Interrupted(Exception):
+    pass
+
+def make_algorithm(cascade):
+    # Built like batch_run.run_job
+    problem = DamOptimization(cascade)
+    variator = CompoundOperator(*[op for _ in range(problem.nvars) for op in (SBX(), PM())])
+    return NSGAII(problem, population_size=POPULATION, variator=variator)
+
+def interrupt_at(nfe):
+    def callback(algorithm):
+        if algorithm.nfe >= nfe:
+            raise Interrupted()
+    return callback
+
+def state(algorithm):
+    return algorithm.nfe, [(s.variables[:], s.objectives[:]) for s in algorithm.population]
+
+def test_resumed_run_matches_uninterrupted(cascade, tmp_path):
+    random.seed(SEED)
+    expected = state(run_with_checkpoints(make_algorithm(cascade), EVALUATIONS, str(tmp_path / 'whole.npz'), FREQUENCY))
+    assert expected[0] == EVALUATIONS
+
+    # Interrupted between two checkpoints, then resumed from the npz by a new algorithm and a reseeded generator
+    path = str(tmp_path / 'interrupted.npz')
+    random.seed(SEED)
+    with pytest.raises(Interrupted):
+        run_with_checkpoints(make_algorithm(cascade), EVALUATIONS, path, FREQUENCY, callback=interrupt_at(80))
+    assert os.path.exists(path)
+    assert load_checkpoint(path, DamOptimization(cascade))['nfe'] == 72 # the evaluations after it are redone
+
+    random.seed(SEED + 1) # the checkpoint restores the generator
+    resumed = run_with_checkpoints(make_algorithm(cascade), EVALUATIONS, path, FREQUENCY)
+    assert state(resumed) == expected
+
+    # Calling it again on a finished checkpoint does no more evaluations
+    assert state(run_with_checkpoints(make_algorithm(cascade), EVALUATIONS, path, FREQUENCY)) == expected
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from evaluation_cache import EvaluationCache, canonical_variables, model_fingerprint
+from fish_passage import FishPassage
+from power_table import typical_kaplan_table
+from conftest import make_cascade
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = EvaluationCache(str(tmp_path / 'evaluations.sqlite'))
+    yield cache
+    cache.close()
+
+def stored(cache, cascade, policies):
+    # Store the objectives of the policies under the cascade's fingerprint
+    fingerprint = model_fingerprint(cascade)
+    variables = canonical_variables(policies)
+    objectives = [cascade.evaluate(v) for v in policies]
+    cache.put(fingerprint, variables, objectives)
+    return fingerprint, variables, objectives
+
+def test_hit_returns_stored_objectives(record, cache, policies):
+    cascade = make_cascade(record)
+    fingerprint, variables, objectives = stored(cache, cascade, policies)
+    found = cache.get(fingerprint, variables)
+    for obj, expected in zip(found, objectives):
+        np.testing.assert_array_equal(obj, expected)
+    assert cache.stats()['hits'] == len(policies)
+
+    # Release parameters of removed dams don't change the key, other vectors miss
+    v = policies[1].copy()
+    v[:12] += 1
+    assert cache.get(fingerprint, canonical_variables(v))[0] is not None
+    v = policies[0].copy()
+    v[:4] += 1
+    assert cache.get(fingerprint, canonical_variables(v))[0] is None
+
+@pytest.mark.parametrize('change', ['params', 'power_table', 'fish_passage'])
+def test_model_change_misses(record, cache, policies, change):
+    cascade = make_cascade(record)
+    fingerprint, variables, _ = stored(cache, cascade, policies)
+    if change == 'params':
+        cascade.reservoirs[2].set_params(2.3, 4.9)
+    elif change == 'power_table':
+        cascade.reservoirs[0].set_power_table(typical_kaplan_table(cascade.reservoirs[0]))
+    else:
+        cascade = make_cascade(record, fish_passage=FishPassage())
+    changed = model_fingerprint(cascade)
+    assert changed != fingerprint
+    assert cache.get(changed, variables) == [None] * len(policies)
+
+def test_fish_model_settings_change_fingerprint(record):
+    with_fish = model_fingerprint(make_cascade(record, fish_passage=FishPassage()))
+    assert model_fingerprint(make_cascade(record, fish_passage=FishPassage())) == with_fish
+    assert model_fingerprint(make_cascade(record, fish_passage=FishPassage(turbine_survival=0.9))) != with_fish
+    assert model_fingerprint(make_cascade(record, fish_passage=FishPassage(monthly_weights=np.ones(12)))) != with_fish
+
+def test_reopened_file_keeps_entries(record, tmp_path, policies):
+    path = str(tmp_path / 'evaluations.sqlite')
+    cascade = make_cascade(record)
+    cache = EvaluationCache(path)
+    fingerprint, variables, objectives = stored(cache, cascade, policies)
+    nbytes = cache.stats()['nbytes']
+    cache.close()
+
+    reopened = EvaluationCache(path)
+    try:
+        stats = reopened.stats()
+        assert (stats['entries'], stats['nbytes']) == (len(policies), nbytes)
+        for obj, expected in zip(reopened.get(fingerprint, variables), objectives):
+            np.testing.assert_array_equal(obj, expected)
+    finally:
+        reopened.close()
@@ -0,0 +1,108 @@
+import importlib.util
+import sys
+import numpy as np
+import pytest
+import reservoir_kernels as kernels
+import river_cascade
+from conftest import INITIAL_HEIGHTS
+
+# The compiled kernels against the pure-python backend: Reservoir's own loops for the lake models, and a
+# second copy of reservoir_kernels with BACKEND = 'python' for the cascade kernels.
+
+RTOL = 1e-9
+
+needs_numba = pytest.mark.skipif(importlib.util.find_spec('numba') is None, reason='numba is not installed')
+
+@pytest.fixture(scope='module')
+def python_kernels():
+    # Fresh reservoir_kernels module, loaded as if numba were not installed
+    spec = importlib.util.spec_from_file_location('reservoir_kernels_python', kernels.__file__)
+    module = importlib.util.module_from_spec(spec)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setitem(sys.modules, 'numba', None)
+        spec.loader.exec_module(module)
+    module.BACKEND = 'python'
+    return module
+
+@pytest.fixture
+def net_inflow(record):
+    # Lower Granite inflow of the record, with a dry spell so the low-level branches are taken
+    n = record[1].copy()
+    n[400:500] = 5.0
+    return n
+
+def run_backends(reservoir, method, *args):
+    # Same Reservoir call on the python loops and on the compiled kernels
+    backend = reservoir.backend
+    try:
+        reservoir.backend = 'python'
+        expected = getattr(reservoir, method)(*args)
+        reservoir.backend = 'numba'
+        actual = getattr(reservoir, method)(*args)
+    finally:
+        reservoir.backend = backend
+    return expected, actual
+
+@needs_numba
+def test_reg_lake(reservoirs, net_inflow):
+    for res, h_in in zip(reservoirs, INITIAL_HEIGHTS):
+        for param in ({'mef': 100.0, 'h1': res.tail_elev + 20, 'm': 800.0}, {'mef': 2000.0, 'h1': res.pool_elev, 'm': 4000.0}):
+            expected, actual = run_backends(res, 'simulation_reg_lake', 1, param, h_in, net_inflow)
+            for a, b in zip(expected, actual):
+                np.testing.assert_allclose(b, a, rtol=RTOL)
+
+@needs_numba
+def test_nat_lake(reservoirs, net_inflow):
+    for res, h_in in zip(reservoirs, INITIAL_HEIGHTS):
+        expected, actual = run_backends(res, 'simulation_nat_lake', 1, h_in, net_inflow)
+        for a, b in zip(expected, actual):
+            np.testing.assert_allclose(b, a, rtol=RTOL)
+
+@needs_numba
+def test_reg_lake_batch(reservoirs, net_inflow):
+    res = reservoirs[1]
+    rng = np.random.default_rng(0)
+    P = 8
+    mef = rng.uniform(0, 2000, P)
+    h1 = rng.uniform(res.tail_elev, res.pool_elev, P)
+    m = rng.uniform(50, 500, P) # releases that settle, see Reservoir.simulation_reg_lake_batch
+    keep = np.r_[np.ones(P - 2), 0, 1]
+    expected, actual = run_backends(res, 'simulation_reg_lake_batch', keep, mef, h1, m, INITIAL_HEIGHTS[1], net_inflow)
+    for a, b in zip(expected, actual):
+        np.testing.assert_allclose(b, a, rtol=RTOL)
+
+    # The batch gives the trajectories of one simulation_reg_lake per candidate
+    for p in range(P):
+        s, h, r = res.simulation_reg_lake(keep[p], {'mef': mef[p], 'h1': h1[p], 'm': m[p]}, INITIAL_HEIGHTS[1], net_inflow)
+        np.testing.assert_allclose(actual[1][p], h, rtol=RTOL)
+        np.testing.assert_allclose(actual[2][p], r, rtol=RTOL)
+
+@needs_numba
+def test_cascade(cascade, policies, python_kernels, monkeypatch):
+    D = len(cascade.reservoirs)
+    compiled = [cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:]) for v in policies]
+    monkeypatch.setattr(river_cascade, 'kernels', python_kernels)
+    for v, result in zip(policies, compiled):
+        expected = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+        np.testing.assert_allclose(result.outflow, expected.outflow, rtol=RTOL)
+        np.testing.assert_allclose(result.height, expected.height, rtol=RTOL)
+        np.testing.assert_allclose(result.avg_hydro, expected.avg_hydro, rtol=RTOL)
+
+@needs_numba
+def test_cascade_objectives(cascade, policies, python_kernels, monkeypatch):
+    D = len(cascade.reservoirs)
+    compiled = [cascade.annual_objectives(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:]) for v in policies]
+    monkeypatch.setattr(river_cascade, 'kernels', python_kernels)
+    for v, objectives in zip(policies, compiled):
+        for a, b in zip(cascade.annual_objectives(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:]), objectives):
+            np.testing.assert_allclose(b, a, rtol=RTOL)
+
+def test_python_backend(cascade, policies, python_kernels, monkeypatch):
+    # The python backend on its own, without numba: annual_objectives reduces the trajectories of simulate
+    D = len(cascade.reservoirs)
+    monkeypatch.setattr(river_cascade, 'kernels', python_kernels)
+    v = policies[2]
+    result = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+    annual_min, annual_hydro = cascade.annual_objectives(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])[:2]
+    np.testing.assert_allclose(annual_min, cascade.annual_min(result.outflow), rtol=RTOL)
+    np.testing.assert_allclose(annual_hydro, cascade.annual_sum(result.hydro), rtol=RTOL)
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from prefix_cache import PrefixCache
+from conftest import make_cascade
+
+@pytest.fixture
+def cached_cascade(record):
+    # Same dams and record as the cascade fixture, with a prefix cache
+    return make_cascade(record, cache=PrefixCache())
+
+def entry(n):
+    # (outflow, height) pair of n steps
+    return np.zeros(n), np.zeros(n)
+
+def test_cached_matches_uncached(cascade, cached_cascade, policies):
+    D = len(cascade.reservoirs)
+    for v in policies + policies: # the second pass answers from the cache
+        expected = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+        result = cached_cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+        assert np.array_equal(result.outflow, expected.outflow, equal_nan=True)
+        assert np.array_equal(result.height, expected.height, equal_nan=True)
+        num_below_min, total_hydro = cached_cascade.evaluate(v)
+        assert num_below_min == cascade.evaluate(v)[0]
+        np.testing.assert_allclose(total_hydro, cascade.evaluate(v)[1], rtol=1e-9)
+    assert cached_cascade.cache.hits > 0
+
+def test_downstream_change_reuses_prefix(cascade, cached_cascade, policies):
+    D = len(cascade.reservoirs)
+    v = policies[0].copy()
+    cached_cascade.evaluate(v)
+    hits = cached_cascade.cache.hits
+    v[D - 1] += 50 # mef of the last dam
+    cached_cascade.evaluate(v)
+    assert cached_cascade.cache.hits - hits == D - 1
+    expected = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+    result = cached_cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+    assert np.array_equal(result.outflow, expected.outflow, equal_nan=True)
+
+def test_removed_dam_ignores_release_parameters():
+    cache = PrefixCache()
+    assert cache.dam_key(100, 200, 300, 0, 2.2, 4.9) == cache.dam_key(1, 2, 3, 0, 2.2, 4.9)
+    assert cache.dam_key(100, 200, 300, 1, 2.2, 4.9) != cache.dam_key(1, 2, 3, 1, 2.2, 4.9)
+
+def test_lru_eviction():
+    size = 2 * 8 * 10 # one entry of 10 steps
+    cache = PrefixCache(max_bytes=3 * size)
+    for k in 'abc':
+        cache.put(k, *entry(10))
+    assert cache.get('a') is not None # a is now the most recently used
+    cache.put('d', *entry(10))
+    assert cache.get('b') is None
+    assert [cache.get(k) is not None for k in 'acd'] == [True, True, True]
+    assert cache.stats()['evictions'] == 1
+    assert cache.nbytes == 3 * size
+
+    # An entry larger than the whole cache is not stored and evicts nothing
+    cache.put('e', *entry(100))
+    assert cache.get('e') is None
+    assert len(cache.entries) == 3
+
+def test_evicted_entries_are_recomputed(record, cascade, policies):
+    # A cache that only holds a few dams' trajectories still gives the uncached results
+    D = len(cascade.reservoirs)
+    T = len(cascade.inflow)
+    cached = make_cascade(record, cache=PrefixCache(max_bytes=3 * 2 * 8 * T))
+    for v in policies + policies[::-1]:
+        expected = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+        result = cached.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+        assert np.array_equal(result.outflow, expected.outflow, equal_nan=True)
+        assert np.array_equal(result.height, expected.height, equal_nan=True)
+    stats = cached.cache.stats()
+    assert stats['evictions'] > 0
+    assert stats['nbytes'] <= stats['max_bytes']
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from platypus import Solution
+from dam_optimization import DamOptimization, decode_variables
+from result_store import FIELDS, ResultStore, save_solutions
+
+# Small chunks, so reads cross solution and step chunk edges: 3 solution chunks of 3, 3 and 1 solutions,
+# and 19 step chunks of 100 steps, the last one partial
+CHUNK_SOLUTIONS = 3
+CHUNK_STEPS = 100
+
+@pytest.fixture(scope='module')
+def solutions(cascade, policies):
+    problem = DamOptimization(cascade)
+    out = []
+    for v in policies + [np.r_[policies[2][:12], 1, 0, 1, 0]]:
+        s = Solution(problem)
+        s.variables[:] = [t.encode(x) for t, x in zip(problem.types, v)]
+        s.evaluate()
+        out.append(s)
+    return out
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory, cascade, solutions):
+    path = str(tmp_path_factory.mktemp('store'))
+    save_solutions(path, cascade, solutions, batch=2, chunk_solutions=CHUNK_SOLUTIONS, chunk_steps=CHUNK_STEPS)
+    return ResultStore(path)
+
+@pytest.fixture(scope='module')
+def simulated(cascade, solutions):
+    # CascadeResult of every solution
+    D = len(cascade.reservoirs)
+    return [cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:]) for v in decode_variables(solutions)]
+
+def expected(simulated, field, d, rows, steps=slice(None)):
+    return np.array([getattr(simulated[i], field)[d, steps] for i in np.atleast_1d(rows)])
+
+@pytest.mark.parametrize('field', FIELDS)
+def test_read_matches_simulate(store, simulated, field):
+    N = len(simulated)
+    assert len(store) == N
+    selections = [None, slice(2, 5), slice(1, None, 2), [6, 0, 4, 3], np.array([-1, -4]), np.arange(N) % 3 == 1]
+    for d, name in enumerate(store.names):
+        for solutions in selections:
+            rows = np.arange(N)[slice(None) if solutions is None else solutions]
+            np.testing.assert_array_equal(store.read(field, name, solutions), expected(simulated, field, d, rows))
+        # A single solution, negative indices included, gives one trajectory
+        np.testing.assert_array_equal(store.read(field, name, -2), getattr(simulated[-2], field)[d])
+        np.testing.assert_array_equal(store.read(field, name, 4), getattr(simulated[4], field)[d])
+
+def test_read_date_windows(store, simulated):
+    dates = store.dates
+    # Windows inside one step chunk, across chunk edges and up to the partial last chunk
+    for start, end in [(0, 10), (95, 105), (250, 1020), (1799, len(dates) - 1), (0, len(dates) - 1)]:
+        steps = slice(start, end + 1)
+        for solutions in (slice(2, 7), [5, 1]):
+            rows = np.arange(len(simulated))[solutions]
+            actual = store.read('height', 'LMN', solutions, str(dates[start].astype('datetime64[D]')), str(dates[end].astype('datetime64[D]')))
+            np.testing.assert_array_equal(actual, expected(simulated, 'height', 2, rows, steps))
+    # Windows bounded at one end only
+    np.testing.assert_array_equal(store.read('outflow', 'ICH', 3, start='1998-01-01'), simulated[3].outflow[3, store.window('1998-01-01').start:])
+    assert store.read('outflow', 'ICH', [1, 2], end='1995-03-31').shape == (2, 90)
+
+def test_result_matches_simulate(store, simulated, solutions):
+    for i, sim in enumerate(simulated):
+        result = store.result(i)
+        for field in FIELDS:
+            np.testing.assert_array_equal(getattr(result, field), getattr(sim, field))
+        np.testing.assert_array_equal(result.avg_hydro, sim.avg_hydro)
+    # Objectives are stored with their sign, hydropower maximized
+    np.testing.assert_array_equal(store.objectives[:, 0], [s.objectives[0] for s in solutions])
+    np.testing.assert_array_equal(store.objectives[:, 1], [-s.objectives[1] for s in solutions])
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+import instrumentation
+from fish_passage import FishPassage
+from prefix_cache import PrefixCache
+from river_cascade import RiverCascade
+from conftest import make_cascade, make_reservoirs
+
+# RiverCascade against the per-reservoir chain of the notebooks: each dam simulated on its own with
+# Reservoir.simulate, its outflow plus the next tributary feeding the dam below.
+
+def chain(cascade, v):
+    # Outflow, height and average annual hydropower of every dam, one Reservoir.simulate at a time
+    D = len(cascade.reservoirs)
+    dates = pd.Series(cascade.dates)
+    outflow, height, avg_hydro = [], [], []
+    upstream = cascade.inflow
+    for d, res in enumerate(make_reservoirs()):
+        param = {'mef': v[d], 'h1': v[D + d], 'm': v[2*D + d]}
+        q, hydro, h = res.simulate(v[3*D + d], cascade.initial_heights[d], param, dates, upstream, cascade.tributaries[d])
+        outflow.append(q)
+        height.append(h)
+        avg_hydro.append(hydro)
+        upstream = q
+    return np.array(outflow), np.array(height), np.array(avg_hydro)
+
+def test_simulate_matches_chain(cascade, policies):
+    D = len(cascade.reservoirs)
+    for v in policies:
+        result = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+        outflow, height, avg_hydro = chain(cascade, v)
+        np.testing.assert_allclose(result.outflow, outflow, rtol=1e-9)
+        np.testing.assert_allclose(result.height, height, rtol=1e-9)
+        np.testing.assert_allclose(result.avg_hydro, avg_hydro, rtol=1e-9)
+
+def test_evaluate_matches_simulate_and_chain(cascade, policies):
+    D = len(cascade.reservoirs)
+    years = pd.DatetimeIndex(cascade.dates).year
+    for v in policies:
+        num_below_min, total_hydro = cascade.evaluate(v)
+
+        result = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+        assert num_below_min == (cascade.annual_min(result.outflow) < cascade.hist_min[:, None]).sum()
+        np.testing.assert_allclose(total_hydro, result.avg_hydro.sum(), rtol=1e-9)
+
+        # Annual minimums of the chain with a pandas groupby, as in the notebooks
+        outflow, _, avg_hydro = chain(cascade, v)
+        annual_min = pd.DataFrame(outflow.T).groupby(years).min().values.T
+        assert num_below_min == (annual_min < cascade.hist_min[:, None]).sum()
+        np.testing.assert_allclose(total_hydro, avg_hydro.sum(), rtol=1e-9)
+
+@pytest.mark.parametrize('year_start_month', [1, 10])
+def test_annual_objectives_match_simulate(record, policies, year_start_month):
+    # The objectives-only kernel gives the annual reductions of the full trajectories, on calendar and water years
+    cascade = make_cascade(record, year_start_month=year_start_month)
+    D = len(cascade.reservoirs)
+    for v in policies:
+        result = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+        annual_min, annual_hydro = cascade.annual_objectives(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])[:2]
+        np.testing.assert_array_equal(annual_min, cascade.annual_min(result.outflow))
+        np.testing.assert_allclose(annual_hydro, cascade.annual_sum(result.hydro), rtol=1e-12)
+
+@pytest.mark.parametrize('year_start_month', [1, 10])
+def test_kernel_fish_survival_matches_simulate(record, policies, year_start_month):
+    # The survival computed in the objectives kernel is FishPassage.annual_survival of the simulated trajectories
+    cascade = make_cascade(record, fish_passage=FishPassage(), year_start_month=year_start_month)
+    D = len(cascade.reservoirs)
+    rng = np.random.default_rng(7)
+    mixed = [np.r_[v[:12], rng.integers(0, 2, D)] for v in policies[2:]] # the random policies with other keep combinations
+    for v in policies + mixed:
+        result = cascade.simulate(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])
+        annual_fish = cascade.annual_objectives(v[:D], v[D:2*D], v[2*D:3*D], v[3*D:])[2]
+        np.testing.assert_allclose(annual_fish, cascade.fish_passage.annual_survival(cascade, result.outflow, result.height, v[3*D:]),
+                                   rtol=1e-12)
+        np.testing.assert_allclose(cascade.evaluate(v)[2], cascade.fish_survival(result, v[3*D:]), rtol=1e-12)
+
+def test_evaluate_ensemble_matches_evaluate(cascade, policies):
+    # Each member of the ensemble evaluates like a cascade on that member's record
+    scale = np.array([0.5, 1.0, 1.5])
+    inflow = cascade.inflow * scale[:, None]
+    tributaries = cascade.tributaries * scale[:, None, None]
+    for v in policies[:3]:
+        num_below_min, total_hydro = cascade.evaluate_ensemble(v, inflow, tributaries)
+        for n in range(len(scale)):
+            member = RiverCascade(cascade.names, cascade.reservoirs, cascade.initial_heights, inflow[n], tributaries[n],
+                                  cascade.dates.values, cascade.hist_min)
+            expected = member.evaluate(v)
+            assert num_below_min[n] == expected[0]
+            np.testing.assert_allclose(total_hydro[n], expected[1], rtol=1e-12)
+
+def test_profiled_evaluate_times_the_objectives_path(record, cascade, policies):
+    # A profiler times the same objectives-only path as production and gives the same objectives
+    with instrumentation.profile() as prof:
+        profiled = [cascade.evaluate(v) for v in policies]
+    assert profiled == [cascade.evaluate(v) for v in policies]
+    stages = {stage for _, stage in prof.totals}
+    assert {'annual_objectives', 'evaluate'} <= stages
+    assert 'kernel' not in stages and 'simulate_hydropower' not in stages
+    assert prof.totals[('cascade', 'evaluate')][0] == len(policies)
+
+    # With a prefix cache evaluate needs the trajectories, and the profile shows them
+    cached = make_cascade(record, cache=PrefixCache())
+    with instrumentation.profile() as prof:
+        assert [cached.evaluate(v)[0] for v in policies] == [objectives[0] for objectives in profiled]
+    stages = {stage for _, stage in prof.totals}
+    assert {'kernel cached', 'years_below_min', 'evaluate'} <= stages
+    assert 'annual_objectives' not in stages
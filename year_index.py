@@ -0,0 +1,48 @@
+import numpy as np
+
+class YearIndex:
+    '''
+    Year segments of a sorted daily date array, built once and reused for every annual aggregation.
+    Annual sums, minimums and maximums run as reduceat over the segment offsets, matching
+    pandas groupby on the year without building a DataFrame.
+    - start_month: 1 for calendar years, 10 for water years starting on October 1.
+      A water year is labeled by the calendar year it ends in.
+    - offsets: index of the first day of each year
+    - labels: year of each segment
+    '''
+
+    def __init__(self, dates, start_month=1):
+        # Calendar year and month straight from datetime64, without pandas
+        dates = np.asarray(dates)
+        if not np.issubdtype(dates.dtype, np.datetime64):
+            dates = dates.astype('datetime64[ns]')
+        self.start_month = start_month
+        years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+        if start_month != 1:
+            years = years + (dates.astype('datetime64[M]').astype(np.int64) % 12 + 1 >= start_month)
+        self.offsets = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+        self.labels = years[self.offsets]
+        self.counts = np.diff(np.r_[self.offsets, len(years)])
+        self.n_days = len(years)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def sum(self, x):
+        # NaN days count as zero, like pandas groupby sum
+        return np.add.reduceat(np.nan_to_num(x), self.offsets, axis=-1)
+
+    def min(self, x):
+        # NaN days are skipped, like pandas groupby min
+        return np.fmin.reduceat(x, self.offsets, axis=-1)
+
+    def max(self, x):
+        # NaN days are skipped, like pandas groupby max
+        return np.fmax.reduceat(x, self.offsets, axis=-1)
+
+    def mean(self, x):
+        # NaN days are skipped, like pandas groupby mean
+        x = np.asarray(x, dtype=float)
+        valid = np.add.reduceat((~np.isnan(x)).astype(float), self.offsets, axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum(x) / valid